@@ -16,9 +16,10 @@
 import base64
 import json
 import logging
+import os
 import re
 import time
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from copy import deepcopy
 from functools import partial
 from typing import Any, Union, Tuple
@@ -32,6 +33,10 @@ from common.exceptions import TaskCanceledException
 from rag.prompts.generator import chunks_format
 from rag.utils.redis_conn import REDIS_CONN
 
+# Shared by every canvas run in the process, instead of a new executor per batch of the path.
+_NODE_EXECUTOR = ThreadPoolExecutor(max_workers=int(os.environ.get("CANVAS_MAX_WORKERS", "32")), thread_name_prefix="canvas")
+
+
 class Graph:
     """
         dsl = {
@@ -230,6 +235,31 @@ class Graph:
         return True
 
 
+class IterationScope(Graph):
+    """
+    A private copy of an Iteration's sub-graph, so that several items can run at the same time.
+
+    Components inside the iteration are cloned and bound to the scope; everything else, including
+    outer components, globals, references and cancellation, is read from the canvas itself.
+    """
+
+    def __init__(self, canvas: Graph, iteration_id: str):
+        self._base = canvas
+        self.components = dict(canvas.components)
+        for cid, cpn in canvas.components.items():
+            if cpn.get("parent_id") != iteration_id:
+                continue
+            obj = cpn["obj"]
+            cpn = {k: v for k, v in cpn.items() if k != "obj"}
+            cpn["obj"] = component_class(obj.component_name)(self, cid, deepcopy(obj._param))
+            self.components[cid] = cpn
+
+    def __getattr__(self, name):
+        if name == "_base":
+            raise AttributeError(name)
+        return getattr(self._base, name)
+
+
 class Canvas(Graph):
 
     def __init__(self, dsl: str, tenant_id=None, task_id=None):
@@ -331,32 +361,6 @@ class Canvas(Graph):
         yield decorate("workflow_started", {"inputs": kwargs.get("inputs")})
         self.retrieval.append({"chunks": {}, "doc_aggs": {}})
 
-        def _run_batch(f, t):
-            if self.is_canceled():
-                msg = f"Task {self.task_id} has been canceled during batch execution."
-                logging.info(msg)
-                raise TaskCanceledException(msg)
-
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                thr = []
-                i = f
-                while i < t:
-                    cpn = self.get_component_obj(self.path[i])
-                    if cpn.component_name.lower() in ["begin", "userfillup"]:
-                        thr.append(executor.submit(cpn.invoke, inputs=kwargs.get("inputs", {})))
-                        i += 1
-                    else:
-                        for _, ele in cpn.get_input_elements().items():
-                            if isinstance(ele, dict) and ele.get("_cpn_id") and ele.get("_cpn_id") not in self.path[:i] and self.path[0].lower().find("userfillup") < 0:
-                                self.path.pop(i)
-                                t -= 1
-                                break
-                        else:
-                            thr.append(executor.submit(cpn.invoke, **cpn.get_input()))
-                            i += 1
-                for t in thr:
-                    t.result()
-
         def _node_finished(cpn_obj):
             return decorate("node_finished",{
                            "inputs": cpn_obj.get_input_values(),
@@ -372,9 +376,51 @@ class Canvas(Graph):
         self.error = ""
         idx = len(self.path) - 1
         partials = []
-        while idx < len(self.path):
-            to = len(self.path)
-            for i in range(idx, to):
+        # Every position of self.path is pending until it's submitted, then running and done, or dropped.
+        state = {i: "done" for i in range(idx)}
+        running = {}
+        deps = {}
+
+        def _deps(cpn_id):
+            if cpn_id not in deps:
+                cpn_obj = self.get_component_obj(cpn_id)
+                refs = set()
+                if cpn_obj.component_name.lower() not in ["begin", "userfillup"]:
+                    refs = {ele["_cpn_id"] for ele in cpn_obj.get_input_elements().values() if isinstance(ele, dict) and ele.get("_cpn_id")}
+                deps[cpn_id] = (refs, set(self.get_component(cpn_id)["upstream"]))
+            return deps[cpn_id]
+
+        def _ready(i):
+            """
+            None if path[i] reads a component which isn't on the path (it will be appended again by that one),
+            False while one of its inputs or upstream components on the path before it hasn't finished.
+            """
+            refs, upstream = _deps(self.path[i])
+            finished = {}
+            for j in range(i):
+                if state.get(j, "pending") != "dropped":
+                    finished[self.path[j]] = finished.get(self.path[j], True) and state.get(j) == "done"
+            if self.path[0].lower().find("userfillup") < 0 and any(c not in finished for c in refs):
+                return None
+            return all(finished.get(c, True) for c in refs | upstream)
+
+        def _pending(cpn_id=None):
+            return [i for i in range(len(self.path)) if state.get(i, "pending") == "pending" and (cpn_id is None or self.path[i] == cpn_id)]
+
+        def _submit():
+            if self.is_canceled():
+                msg = f"Task {self.task_id} has been canceled during execution."
+                logging.info(msg)
+                raise TaskCanceledException(msg)
+
+            for i in _pending():
+                ready = _ready(i)
+                if ready is None:
+                    state[i] = "dropped"
+                    continue
+                if not ready:
+                    continue
+                state[i] = "running"
                 yield decorate("node_started", {
                     "inputs": None, "created_at": int(time.time()),
                     "component_id": self.path[i],
@@ -382,114 +428,131 @@ class Canvas(Graph):
                     "component_type": self.get_component_type(self.path[i]),
                     "thoughts": self.get_component_thoughts(self.path[i])
                 })
-            _run_batch(idx, to)
-            to = len(self.path)
-            # post processing of components invocation
-            for i in range(idx, to):
-                cpn = self.get_component(self.path[i])
-                cpn_obj = self.get_component_obj(self.path[i])
-                if cpn_obj.component_name.lower() == "message":
-                    if isinstance(cpn_obj.output("content"), partial):
-                        _m = ""
-                        for m in cpn_obj.output("content")():
-                            if not m:
-                                continue
-                            if m == "<think>":
-                                yield decorate("message", {"content": "", "start_to_think": True})
-                            elif m == "</think>":
-                                yield decorate("message", {"content": "", "end_to_think": True})
-                            else:
-                                yield decorate("message", {"content": m})
-                                _m += m
-                        cpn_obj.set_output("content", _m)
-                        cite = re.search(r"\[ID:[ 0-9]+\]", _m)
-                    else:
-                        yield decorate("message", {"content": cpn_obj.output("content")})
-                        cite = re.search(r"\[ID:[ 0-9]+\]",  cpn_obj.output("content"))
-
-                    if isinstance(cpn_obj.output("attachment"), tuple):
-                        yield decorate("message", {"attachment": cpn_obj.output("attachment")})
-                        
-                    yield decorate("message_end", {"reference": self.get_reference() if cite else None})
-
-                    while partials:
-                        _cpn_obj = self.get_component_obj(partials[0])
-                        if isinstance(_cpn_obj.output("content"), partial):
-                            break
-                        yield _node_finished(_cpn_obj)
-                        partials.pop(0)
-
-                other_branch = False
-                if cpn_obj.error():
-                    ex = cpn_obj.exception_handler()
-                    if ex and ex["goto"]:
-                        self.path.extend(ex["goto"])
-                        other_branch = True
-                    elif ex and ex["default_value"]:
-                        yield decorate("message", {"content": ex["default_value"]})
-                        yield decorate("message_end", {})
-                    else:
-                        self.error = cpn_obj.error()
-
-                if cpn_obj.component_name.lower() != "iteration":
-                    if isinstance(cpn_obj.output("content"), partial):
-                        if self.error:
-                            cpn_obj.set_output("content", None)
-                            yield _node_finished(cpn_obj)
+                cpn = self.get_component_obj(self.path[i])
+                if cpn.component_name.lower() in ["begin", "userfillup"]:
+                    running[_NODE_EXECUTOR.submit(cpn.invoke, inputs=kwargs.get("inputs", {}))] = i
+                else:
+                    running[_NODE_EXECUTOR.submit(cpn.invoke, **cpn.get_input())] = i
+
+        def _post_process(i):
+            cpn = self.get_component(self.path[i])
+            cpn_obj = self.get_component_obj(self.path[i])
+            if cpn_obj.component_name.lower() == "message":
+                if isinstance(cpn_obj.output("content"), partial):
+                    _m = ""
+                    for m in cpn_obj.output("content")():
+                        if not m:
+                            continue
+                        if m == "<think>":
+                            yield decorate("message", {"content": "", "start_to_think": True})
+                        elif m == "</think>":
+                            yield decorate("message", {"content": "", "end_to_think": True})
                         else:
-                            partials.append(self.path[i])
-                    else:
-                        yield _node_finished(cpn_obj)
-
-                def _append_path(cpn_id):
-                    nonlocal other_branch
-                    if other_branch:
-                        return
-                    if self.path[-1] == cpn_id:
-                        return
-                    self.path.append(cpn_id)
-
-                def _extend_path(cpn_ids):
-                    nonlocal other_branch
-                    if other_branch:
-                        return
-                    for cpn_id in cpn_ids:
-                        _append_path(cpn_id)
-
-                if cpn_obj.component_name.lower() == "iterationitem" and cpn_obj.end():
-                    iter = cpn_obj.get_parent()
-                    yield _node_finished(iter)
-                    _extend_path(self.get_component(cpn["parent_id"])["downstream"])
-                elif cpn_obj.component_name.lower() in ["categorize", "switch"]:
-                    _extend_path(cpn_obj.output("_next"))
-                elif cpn_obj.component_name.lower() == "iteration":
-                    _append_path(cpn_obj.get_start())
-                elif not cpn["downstream"] and cpn_obj.get_parent():
-                    _append_path(cpn_obj.get_parent().get_start())
+                            yield decorate("message", {"content": m})
+                            _m += m
+                    cpn_obj.set_output("content", _m)
+                    cite = re.search(r"\[ID:[ 0-9]+\]", _m)
+                else:
+                    yield decorate("message", {"content": cpn_obj.output("content")})
+                    cite = re.search(r"\[ID:[ 0-9]+\]",  cpn_obj.output("content"))
+
+                if isinstance(cpn_obj.output("attachment"), tuple):
+                    yield decorate("message", {"attachment": cpn_obj.output("attachment")})
+                    
+                yield decorate("message_end", {"reference": self.get_reference() if cite else None})
+
+                while partials:
+                    _cpn_obj = self.get_component_obj(partials[0])
+                    if isinstance(_cpn_obj.output("content"), partial):
+                        break
+                    yield _node_finished(_cpn_obj)
+                    partials.pop(0)
+
+            other_branch = False
+            if cpn_obj.error():
+                ex = cpn_obj.exception_handler()
+                if ex and ex["goto"]:
+                    self.path.extend(ex["goto"])
+                    other_branch = True
+                elif ex and ex["default_value"]:
+                    yield decorate("message", {"content": ex["default_value"]})
+                    yield decorate("message_end", {})
                 else:
-                    _extend_path(cpn["downstream"])
+                    self.error = cpn_obj.error()
 
-            if self.error:
-                logging.error(f"Runtime Error: {self.error}")
+            if cpn_obj.component_name.lower() != "iteration":
+                if isinstance(cpn_obj.output("content"), partial):
+                    if self.error:
+                        cpn_obj.set_output("content", None)
+                        yield _node_finished(cpn_obj)
+                    else:
+                        partials.append(self.path[i])
+                else:
+                    yield _node_finished(cpn_obj)
+
+            def _append_path(cpn_id):
+                nonlocal other_branch
+                if other_branch:
+                    return
+                if self.path[-1] == cpn_id or _pending(cpn_id):
+                    return
+                self.path.append(cpn_id)
+
+            def _extend_path(cpn_ids):
+                nonlocal other_branch
+                if other_branch:
+                    return
+                for cpn_id in cpn_ids:
+                    _append_path(cpn_id)
+
+            if cpn_obj.component_name.lower() == "iterationitem" and cpn_obj.end():
+                iter = cpn_obj.get_parent()
+                yield _node_finished(iter)
+                _extend_path(self.get_component(cpn["parent_id"])["downstream"])
+            elif cpn_obj.component_name.lower() in ["categorize", "switch"]:
+                _extend_path(cpn_obj.output("_next"))
+            elif cpn_obj.component_name.lower() == "iteration":
+                _append_path(cpn_obj.get_start())
+            elif not cpn["downstream"] and cpn_obj.get_parent():
+                _append_path(cpn_obj.get_parent().get_start())
+            else:
+                _extend_path(cpn["downstream"])
+
+        # Components start as soon as the ones they depend on are done and are post-processed as they finish.
+        stop = False
+        while True:
+            if not stop:
+                yield from _submit()
+            if not running:
                 break
-            idx = to
-
-            if any([self.get_component_obj(c).component_name.lower() == "userfillup" for c in self.path[idx:]]):
-                path = [c for c in self.path[idx:] if self.get_component(c)["obj"].component_name.lower() == "userfillup"]
-                path.extend([c for c in self.path[idx:] if self.get_component(c)["obj"].component_name.lower() != "userfillup"])
-                another_inputs = {}
-                tips = ""
-                for c in path:
-                    o = self.get_component_obj(c)
-                    if o.component_name.lower() == "userfillup":
-                        o.invoke()
-                        another_inputs.update(o.get_input_elements())
-                        if o.get_param("enable_tips"):
-                            tips = o.output("tips")
-                self.path = path
-                yield decorate("user_inputs", {"inputs": another_inputs, "tips": tips})
-                return
-        self.path = self.path[:idx]
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for f in sorted(finished, key=lambda f: running[f]):
+                i = running.pop(f)
+                f.result()
+                state[i] = "done"
+                yield from _post_process(i)
+            if self.error or any(self.get_component_obj(self.path[i]).component_name.lower() == "userfillup" for i in _pending()):
+                stop = True
+
+        if self.error:
+            logging.error(f"Runtime Error: {self.error}")
+        elif any(self.get_component_obj(self.path[i]).component_name.lower() == "userfillup" for i in _pending()):
+            rest = [self.path[i] for i in _pending()]
+            path = [c for c in rest if self.get_component(c)["obj"].component_name.lower() == "userfillup"]
+            path.extend([c for c in rest if self.get_component(c)["obj"].component_name.lower() != "userfillup"])
+            another_inputs = {}
+            tips = ""
+            for c in path:
+                o = self.get_component_obj(c)
+                if o.component_name.lower() == "userfillup":
+                    o.invoke()
+                    another_inputs.update(o.get_input_elements())
+                    if o.get_param("enable_tips"):
+                        tips = o.output("tips")
+            self.path = path
+            yield decorate("user_inputs", {"inputs": another_inputs, "tips": tips})
+            return
+        self.path = [c for i, c in enumerate(self.path) if state.get(i) == "done"]
         if not self.error:
             yield decorate("workflow_finished",
                        {
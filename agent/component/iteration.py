@@ -13,7 +13,11 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import queue
+import threading
 from abc import ABC
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from agent.component.base import ComponentBase, ComponentParamBase
 
 """
@@ -32,6 +36,8 @@ class IterationParam(ComponentParamBase):
     def __init__(self):
         super().__init__()
         self.items_ref = ""
+        self.parallel = False
+        self.max_concurrency = 4
 
     def get_input_form(self) -> dict[str, dict]:
         return {
@@ -42,6 +48,8 @@ class IterationParam(ComponentParamBase):
         }
 
     def check(self):
+        self.check_boolean(self.parallel, "[Iteration] Parallel")
+        self.check_positive_integer(self.max_concurrency, "[Iteration] Max concurrency")
         return True
 
 
@@ -62,6 +70,96 @@ class Iteration(ComponentBase, ABC):
         arr = self._canvas.get_variable_value(self._param.items_ref)
         if not isinstance(arr, list):
             self.set_output("_ERROR", self._param.items_ref + " must be an array, but its type is "+str(type(arr)))
+            return
+
+        if self._param.parallel:
+            self._invoke_parallel(arr)
+
+    def _invoke_parallel(self, arr, max_concurrency=None):
+        """
+        Run the sub-graph of every item right here, up to `max_concurrency` items at a time, each on its own
+        IterationScope. Outputs are collated in item order, and IterationItem then ends the loop at once.
+        Components inside the iteration don't stream messages in this mode.
+        """
+        from agent.canvas import IterationScope  # Local import to avoid cyclic dependency
+
+        start = self.get_start()
+        refs = {}
+        for k, o in self._param.outputs.items():
+            if "ref" not in o:
+                continue
+            cid, var = o["ref"].split("@")
+            refs[k] = (cid, var)
+
+        n = max(1, min(int(max_concurrency or self._param.max_concurrency), len(arr)))
+        scopes = queue.Queue()
+        for _ in range(n):
+            scopes.put(IterationScope(self._canvas, self._id))
+        stop = threading.Event()
+        errors = []
+
+        def run_item(idx):
+            if stop.is_set():
+                return None
+            scope = scopes.get()
+            try:
+                return self._run_item(scope, start, idx, arr[idx], refs, stop)
+            except Exception as e:
+                errors.append(str(e))
+                stop.set()
+            finally:
+                scopes.put(scope)
+
+        with ThreadPoolExecutor(max_workers=n, thread_name_prefix="iteration") as executor:
+            results = list(executor.map(run_item, range(len(arr))))
+
+        if self.check_if_canceled("Iteration processing"):
+            return
+        if errors:
+            self.set_output("_ERROR", errors[0])
+            return
+        for k in refs:
+            self.set_output(k, [res[k] for res in results])
+
+    def _run_item(self, scope, start, idx, item, refs, stop):
+        for cpn in scope.components.values():
+            if cpn.get("parent_id") == self._id:
+                cpn["obj"].reset(True)
+        scope.get_component_obj(start).set_output("item", item)
+        scope.get_component_obj(start).set_output("index", idx)
+
+        path = list(scope.get_component(start)["downstream"])
+        i = 0
+        while i < len(path):
+            if stop.is_set():
+                return None
+            if self.is_canceled():
+                stop.set()
+                return None
+            cpn = scope.get_component(path[i])
+            obj = cpn["obj"]
+            i += 1
+            obj.invoke(**obj.get_input())
+            if obj.component_name.lower() == "iteration" and not obj._param.parallel and not obj.error():
+                # The canvas loop that drives a sequential iteration doesn't run here, so run its items in turn.
+                obj._invoke_parallel(scope.get_variable_value(obj._param.items_ref), 1)
+            if isinstance(obj.output("content"), partial):
+                obj.set_output("content", "".join([m for m in obj.output("content")() if m and m not in ["<think>", "</think>"]]))
+
+            nxt = cpn["downstream"]
+            if obj.error():
+                ex = obj.exception_handler()
+                if ex and ex["goto"]:
+                    nxt = ex["goto"]
+                elif not (ex and ex["default_value"]):
+                    raise Exception(obj.error())
+            elif obj.component_name.lower() in ["categorize", "switch"]:
+                nxt = obj.output("_next")
+            for cid in nxt:
+                if cid not in path and scope.get_component(cid).get("parent_id") == self._id:
+                    path.append(cid)
+
+        return {k: scope.get_component_obj(cid).output(var) for k, (cid, var) in refs.items()}
 
     def thoughts(self) -> str:
         return "Need to process {} items.".format(len(self._canvas.get_variable_value(self._param.items_ref)))
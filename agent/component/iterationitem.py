@@ -37,6 +37,11 @@ class IterationItem(ComponentBase, ABC):
             return
 
         parent = self.get_parent()
+        if parent._param.parallel:
+            # Every item has already been run and collated by the Iteration.
+            self._idx = -1
+            return
+
         arr = self._canvas.get_variable_value(parent._param.items_ref)
         if not isinstance(arr, list):
             self._idx = -1
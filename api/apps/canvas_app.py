@@ -549,7 +549,9 @@ def trace():
     try:
         binary = REDIS_CONN.get(f"{cvs_id}-{msg_id}-logs")
         if not binary:
-            return get_json_result(data={})
+            # Ingestion pipelines keep an append-only trace instead.
+            logs = Pipeline.load_logs(cvs_id, msg_id, int(request.args.get("offset", 0)), int(request.args.get("limit", -1)))
+            return get_json_result(data=logs if logs else {})
 
         return get_json_result(data=json.loads(binary.encode("utf-8")))
     except Exception as e:
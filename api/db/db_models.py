@@ -1112,6 +1112,19 @@ class SyncLogs(DataBaseModel):
         db_table = "sync_logs"
 
 
+class ConnectorDocIndex(DataBaseModel):
+    id = CharField(max_length=32, primary_key=True, help_text="hash of connector id, kb id and source document id")
+    connector_id = CharField(max_length=32, null=False, index=True)
+    kb_id = CharField(max_length=32, null=False, index=True)
+    source_id = TextField(null=False, help_text="document id in the data source")
+    content_hash = CharField(max_length=32, null=False, help_text="xxh128 of the document bytes")
+    size = IntegerField(default=0, index=False)
+    doc_id = CharField(max_length=32, null=False, index=True)
+
+    class Meta:
+        db_table = "connector_doc_index"
+
+
 def migrate_db():
     logging.disable(logging.ERROR)
     migrator = DatabaseMigrator[settings.DATABASE_TYPE.upper()].value(DB)
@@ -17,11 +17,13 @@ import logging
 from datetime import datetime
 from typing import Tuple, List
 
+import xxhash
+
 from anthropic import BaseModel
 from peewee import SQL, fn
 
 from api.db import InputType
-from api.db.db_models import Connector, SyncLogs, Connector2Kb, Knowledgebase
+from api.db.db_models import DB, Connector, SyncLogs, Connector2Kb, Knowledgebase, ConnectorDocIndex
 from api.db.services.common_service import CommonService
 from api.db.services.document_service import DocumentService
 from api.db.services.file_service import FileService
@@ -191,6 +193,11 @@ class SyncLogsService(CommonService):
 
     @classmethod
     def duplicate_and_parse(cls, kb, docs, tenant_id, src, auto_parse=True):
+        """
+        Upload new documents and re-parse changed ones in place. Documents whose bytes are the same as
+        the last time they were synchronized are skipped. Returns the errors and the ids of the documents
+        that were (re-)indexed.
+        """
         if not docs:
             return None
 
@@ -202,18 +209,50 @@ class SyncLogsService(CommonService):
                 return self.blob
 
         errs = []
-        files = [FileObj(filename=d["semantic_identifier"]+(f"{d['extension']}" if d["semantic_identifier"][::-1].find(d['extension'][::-1])<0 else ""), blob=d["blob"]) for d in docs]
         doc_ids = []
-        err, doc_blob_pairs = FileService.upload_document(kb, files, tenant_id, src)
-        errs.extend(err)
-
         kb_table_num_map = {}
-        for doc, _ in doc_blob_pairs:
-            doc_ids.append(doc["id"])
-            if not auto_parse or auto_parse == "0":
-                continue
-            DocumentService.run(tenant_id, doc, kb_table_num_map)
+        index = ConnectorDocIndexService.get_entries(kb.id, docs)
+        existing = {}
+        if index:
+            existing = {d.id: d for d in DocumentService.get_by_ids([e.doc_id for e in index.values()])}
 
+        entries = []
+        unchanged = 0
+        try:
+            for d in docs:
+                key = ConnectorDocIndexService.key(d["connector_id"], kb.id, d["id"])
+                content_hash = xxhash.xxh128(d["blob"]).hexdigest()
+                entry = index.get(key)
+                doc = existing.get(entry.doc_id) if entry else None
+                if doc and entry.content_hash == content_hash and entry.size == len(d["blob"]):
+                    unchanged += 1
+                    continue
+
+                if doc:
+                    try:
+                        doc = FileService.replace_document(kb, doc, d["blob"])
+                    except Exception as e:
+                        errs.append(f"{doc.name}: {e}")
+                        continue
+                else:
+                    file = FileObj(filename=d["semantic_identifier"]+(f"{d['extension']}" if d["semantic_identifier"][::-1].find(d['extension'][::-1])<0 else ""), blob=d["blob"])
+                    err, doc_blob_pairs = FileService.upload_document(kb, [file], tenant_id, src)
+                    errs.extend(err)
+                    if not doc_blob_pairs:
+                        continue
+                    doc = doc_blob_pairs[0][0]
+
+                entries.append({"id": key, "connector_id": d["connector_id"], "kb_id": kb.id, "source_id": d["id"],
+                                "content_hash": content_hash, "size": len(d["blob"]), "doc_id": doc["id"]})
+                doc_ids.append(doc["id"])
+                if not auto_parse or auto_parse == "0":
+                    continue
+                DocumentService.run(tenant_id, doc, kb_table_num_map)
+        finally:
+            ConnectorDocIndexService.save_entries(entries)
+
+        if unchanged:
+            logging.info(f"[SyncLogService] {src}: skipped {unchanged} unchanged documents.")
         return errs, doc_ids
 
     @classmethod
@@ -224,6 +263,33 @@ class SyncLogsService(CommonService):
         ).order_by(cls.model.update_time.desc()).first()
 
 
+class ConnectorDocIndexService(CommonService):
+    """
+    Content hash, size and document id of everything a connector has put into a knowledge base,
+    keyed by the document id in the data source.
+    """
+    model = ConnectorDocIndex
+
+    @staticmethod
+    def key(connector_id, kb_id, source_id) -> str:
+        return xxhash.xxh128(f"{connector_id}/{kb_id}/{source_id}".encode("utf-8", "surrogatepass")).hexdigest()
+
+    @classmethod
+    @DB.connection_context()
+    def get_entries(cls, kb_id, docs) -> dict:
+        keys = [cls.key(d["connector_id"], kb_id, d["id"]) for d in docs]
+        return {e.id: e for e in cls.model.select().where(cls.model.id.in_(keys))}
+
+    @classmethod
+    @DB.connection_context()
+    def save_entries(cls, entries: list[dict]):
+        if not entries:
+            return
+        with DB.atomic():
+            cls.model.delete().where(cls.model.id.in_([e["id"] for e in entries])).execute()
+            cls.insert_many(entries)
+
+
 class Connector2KbService(CommonService):
     model = Connector2Kb
 
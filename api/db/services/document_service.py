@@ -15,6 +15,7 @@
 #
 import json
 import logging
+import os
 import random
 import re
 from concurrent.futures import ThreadPoolExecutor
@@ -41,6 +42,11 @@ from rag.utils.redis_conn import REDIS_CONN
 from rag.utils.doc_store_conn import OrderByExpr
 from common import settings
 
+DOC_PROGRESS_EVENTS = "doc_progress_events"
+DOC_PROGRESS_EVENT_BATCH = int(os.environ.get("DOC_PROGRESS_EVENT_BATCH", "1000"))
+DOC_PROGRESS_SYNC_BATCH = int(os.environ.get("DOC_PROGRESS_SYNC_BATCH", "500"))
+
+
 class DocumentService(CommonService):
     model = Document
 
@@ -384,6 +390,19 @@ class DocumentService(CommonService):
              (cls.model.id.in_(unfinished_task_query)))) # including unfinished tasks like GraphRAG, RAPTOR and Mindmap
         return list(docs.dicts())
 
+    @classmethod
+    @DB.connection_context()
+    def get_docs_for_progress(cls, doc_ids):
+        fields = [cls.model.id, cls.model.process_begin_at, cls.model.parser_config, cls.model.progress_msg,
+                  cls.model.run, cls.model.parser_id]
+        docs = []
+        for i in range(0, len(doc_ids), DOC_PROGRESS_SYNC_BATCH):
+            docs.extend(cls.model.select(*fields).where(
+                cls.model.id.in_(doc_ids[i: i + DOC_PROGRESS_SYNC_BATCH]),
+                cls.model.status == StatusEnum.VALID.value,
+                ~(cls.model.type == FileType.VIRTUAL.value)).dicts())
+        return docs
+
     @classmethod
     @DB.connection_context()
     def increment_chunk_num(cls, doc_id, kb_id, token_num, chunk_num, duration):
@@ -676,65 +695,117 @@ class DocumentService(CommonService):
         cls._sync_progress(docs)
 
 
+    @classmethod
+    def publish_progress_event(cls, doc_id):
+        """Tell the progress aggregator of the API servers that the tasks of a document changed."""
+        if doc_id:
+            REDIS_CONN.stream_add(DOC_PROGRESS_EVENTS, {"doc_id": doc_id})
+
     @classmethod
     @DB.connection_context()
-    def _sync_progress(cls, docs:list[dict]):
-        from api.db.services.task_service import TaskService
+    def update_progress_from_events(cls):
+        """
+        Roll up the documents named by the task events published since the last call.
 
-        for d in docs:
-            try:
-                tsks = TaskService.query(doc_id=d["id"], order_by=Task.create_time)
-                if not tsks:
-                    continue
-                msg = []
-                prg = 0
-                finished = True
-                bad = 0
-                e, doc = DocumentService.get_by_id(d["id"])
-                status = doc.run  # TaskStatus.RUNNING.value
-                doc_progress = doc.progress if doc and doc.progress else 0.0
-                special_task_running = False
-                priority = 0
-                for t in tsks:
-                    task_type = (t.task_type or "").lower()
-                    if task_type in PIPELINE_SPECIAL_PROGRESS_FREEZE_TASK_TYPES:
-                        special_task_running = True
-                    if 0 <= t.progress < 1:
-                        finished = False
-                    if t.progress == -1:
-                        bad += 1
-                    prg += t.progress if t.progress >= 0 else 0
-                    if t.progress_msg.strip():
-                        msg.append(t.progress_msg)
-                    priority = max(priority, t.priority)
-                prg /= len(tsks)
-                if finished and bad:
-                    prg = -1
-                    status = TaskStatus.FAIL.value
-                elif finished:
-                    prg = 1
-                    status = TaskStatus.DONE.value
-
-                # only for special task and parsed docs and unfinised
-                freeze_progress = special_task_running and doc_progress >= 1 and not finished
-                msg = "\n".join(sorted(msg))
-                info = {
-                    "process_duration": datetime.timestamp(
-                        datetime.now()) -
-                                       d["process_begin_at"].timestamp(),
-                    "run": status}
-                if prg != 0 and not freeze_progress:
-                    info["progress"] = prg
-                if msg:
-                    info["progress_msg"] = msg
-                    if msg.endswith("created task graphrag") or msg.endswith("created task raptor") or msg.endswith("created task mindmap"):
-                        info["progress_msg"] += "\n%d tasks are ahead in the queue..."%get_queue_length(priority)
-                else:
-                    info["progress_msg"] = "%d tasks are ahead in the queue..."%get_queue_length(priority)
-                cls.update_by_id(d["id"], info)
-            except Exception as e:
-                if str(e).find("'0'") < 0:
-                    logging.exception("fetch task exception")
+        The stream offset is kept in Redis, so whichever server holds the `update_progress` lock
+        continues where the previous holder stopped. Returns the number of events consumed.
+        """
+        offset_key = DOC_PROGRESS_EVENTS + "_offset"
+        events = REDIS_CONN.stream_read(DOC_PROGRESS_EVENTS, REDIS_CONN.get(offset_key) or "0", DOC_PROGRESS_EVENT_BATCH)
+        if not events:
+            return 0
+        doc_ids = list({fields["doc_id"] for _, fields in events if fields.get("doc_id")})
+        cls._sync_progress(cls.get_docs_for_progress(doc_ids))
+        REDIS_CONN.set(offset_key, events[-1][0], exp=7 * 24 * 3600)
+        return len(events)
+
+    @classmethod
+    @DB.connection_context()
+    def _sync_progress(cls, docs:list[dict]):
+        queue_lengths = {}
+
+        def queue_length(priority):
+            if priority not in queue_lengths:
+                queue_lengths[priority] = get_queue_length(priority)
+            return queue_lengths[priority]
+
+        for i in range(0, len(docs), DOC_PROGRESS_SYNC_BATCH):
+            batch = docs[i: i + DOC_PROGRESS_SYNC_BATCH]
+            doc_ids = [d["id"] for d in batch]
+            tasks = {}
+            for t in Task.select().where(Task.doc_id.in_(doc_ids)).order_by(Task.create_time):
+                tasks.setdefault(t.doc_id, []).append(t)
+            current = {doc.id: doc for doc in cls.model.select(
+                cls.model.id, cls.model.run, cls.model.progress, cls.model.progress_msg).where(cls.model.id.in_(doc_ids))}
+
+            updates = []
+            for d in batch:
+                try:
+                    tsks = tasks.get(d["id"])
+                    doc = current.get(d["id"])
+                    if not tsks or not doc:
+                        continue
+                    info = cls._rollup_progress(d, doc, tsks, queue_length)
+                    if info["run"] == doc.run and info.get("progress", doc.progress) == doc.progress \
+                            and info["progress_msg"] == doc.progress_msg:
+                        continue
+                    updates.append((d["id"], info))
+                except Exception as e:
+                    if str(e).find("'0'") < 0:
+                        logging.exception("fetch task exception")
+
+            if updates:
+                with DB.atomic():
+                    for doc_id, info in updates:
+                        cls.update_by_id(doc_id, info)
+
+    @staticmethod
+    def _rollup_progress(d, doc, tsks, queue_length):
+        msg = []
+        prg = 0
+        finished = True
+        bad = 0
+        status = doc.run  # TaskStatus.RUNNING.value
+        doc_progress = doc.progress if doc and doc.progress else 0.0
+        special_task_running = False
+        priority = 0
+        for t in tsks:
+            task_type = (t.task_type or "").lower()
+            if task_type in PIPELINE_SPECIAL_PROGRESS_FREEZE_TASK_TYPES:
+                special_task_running = True
+            if 0 <= t.progress < 1:
+                finished = False
+            if t.progress == -1:
+                bad += 1
+            prg += t.progress if t.progress >= 0 else 0
+            if t.progress_msg.strip():
+                msg.append(t.progress_msg)
+            priority = max(priority, t.priority)
+        prg /= len(tsks)
+        if finished and bad:
+            prg = -1
+            status = TaskStatus.FAIL.value
+        elif finished:
+            prg = 1
+            status = TaskStatus.DONE.value
+
+        # only for special task and parsed docs and unfinised
+        freeze_progress = special_task_running and doc_progress >= 1 and not finished
+        msg = "\n".join(sorted(msg))
+        info = {
+            "process_duration": datetime.timestamp(
+                datetime.now()) -
+                               d["process_begin_at"].timestamp(),
+            "run": status}
+        if prg != 0 and not freeze_progress:
+            info["progress"] = prg
+        if msg:
+            info["progress_msg"] = msg
+            if msg.endswith("created task graphrag") or msg.endswith("created task raptor") or msg.endswith("created task mindmap"):
+                info["progress_msg"] += "\n%d tasks are ahead in the queue..."%queue_length(priority)
+        else:
+            info["progress_msg"] = "%d tasks are ahead in the queue..."%queue_length(priority)
+        return info
 
     @classmethod
     @DB.connection_context()
@@ -33,6 +33,7 @@ from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db.services.task_service import TaskService
 from api.utils.file_utils import filename_type, read_potential_broken_pdf, thumbnail_img, sanitize_path
 from rag.llm.cv_model import GptV4
+from rag.nlp import search
 from common import settings
 
 
@@ -482,6 +483,36 @@ class FileService(CommonService):
 
         return err, files
 
+    @classmethod
+    @DB.connection_context()
+    def replace_document(cls, kb, doc, blob):
+        # Overwrite the stored bytes of a document in place and drop its tasks and chunks,
+        # so that it can be parsed again under the same id
+        # Args:
+        #     kb: Knowledge base of the document
+        #     doc: Document object
+        #     blob: New content
+        # Returns:
+        #     The updated document as a dict
+        if doc.type == FileType.PDF.value:
+            blob = read_potential_broken_pdf(blob)
+        settings.STORAGE_IMPL.put(kb.id, doc.location, blob)
+
+        if doc.chunk_num or doc.token_num:
+            DocumentService.clear_chunk_num_when_rerun(doc.id)
+        TaskService.filter_delete([Task.doc_id == doc.id])
+        if settings.docStoreConn.indexExist(search.index_name(kb.tenant_id), kb.id):
+            settings.docStoreConn.delete({"doc_id": doc.id}, search.index_name(kb.tenant_id), kb.id)
+
+        info = {"size": len(blob), "run": TaskStatus.UNSTART.value, "progress": 0, "progress_msg": "",
+                "chunk_num": 0, "token_num": 0, "process_duration": 0}
+        DocumentService.update_by_id(doc.id, info)
+        for f2d in File2DocumentService.get_by_document_id(doc.id):
+            cls.model.update(size=len(blob)).where(cls.model.id == f2d.file_id).execute()
+        doc = doc.to_dict()
+        doc.update(info)
+        return doc
+
     @classmethod
     @DB.connection_context()
     def list_all_files_by_parent_id(cls, parent_id):
@@ -16,12 +16,15 @@
 import logging
 import os
 import random
+import threading
+import time
 import xxhash
+from collections import deque
 from datetime import datetime
 
 from api.db.db_utils import bulk_insert_into_db
 from deepdoc.parser import PdfParser
-from peewee import JOIN
+from peewee import JOIN, Case, DoesNotExist
 from api.db.db_models import DB, File2Document, File
 from api.db import FileType
 from api.db.db_models import Task, Document, Knowledgebase, Tenant
@@ -37,6 +40,8 @@ from rag.nlp import search
 
 CANVAS_DEBUG_DOC_ID = "dataflow_x"
 GRAPH_RAPTOR_FAKE_DOC_ID = "graph_raptor_x"
+TASK_PROGRESS_FLUSH_MS = int(os.environ.get("TASK_PROGRESS_FLUSH_MS", "1000"))
+TASK_CANCEL_CACHE_MS = int(os.environ.get("TASK_CANCEL_CACHE_MS", "1000"))
 
 def trim_header_by_lines(text: str, max_length) -> str:
     # Trim header text to maximum length while preserving line breaks
@@ -135,6 +140,7 @@ class TaskService(CommonService):
             progress=prog,
             retry_count=docs[0]["retry_count"] + 1,
         ).where(cls.model.id == docs[0]["id"]).execute()
+        DocumentService.publish_progress_event(docs[0]["doc_id"])
 
         if docs[0]["retry_count"] >= 3:
             return None
@@ -315,6 +321,26 @@ class TaskService(CommonService):
 
         process_duration = (datetime.now() - task.begin_at).total_seconds()
         cls.model.update(process_duration=process_duration).where(cls.model.id == id).execute()
+        DocumentService.publish_progress_event(task.doc_id)
+
+    @classmethod
+    @DB.connection_context()
+    def write_progress(cls, id, progress_msg, progress=None, begin_at=None):
+        """Overwrite the progress of a task owned by the calling executor with one UPDATE.
+
+        Unlike `update_progress`, neither the previous message is read nor the global lock taken:
+        the caller keeps the whole message history, see `TaskProgressReporter`. `progress` follows
+        the same rule as in `update_progress`, it never overwrites -1 nor goes backward.
+        """
+        fields = {cls.model.progress_msg: progress_msg}
+        if progress is not None:
+            cond = cls.model.progress != -1
+            if progress != -1:
+                cond &= cls.model.progress < progress
+            fields[cls.model.progress] = Case(None, [(cond, progress)], cls.model.progress)
+        if begin_at:
+            fields[cls.model.process_duration] = (datetime.now() - begin_at).total_seconds()
+        return cls.model.update(fields).where(cls.model.id == id).execute()
 
     @classmethod
     @DB.connection_context()
@@ -485,13 +511,144 @@ def cancel_all_task_of(doc_id):
             logging.exception(e)
 
 
+_cancel_cache = {}
+_cancel_cache_lock = threading.Lock()
+
+
 def has_canceled(task_id):
+    # Workers poll this in tight loops, so the answer is kept for TASK_CANCEL_CACHE_MS.
+    # A cancellation is final and is kept until the cache is pruned.
+    now = time.monotonic()
+    with _cancel_cache_lock:
+        hit = _cancel_cache.get(task_id)
+    if hit and (hit[1] or hit[0] > now):
+        return hit[1]
+    canceled = False
     try:
         if REDIS_CONN.get(f"{task_id}-cancel"):
-            return True
+            canceled = True
     except Exception as e:
         logging.exception(e)
-    return False
+    with _cancel_cache_lock:
+        if len(_cancel_cache) > 10000:
+            for k in [k for k, (expire, _) in _cancel_cache.items() if expire <= now]:
+                del _cancel_cache[k]
+        _cancel_cache[task_id] = (now + TASK_CANCEL_CACHE_MS / 1000., canceled)
+    return canceled
+
+
+class TaskProgressReporter:
+    """
+    Coalesce the progress of the tasks running in this process.
+
+    Messages are appended to a per-task buffer, trimmed from the head to 3000 characters like
+    `TaskService.update_progress` does, and written with `TaskService.write_progress` at most once
+    every TASK_PROGRESS_FLUSH_MS. Failures, completion and `flush` write immediately. The stored
+    message is read once, the first time a task is reported, since the executor running a task
+    is its only writer.
+    """
+
+    MAX_MSG_LEN = 3000
+
+    class _State:
+        def __init__(self):
+            self.msgs = deque()
+            self.msg_len = 0
+            self.progress = None
+            self.begin_at = None
+            self.doc_id = None
+            self.seeded = False
+            self.dirty = False
+            self.flushed_at = 0.
+            self.lock = threading.Lock()
+
+    def __init__(self, flush_ms: int = TASK_PROGRESS_FLUSH_MS):
+        self.interval = flush_ms / 1000.
+        self._tasks = {}
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def _state(self, task_id):
+        with self._lock:
+            st = self._tasks.get(task_id)
+            if st is None:
+                st = self._tasks[task_id] = self._State()
+            if self._flusher is None and self.interval > 0:
+                self._flusher = threading.Thread(target=self._flush_loop, name="task_progress_flusher", daemon=True)
+                self._flusher.start()
+            return st
+
+    def _append(self, st, msg):
+        st.msgs.append(msg)
+        st.msg_len += len(msg) + 1
+        while len(st.msgs) > 1 and st.msg_len > self.MAX_MSG_LEN:
+            st.msg_len -= len(st.msgs.popleft()) + 1
+
+    def report(self, task_id, msg="", prog=None):
+        st = self._state(task_id)
+        with st.lock:
+            if msg:
+                self._append(st, msg)
+                st.dirty = True
+            if prog is not None and st.progress != -1 and (prog == -1 or st.progress is None or prog > st.progress):
+                st.progress = prog
+                st.dirty = True
+            due = time.monotonic() - st.flushed_at >= self.interval
+        if due or (prog is not None and (prog < 0 or prog >= 1)):
+            self.flush(task_id)
+
+    def _write(self, task_id, st):
+        if not st.seeded:
+            task = TaskService.model.get_by_id(task_id)
+            head = st.msgs
+            st.msgs, st.msg_len = deque(), 0
+            for line in (task.progress_msg or "").split("\n"):
+                self._append(st, line)
+            for line in head:
+                self._append(st, line)
+            st.begin_at = task.begin_at
+            st.doc_id = task.doc_id
+            st.seeded = True
+        progress_msg = trim_header_by_lines("\n".join(st.msgs), self.MAX_MSG_LEN)
+        TaskService.write_progress(task_id, progress_msg, st.progress, st.begin_at)
+        DocumentService.publish_progress_event(st.doc_id)
+
+    def flush(self, task_id):
+        with self._lock:
+            st = self._tasks.get(task_id)
+        if st is None:
+            return
+        with st.lock:
+            if not st.dirty:
+                return
+            st.dirty = False
+            st.flushed_at = time.monotonic()
+            try:
+                self._write(task_id, st)
+            except DoesNotExist:
+                logging.warning(f"TaskProgressReporter.flush({task_id}) got exception DoesNotExist")
+                with self._lock:
+                    self._tasks.pop(task_id, None)
+            except Exception:
+                st.dirty = True
+                logging.exception(f"TaskProgressReporter.flush({task_id}) got exception")
+
+    def close(self, task_id):
+        """Write what is pending for a finished task and forget it."""
+        self.flush(task_id)
+        with self._lock:
+            self._tasks.pop(task_id, None)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                task_ids = list(self._tasks.keys())
+            for task_id in task_ids:
+                self.flush(task_id)
+
+
+TASK_PROGRESS = TaskProgressReporter()
 
 
 def queue_dataflow(tenant_id:str, flow_id:str, task_id:str, doc_id:str=CANVAS_DEBUG_DOC_ID, file:dict=None, priority: int=0, rerun:bool=False) -> tuple[bool, str]:
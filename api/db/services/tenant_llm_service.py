@@ -13,9 +13,16 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import atexit
+import copy
 import os
 import logging
+import threading
+import time
+from collections import OrderedDict
+
 from langfuse import Langfuse
+from peewee import Expression
 from common import settings
 from common.constants import LLMType
 from api.db.db_models import DB, LLMFactories, TenantLLM
@@ -23,6 +30,11 @@ from api.db.services.common_service import CommonService
 from api.db.services.langfuse_service import TenantLangfuseService
 from api.db.services.user_service import TenantService
 from rag.llm import ChatModel, CvModel, EmbeddingModel, RerankModel, Seq2txtModel, TTSModel
+from rag.utils.redis_conn import REDIS_CONN
+
+LLM_INSTANCE_CACHE_SIZE = int(os.environ.get("LLM_INSTANCE_CACHE_SIZE", "256"))
+LLM_INSTANCE_CACHE_TTL = int(os.environ.get("LLM_INSTANCE_CACHE_TTL", "600"))
+LLM_USAGE_FLUSH_INTERVAL = int(os.environ.get("LLM_USAGE_FLUSH_INTERVAL", "5"))
 
 
 class LLMFactoriesService(CommonService):
@@ -32,6 +44,37 @@ class LLMFactoriesService(CommonService):
 class TenantLLMService(CommonService):
     model = TenantLLM
 
+    @classmethod
+    def save(cls, **kwargs):
+        obj = super().save(**kwargs)
+        bump_llm_config_version(kwargs.get("tenant_id"))
+        return obj
+
+    @classmethod
+    def insert_many(cls, data_list, batch_size=100):
+        super().insert_many(data_list, batch_size)
+        for tenant_id in {d.get("tenant_id") for d in data_list}:
+            bump_llm_config_version(tenant_id)
+
+    @classmethod
+    def filter_update(cls, filters, update_data):
+        num = super().filter_update(filters, update_data)
+        bump_llm_config_version(cls._filtered_tenant(filters))
+        return num
+
+    @classmethod
+    def filter_delete(cls, filters):
+        num = super().filter_delete(filters)
+        bump_llm_config_version(cls._filtered_tenant(filters))
+        return num
+
+    @classmethod
+    def _filtered_tenant(cls, filters):
+        for f in filters:
+            if isinstance(f, Expression) and f.lhs is cls.model.tenant_id and f.op == "=":
+                return f.rhs
+        return None
+
     @classmethod
     @DB.connection_context()
     def get_api_key(cls, tenant_id, model_name):
@@ -128,8 +171,9 @@ class TenantLLMService(CommonService):
 
     @classmethod
     @DB.connection_context()
-    def model_instance(cls, tenant_id, llm_type, llm_name=None, lang="Chinese", **kwargs):
-        model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
+    def model_instance(cls, tenant_id, llm_type, llm_name=None, lang="Chinese", model_config=None, **kwargs):
+        if model_config is None:
+            model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
         kwargs.update({"provider": model_config["llm_factory"]})
         if llm_type == LLMType.EMBEDDING.value:
             if model_config["llm_factory"] not in EmbeddingModel:
@@ -210,6 +254,47 @@ class TenantLLMService(CommonService):
 
         return num
 
+    @classmethod
+    @DB.connection_context()
+    def increase_usage_batch(cls, usage: dict):
+        """Apply `{(tenant_id, llm_type, llm_name): used_tokens}` with one UPDATE per tenant model, in one transaction."""
+        tenants = {}
+        totals = {}
+        for (tenant_id, llm_type, llm_name), used_tokens in usage.items():
+            if tenant_id not in tenants:
+                e, tenant = TenantService.get_by_id(tenant_id)
+                tenants[tenant_id] = tenant if e else None
+                if not e:
+                    logging.error(f"Tenant not found: {tenant_id}")
+            tenant = tenants[tenant_id]
+            if not tenant:
+                continue
+            llm_map = {
+                LLMType.EMBEDDING.value: tenant.embd_id if not llm_name else llm_name,
+                LLMType.SPEECH2TEXT.value: tenant.asr_id,
+                LLMType.IMAGE2TEXT.value: tenant.img2txt_id,
+                LLMType.CHAT.value: tenant.llm_id if not llm_name else llm_name,
+                LLMType.RERANK.value: tenant.rerank_id if not llm_name else llm_name,
+                LLMType.TTS.value: tenant.tts_id if not llm_name else llm_name,
+            }
+            mdlnm = llm_map.get(llm_type)
+            if mdlnm is None:
+                logging.error(f"LLM type error: {llm_type}")
+                continue
+            key = (tenant_id, *TenantLLMService.split_model_name_and_factory(mdlnm))
+            totals[key] = totals.get(key, 0) + used_tokens
+
+        with DB.atomic():
+            for (tenant_id, llm_name, llm_factory), used_tokens in totals.items():
+                num = cls.model.update(used_tokens=cls.model.used_tokens + used_tokens) \
+                    .where(cls.model.tenant_id == tenant_id, cls.model.llm_name == llm_name,
+                           cls.model.llm_factory == llm_factory if llm_factory else True) \
+                    .execute()
+                if not num:
+                    # `TokenUsageAccumulator.add` returned True long before, so this is the only trace of the lost usage.
+                    logging.error(f"TenantLLMService.increase_usage_batch can't update token usage for {tenant_id}/{llm_name}@{llm_factory} used_tokens: {used_tokens}")
+        return len(totals)
+
     @classmethod
     @DB.connection_context()
     def get_openai_models(cls):
@@ -221,7 +306,9 @@ class TenantLLMService(CommonService):
     @classmethod
     @DB.connection_context()
     def delete_by_tenant_id(cls, tenant_id):
-        return cls.model.delete().where(cls.model.tenant_id == tenant_id).execute()
+        num = cls.model.delete().where(cls.model.tenant_id == tenant_id).execute()
+        bump_llm_config_version(tenant_id)
+        return num
 
     @staticmethod
     def llm_id2llm_type(llm_id: str) -> str | None:
@@ -244,25 +331,203 @@ class TenantLLMService(CommonService):
         return None
 
 
+class TokenUsageAccumulator:
+    """
+    Sum token usage in memory per (tenant, model type, model name) and write it in batches.
+
+    `add` only touches a dict. A daemon thread hands the sums to `TenantLLMService.increase_usage_batch`
+    every LLM_USAGE_FLUSH_INTERVAL seconds, and once more at interpreter exit. Sums of a failed flush
+    are put back for the next one. With LLM_USAGE_FLUSH_INTERVAL=0 every call is written synchronously.
+    """
+
+    def __init__(self, interval: int = LLM_USAGE_FLUSH_INTERVAL):
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = None
+        self._stats = {"calls": 0, "flushed_tokens": 0, "flushes": 0, "failed_flushes": 0, "last_flush_at": None}
+        atexit.register(self.flush)
+
+    def add(self, tenant_id, llm_type, used_tokens, llm_name=None):
+        """
+        Record usage. Unless writes are synchronous, True only means it was queued; usage matching no
+        tenant model row is logged by `increase_usage_batch` when it is flushed.
+        """
+        try:
+            used_tokens = int(used_tokens or 0)
+        except (TypeError, ValueError):
+            return False
+        if self.interval <= 0:
+            return TenantLLMService.increase_usage(tenant_id, llm_type, used_tokens, llm_name)
+        key = (tenant_id, llm_type, llm_name)
+        with self._lock:
+            self._stats["calls"] += 1
+            if used_tokens:
+                self._pending[key] = self._pending.get(key, 0) + used_tokens
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="token_usage_flusher", daemon=True)
+                self._flusher.start()
+        return True
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                TenantLLMService.increase_usage_batch(pending)
+            except Exception:
+                logging.exception(f"TokenUsageAccumulator.flush of {len(pending)} entries got exception")
+                with self._lock:
+                    self._stats["failed_flushes"] += 1
+                    for k, v in pending.items():
+                        self._pending[k] = self._pending.get(k, 0) + v
+                return
+            with self._lock:
+                self._stats["flushes"] += 1
+                self._stats["flushed_tokens"] += sum(pending.values())
+                self._stats["last_flush_at"] = time.time()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, pending_entries=len(self._pending), pending_tokens=sum(self._pending.values()))
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+
+TOKEN_USAGE = TokenUsageAccumulator()
+
+
+def _llm_config_version_keys(tenant_id):
+    return ["tenant_llm_version", f"tenant_llm_version:{tenant_id}"]
+
+
+def llm_config_version(tenant_id) -> str:
+    """Version of everything `LLM4Tenant` reads for a tenant: models, API keys, defaults and Langfuse keys."""
+    return ":".join(str(v) for v in REDIS_CONN.mget(_llm_config_version_keys(tenant_id)))
+
+
+def bump_llm_config_version(tenant_id=None):
+    """Invalidate the cached model handles of a tenant, or of every tenant if `tenant_id` is None, in all processes."""
+    key = _llm_config_version_keys(tenant_id)[0 if tenant_id is None else 1]
+    REDIS_CONN.incr(key)
+    _MODEL_HANDLES.evict(tenant_id)
+
+
+class _ModelHandleCache:
+    """
+    Process-wide LRU of what `LLM4Tenant` needs to build: the model config, the provider model
+    instance and the tenant's Langfuse client.
+
+    Entries carry the tenant's `llm_config_version` and expire after LLM_INSTANCE_CACHE_TTL
+    seconds, so a stale handle survives a missed invalidation for a bounded time only.
+    """
+
+    def __init__(self, capacity=LLM_INSTANCE_CACHE_SIZE, ttl=LLM_INSTANCE_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            hit = self._lru.get(key)
+            if not hit:
+                return None
+            if hit[0] != version or time.monotonic() - hit[1] > self.ttl:
+                del self._lru[key]
+                return None
+            self._lru.move_to_end(key)
+            return hit[2]
+
+    def put(self, key, version, value):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._lru[key] = (version, time.monotonic(), value)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.capacity:
+                self._lru.popitem(last=False)
+
+    def evict(self, tenant_id=None):
+        with self._lock:
+            if tenant_id is None:
+                self._lru.clear()
+                return
+            for key in [k for k in self._lru if k[1] == tenant_id]:
+                del self._lru[key]
+
+
+_MODEL_HANDLES = _ModelHandleCache()
+_EMBEDDING_DIMS = {}  # LLM4Tenant.cache_namespace -> vector dimension
+
+
 class LLM4Tenant:
     def __init__(self, tenant_id, llm_type, llm_name=None, lang="Chinese", **kwargs):
         self.tenant_id = tenant_id
         self.llm_type = llm_type
         self.llm_name = llm_name
-        self.mdl = TenantLLMService.model_instance(tenant_id, llm_type, llm_name, lang=lang, **kwargs)
-        assert self.mdl, "Can't find model for {}/{}/{}".format(tenant_id, llm_type, llm_name)
-        model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
+        version = llm_config_version(tenant_id)
+        model_config, mdl = self._model_handle(version, tenant_id, llm_type, llm_name, lang, **kwargs)
+        # Each bundle gets its own shallow copy, so `bind_tools` stays local while HTTP clients are shared.
+        self.mdl = copy.copy(mdl)
         self.max_length = model_config.get("max_tokens", 8192)
+        # Identifies the deployment serving the model, so tenants can share cached embeddings only when
+        # they are computed by the same model behind the same endpoint.
+        self.cache_namespace = "{}\x00{}\x00{}".format(model_config.get("llm_factory", ""), model_config.get("api_base", ""),
+                                                        model_config.get("llm_name", llm_name))
 
         self.is_tools = model_config.get("is_tools", False)
         self.verbose_tool_use = kwargs.get("verbose_tool_use")
 
+        self.langfuse = self._langfuse(version, tenant_id)
+        if self.langfuse:
+            trace_id = self.langfuse.create_trace_id()
+            self.trace_context = {"trace_id": trace_id}
+
+    @property
+    def embedding_dim(self) -> int | None:
+        """Dimension of the vectors of this model, known once it has encoded something in this process."""
+        return _EMBEDDING_DIMS.get(self.cache_namespace)
+
+    def _learn_embedding_dim(self, vectors):
+        if len(vectors):
+            _EMBEDDING_DIMS[self.cache_namespace] = len(vectors[0])
+
+    @staticmethod
+    def _model_handle(version, tenant_id, llm_type, llm_name, lang, **kwargs):
+        key = ("model", tenant_id, llm_type, llm_name, lang, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            key = None
+        handle = _MODEL_HANDLES.get(key, version) if key else None
+        if handle:
+            return handle
+        model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
+        mdl = TenantLLMService.model_instance(tenant_id, llm_type, llm_name, lang=lang, model_config=dict(model_config), **kwargs)
+        assert mdl, "Can't find model for {}/{}/{}".format(tenant_id, llm_type, llm_name)
+        if key:
+            _MODEL_HANDLES.put(key, version, (model_config, mdl))
+        return model_config, mdl
+
+    @staticmethod
+    def _langfuse(version, tenant_id):
+        key = ("langfuse", tenant_id)
+        handle = _MODEL_HANDLES.get(key, version)
+        if handle:
+            return handle[0]
+        langfuse = None
         langfuse_keys = TenantLangfuseService.filter_by_tenant(tenant_id=tenant_id)
-        self.langfuse = None
         if langfuse_keys:
             langfuse = Langfuse(public_key=langfuse_keys.public_key, secret_key=langfuse_keys.secret_key,
                                 host=langfuse_keys.host)
-            if langfuse.auth_check():
-                self.langfuse = langfuse
-                trace_id = self.langfuse.create_trace_id()
-                self.trace_context = {"trace_id": trace_id}
+            if not langfuse.auth_check():
+                langfuse = None
+        _MODEL_HANDLES.put(key, version, (langfuse,))
+        return langfuse
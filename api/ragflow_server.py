@@ -34,7 +34,7 @@ import uuid
 from werkzeug.serving import run_simple
 from api.apps import app, smtp_mail_server
 from api.db.runtime_config import RuntimeConfig
-from api.db.services.document_service import DocumentService
+from api.db.services.document_service import DocumentService, DOC_PROGRESS_EVENT_BATCH
 from common.file_utils import get_project_base_directory
 from common import settings
 from api.db.db_models import init_database_tables as init_web_db
@@ -42,20 +42,29 @@ from api.db.init_data import init_web_data
 from common.versions import get_ragflow_version
 from common.config_utils import show_configs
 from rag.utils.mcp_tool_call_conn import shutdown_all_mcp_sessions
-from rag.utils.redis_conn import RedisDistributedLock
+from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
 
 stop_event = threading.Event()
 
 RAGFLOW_DEBUGPY_LISTEN = int(os.environ.get('RAGFLOW_DEBUGPY_LISTEN', "0"))
+DOC_PROGRESS_EVENT_WAIT = int(os.environ.get('DOC_PROGRESS_EVENT_WAIT', "1"))
+DOC_PROGRESS_RECONCILE_INTERVAL = int(os.environ.get('DOC_PROGRESS_RECONCILE_INTERVAL', "60"))
 
 def update_progress():
+    # Executors publish the documents whose tasks changed, so the lock holder only rolls those up.
+    # The full scan of unfinished documents is kept as a slower reconciliation, e.g. for queue lengths.
     lock_value = str(uuid.uuid4())
     redis_lock = RedisDistributedLock("update_progress", lock_value=lock_value, timeout=60)
     logging.info(f"update_progress lock_value: {lock_value}")
     while not stop_event.is_set():
+        wait = DOC_PROGRESS_EVENT_WAIT
         try:
             if redis_lock.acquire():
-                DocumentService.update_progress()
+                if time.time() - float(REDIS_CONN.get("update_progress_reconciled_at") or 0) >= DOC_PROGRESS_RECONCILE_INTERVAL:
+                    DocumentService.update_progress()
+                    REDIS_CONN.set("update_progress_reconciled_at", str(time.time()), exp=DOC_PROGRESS_RECONCILE_INTERVAL * 10)
+                if DocumentService.update_progress_from_events() >= DOC_PROGRESS_EVENT_BATCH:
+                    wait = 0
                 redis_lock.release()
         except Exception:
             logging.exception("update_progress exception")
@@ -64,7 +73,7 @@ def update_progress():
                 redis_lock.release()
             except Exception:
                 logging.exception("update_progress exception")
-            stop_event.wait(6)
+            stop_event.wait(wait)
 
 def signal_handler(sig, frame):
     logging.info("Received interrupt signal, shutting down...")
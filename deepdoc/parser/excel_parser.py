@@ -18,16 +18,19 @@ from io import BytesIO
 
 import pandas as pd
 from openpyxl import Workbook, load_workbook
+from openpyxl.utils.cell import range_boundaries
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
 
 from rag.nlp import find_codec
 
 # copied from `/openpyxl/cell/cell.py`
 ILLEGAL_CHARACTERS_RE = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
+MERGE_CELL_RE = re.compile(rb'<(?:\w+:)?mergeCell\s[^>]*?\bref="([A-Z]+[0-9]+:[A-Z]+[0-9]+)"')
 
 
 class RAGFlowExcelParser:
     @staticmethod
-    def _load_excel_to_workbook(file_like_object):
+    def _load_excel_to_workbook(file_like_object, read_only=False):
         if isinstance(file_like_object, bytes):
             file_like_object = BytesIO(file_like_object)
 
@@ -51,7 +54,7 @@ class RAGFlowExcelParser:
         # calamine has encoding issues with Korean text
         try:
             file_like_object.seek(0)
-            return load_workbook(file_like_object, data_only=True)
+            return load_workbook(file_like_object, read_only=read_only, data_only=True)
         except Exception as e_openpyxl:
             logging.info(f"openpyxl load error: {e_openpyxl}, try calamine instead")
             try:
@@ -61,6 +64,36 @@ class RAGFlowExcelParser:
             except Exception as e_calamine:
                 raise Exception(f"calamine error: {e_calamine}, original openpyxl error: {e_openpyxl}")
 
+    @staticmethod
+    def _sheet_rows(ws):
+        """Row count of `ws`, taken from the sheet dimension unless it cannot be trusted."""
+        if isinstance(ws, ReadOnlyWorksheet) and (ws.max_row is None or (ws.max_row, ws.max_column) == (1, 1)):
+            # some writers leave the dimension out or always set it to A1
+            ws.reset_dimensions()
+            return sum(1 for _ in ws.iter_rows(values_only=True))
+        return ws.max_row
+
+    @staticmethod
+    def _merged_ranges(ws):
+        """(min_col, min_row, max_col, max_row) of every merged range of `ws`."""
+        if not isinstance(ws, ReadOnlyWorksheet):
+            return [rng.bounds for rng in ws.merged_cells.ranges]
+        # Read-only sheets do not load <mergeCells>, which comes after <sheetData>. Scan the raw xml
+        # for it rather than parsing the cells; markup inside cell text is always escaped.
+        res, tail = [], b""
+        with ws._get_source() as src:
+            while True:
+                buf = src.read(1 << 20)
+                if not buf:
+                    break
+                buf = tail + buf
+                end = 0
+                for m in MERGE_CELL_RE.finditer(buf):
+                    res.append(range_boundaries(m.group(1).decode("ascii")))
+                    end = m.end()
+                tail = buf[max(end, len(buf) - 256):]
+        return res
+
     @staticmethod
     def _clean_dataframe(df: pd.DataFrame):
         def clean_string(s):
@@ -197,16 +230,17 @@ class RAGFlowExcelParser:
     @staticmethod
     def row_number(fnm, binary):
         if fnm.split(".")[-1].lower().find("xls") >= 0:
-            wb = RAGFlowExcelParser._load_excel_to_workbook(BytesIO(binary))
+            wb = RAGFlowExcelParser._load_excel_to_workbook(BytesIO(binary), read_only=True)
             total = 0
-            
-            for sheetname in wb.sheetnames:
-               try:
-                   ws = wb[sheetname]
-                   total += len(list(ws.rows))
-               except Exception as e:
-                   logging.warning(f"Skip sheet '{sheetname}' due to rows access error: {e}")
-                   continue
+            try:
+                for sheetname in wb.sheetnames:
+                    try:
+                        total += RAGFlowExcelParser._sheet_rows(wb[sheetname])
+                    except Exception as e:
+                        logging.warning(f"Skip sheet '{sheetname}' due to rows access error: {e}")
+                        continue
+            finally:
+                wb.close()
             return total
 
         if fnm.split(".")[-1].lower() in ["csv", "txt"]:
@@ -16,14 +16,18 @@
 
 import logging
 import math
+import multiprocessing
 import os
 import random
 import re
 import sys
 import threading
-from collections import Counter, defaultdict
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from copy import deepcopy
 from io import BytesIO
+from multiprocessing import shared_memory
 from timeit import default_timer as timer
 
 import numpy as np
@@ -46,6 +50,53 @@ LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
 if LOCK_KEY_pdfplumber not in sys.modules:
     sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
 
+# Number of OCR worker processes used when there is no more than one GPU, 0 keeps OCR in the parsing process.
+OCR_PROCESS_NUM = int(os.environ.get("OCR_PROCESS_NUM", "0"))
+
+_ocr_pool = None
+_ocr_pool_lock = threading.Lock()
+_worker_ocr = None
+_worker_layouters = {}
+
+
+def _get_ocr_pool():
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is None:
+            # spawned, not forked: the parsing process is multi-threaded and already holds ONNX sessions and locks
+            _ocr_pool = ProcessPoolExecutor(max_workers=OCR_PROCESS_NUM, mp_context=multiprocessing.get_context("spawn"))
+        return _ocr_pool
+
+
+def _reset_ocr_pool():
+    global _ocr_pool
+    with _ocr_pool_lock:
+        if _ocr_pool is not None:
+            _ocr_pool.shutdown(wait=False, cancel_futures=True)
+        _ocr_pool = None
+
+
+def _ocr_page_in_worker(shm_name, shape, dtype, pagenum, chars, ZM, mean_height, layout_domain):
+    """
+    Runs in an OCR worker process, which loads its own OCR model and one layout model per
+    domain on first use. Layouts are detected only if `layout_domain` is given.
+    """
+    global _worker_ocr
+    if _worker_ocr is None:
+        _worker_ocr = OCR()
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        img = np.ndarray(shape, dtype=dtype, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+    bxs, lefted_chars, mean_height = RAGFlowPdfParser._ocr_page(_worker_ocr, pagenum, img, chars, ZM, mean_height)
+    layouts = None
+    if layout_domain:
+        if layout_domain not in _worker_layouters:
+            _worker_layouters[layout_domain] = LayoutRecognizer(layout_domain)
+        layouts = _worker_layouters[layout_domain].forward([img], thr=0.2)[0]
+    return bxs, lefted_chars, mean_height, layouts
+
 
 class RAGFlowPdfParser:
     def __init__(self, **kwargs):
@@ -74,6 +125,7 @@ class RAGFlowPdfParser:
             recognizer_domain = "layout." + self.model_speciess
         else:
             recognizer_domain = "layout"
+        self.layout_domain = recognizer_domain
 
         if layout_recognizer_type == "ascend":
             logging.debug("Using Ascend LayoutRecognizer")
@@ -278,14 +330,21 @@ class RAGFlowPdfParser:
                 b["SP"] = ii
 
     def __ocr(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
+        bxs, lefted_chars, self.mean_height[pagenum - 1] = self._ocr_page(self.ocr, pagenum, img, chars, ZM, self.mean_height[pagenum - 1], device_id)
+        self.lefted_chars.extend(lefted_chars)
+        self.boxes.append(bxs)
+
+    @staticmethod
+    def _ocr_page(ocr, pagenum, img, chars, ZM=3, mean_height=0, device_id: int | None = None):
+        """OCR one page image, returns its text boxes, the chars not merged into any box and the page's mean height."""
         start = timer()
-        bxs = self.ocr.detect(np.array(img), device_id)
+        bxs = ocr.detect(np.array(img), device_id)
         logging.info(f"__ocr detecting boxes of a image cost ({timer() - start}s)")
 
         start = timer()
+        lefted_chars = []
         if not bxs:
-            self.boxes.append([])
-            return
+            return [], lefted_chars, mean_height
         bxs = [(line[0], line[1][0]) for line in bxs]
         bxs = Recognizer.sort_Y_firstly(
             [
@@ -293,19 +352,19 @@ class RAGFlowPdfParser:
                 for b, t in bxs
                 if b[0][0] <= b[1][0] and b[0][1] <= b[-1][1]
             ],
-            self.mean_height[pagenum - 1] / 3,
+            mean_height / 3,
         )
 
         # merge chars in the same rect
         for c in chars:
             ii = Recognizer.find_overlapped(c, bxs)
             if ii is None:
-                self.lefted_chars.append(c)
+                lefted_chars.append(c)
                 continue
             ch = c["bottom"] - c["top"]
             bh = bxs[ii]["bottom"] - bxs[ii]["top"]
             if abs(ch - bh) / max(ch, bh) >= 0.7 and c["text"] != " ":
-                self.lefted_chars.append(c)
+                lefted_chars.append(c)
                 continue
             bxs[ii]["chars"].append(c)
 
@@ -329,22 +388,95 @@ class RAGFlowPdfParser:
         for b in bxs:
             if not b["text"]:
                 left, right, top, bott = b["x0"] * ZM, b["x1"] * ZM, b["top"] * ZM, b["bottom"] * ZM
-                b["box_image"] = self.ocr.get_rotate_crop_image(img_np, np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32))
+                b["box_image"] = ocr.get_rotate_crop_image(img_np, np.array([[left, top], [right, top], [right, bott], [left, bott]], dtype=np.float32))
                 boxes_to_reg.append(b)
             del b["txt"]
-        texts = self.ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
+        texts = ocr.recognize_batch([b["box_image"] for b in boxes_to_reg], device_id)
         for i in range(len(boxes_to_reg)):
             boxes_to_reg[i]["text"] = texts[i]
             del boxes_to_reg[i]["box_image"]
         logging.info(f"__ocr recognize {len(bxs)} boxes cost {timer() - start}s")
         bxs = [b for b in bxs if b["text"]]
-        if self.mean_height[pagenum - 1] == 0:
-            self.mean_height[pagenum - 1] = np.median([b["bottom"] - b["top"] for b in bxs])
-        self.boxes.append(bxs)
+        if mean_height == 0:
+            mean_height = np.median([b["bottom"] - b["top"] for b in bxs])
+        return bxs, lefted_chars, mean_height
+
+    @staticmethod
+    def _mark_char_spaces(chars):
+        j = 0
+        while j + 1 < len(chars):
+            if (
+                chars[j]["text"]
+                and chars[j + 1]["text"]
+                and re.match(r"[0-9a-zA-Z,.:;!%]+", chars[j]["text"] + chars[j + 1]["text"])
+                and chars[j + 1]["x0"] - chars[j]["x1"] >= min(chars[j + 1]["width"], chars[j]["width"]) / 2
+            ):
+                chars[j]["text"] += " "
+            j += 1
+
+    def __ocr_in_pool(self, page_chars, ZM, callback=None):
+        """
+        OCR the pages in OCR_PROCESS_NUM worker processes, each holding its own ONNX sessions.
+
+        Page images are handed over in shared memory and at most two pages per worker are in flight.
+        Results are merged in page order. The ONNX layout detection runs in the workers as well.
+        """
+        with_layout = type(self.layouter) is LayoutRecognizer and self.layouter.client is None
+        layout_domain = self.layout_domain if with_layout else None
+        pool = _get_ocr_pool()
+        in_flight = deque()
+        layouts = []
+
+        def collect():
+            i, shm, future = in_flight.popleft()
+            try:
+                bxs, lefted_chars, self.mean_height[i], lts = future.result()
+            finally:
+                shm.close()
+                shm.unlink()
+            self.lefted_chars.extend(lefted_chars)
+            self.boxes.append(bxs)
+            layouts.append(lts)
+            if callback and i % 6 == 5:
+                callback((i + 1) * 0.6 / len(self.page_images))
+
+        try:
+            for i, (img, chars) in enumerate(zip(self.page_images, page_chars)):
+                self._mark_char_spaces(chars)
+                arr = np.asarray(img)
+                shm = shared_memory.SharedMemory(create=True, size=arr.nbytes)
+                try:
+                    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+                    future = pool.submit(_ocr_page_in_worker, shm.name, arr.shape, arr.dtype.str, i + 1, chars, ZM, self.mean_height[i], layout_domain)
+                except Exception:
+                    shm.close()
+                    shm.unlink()
+                    raise
+                in_flight.append((i, shm, future))
+                if len(in_flight) >= 2 * OCR_PROCESS_NUM:
+                    collect()
+            while in_flight:
+                collect()
+        except Exception as e:
+            while in_flight:
+                _, shm, future = in_flight.popleft()
+                future.cancel()
+                shm.close()
+                shm.unlink()
+            if isinstance(e, BrokenProcessPool):
+                _reset_ocr_pool()
+            raise
+        if with_layout:
+            self._page_layouts = layouts
 
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
-        self.boxes, self.page_layout = self.layouter(self.page_images, self.boxes, ZM, drop=drop)
+        layouts = getattr(self, "_page_layouts", None)
+        if layouts is not None and len(layouts) == len(self.page_images):
+            # already detected by the OCR worker processes
+            self.boxes, self.page_layout = self.layouter(self.page_images, self.boxes, ZM, drop=drop, layouts=layouts)
+        else:
+            self.boxes, self.page_layout = self.layouter(self.page_images, self.boxes, ZM, drop=drop)
         # cumlative Y
         for i in range(len(self.boxes)):
             self.boxes[i]["top"] += self.page_cum_height[self.boxes[i]["page_number"] - 1]
@@ -1080,16 +1212,7 @@ class RAGFlowPdfParser:
             self.is_english = False
 
         async def __img_ocr(i, id, img, chars, limiter):
-            j = 0
-            while j + 1 < len(chars):
-                if (
-                    chars[j]["text"]
-                    and chars[j + 1]["text"]
-                    and re.match(r"[0-9a-zA-Z,.:;!%]+", chars[j]["text"] + chars[j + 1]["text"])
-                    and chars[j + 1]["x0"] - chars[j]["x1"] >= min(chars[j + 1]["width"], chars[j]["width"]) / 2
-                ):
-                    chars[j]["text"] += " "
-                j += 1
+            self._mark_char_spaces(chars)
 
             if limiter:
                 async with limiter:
@@ -1100,29 +1223,33 @@ class RAGFlowPdfParser:
             if callback and i % 6 == 5:
                 callback((i + 1) * 0.6 / len(self.page_images))
 
-        async def __img_ocr_launcher():
-            def __ocr_preprocess():
-                chars = self.page_chars[i] if not self.is_english else []
-                self.mean_height.append(np.median(sorted([c["height"] for c in chars])) if chars else 0)
-                self.mean_width.append(np.median(sorted([c["width"] for c in chars])) if chars else 8)
-                self.page_cum_height.append(img.size[1] / zoomin)
-                return chars
+        def __ocr_preprocess(i, img):
+            chars = self.page_chars[i] if not self.is_english else []
+            self.mean_height.append(np.median(sorted([c["height"] for c in chars])) if chars else 0)
+            self.mean_width.append(np.median(sorted([c["width"] for c in chars])) if chars else 8)
+            self.page_cum_height.append(img.size[1] / zoomin)
+            return chars
 
+        async def __img_ocr_launcher():
             if self.parallel_limiter:
                 async with trio.open_nursery() as nursery:
                     for i, img in enumerate(self.page_images):
-                        chars = __ocr_preprocess()
+                        chars = __ocr_preprocess(i, img)
 
                         nursery.start_soon(__img_ocr, i, i % settings.PARALLEL_DEVICES, img, chars, self.parallel_limiter[i % settings.PARALLEL_DEVICES])
                         await trio.sleep(0.1)
             else:
                 for i, img in enumerate(self.page_images):
-                    chars = __ocr_preprocess()
+                    chars = __ocr_preprocess(i, img)
                     await __img_ocr(i, 0, img, chars, None)
 
         start = timer()
 
-        trio.run(__img_ocr_launcher)
+        self._page_layouts = None
+        if OCR_PROCESS_NUM > 1 and settings.PARALLEL_DEVICES <= 1:
+            self.__ocr_in_pool([__ocr_preprocess(i, img) for i, img in enumerate(self.page_images)], zoomin, callback)
+        else:
+            trio.run(__img_ocr_launcher)
 
         logging.info(f"__images__ {len(self.page_images)} pages cost {timer() - start}s")
 
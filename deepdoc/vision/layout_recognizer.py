@@ -60,15 +60,17 @@ class LayoutRecognizer(Recognizer):
 
             self.client = DLAClient(os.environ["TENSORRT_DLA_SVR"])
 
-    def __call__(self, image_list, ocr_res, scale_factor=3, thr=0.2, batch_size=16, drop=True):
+    def __call__(self, image_list, ocr_res, scale_factor=3, thr=0.2, batch_size=16, drop=True, layouts=None):
         def __is_garbage(b):
             patt = [r"^•+$", "^[0-9]{1,2} / ?[0-9]{1,2}$", r"^[0-9]{1,2} of [0-9]{1,2}$", "^http://[^ ]{12,}", "\\(cid *: *[0-9]+ *\\)"]
             return any([re.search(p, b["text"]) for p in patt])
 
-        if self.client:
-            layouts = self.client.predict(image_list)
-        else:
-            layouts = super().__call__(image_list, thr, batch_size)
+        # `layouts` are the raw detections of `forward`, if they were already computed elsewhere
+        if layouts is None:
+            if self.client:
+                layouts = self.client.predict(image_list)
+            else:
+                layouts = super().__call__(image_list, thr, batch_size)
         # save_results(image_list, layouts, self.labels, output_dir='output/', threshold=0.7)
         assert len(image_list) == len(ocr_res)
         # Tag layout type
@@ -35,6 +35,10 @@ GRAPH_FIELD_SEP = "<SEP>"
 ErrorHandlerFn = Callable[[BaseException | None, str | None, dict | None], None]
 
 chat_limiter = trio.CapacityLimiter(int(os.environ.get("MAX_CONCURRENT_CHATS", 10)))
+# Number of graph chunks per doc store insert, 0 picks a size suited to the doc engine.
+GRAPH_BULK_SIZE = int(os.environ.get("GRAPH_BULK_SIZE", 0))
+# Approximate payload bytes per doc store insert; the graph and subgraph chunks can each hold a whole graph.
+GRAPH_BULK_BYTES = int(os.environ.get("GRAPH_BULK_BYTES", 10 * 1024 * 1024))
 
 
 @dataclasses.dataclass
@@ -108,26 +112,37 @@ def set_llm_cache(llmnm, txt, v, history, genconf):
     REDIS_CONN.set(k, v.encode("utf-8"), 24 * 3600)
 
 
-def get_embed_cache(llmnm, txt):
+def _embed_cache_key(llmnm, txt):
     hasher = xxhash.xxh64()
     hasher.update(str(llmnm).encode("utf-8"))
     hasher.update(str(txt).encode("utf-8"))
+    return hasher.hexdigest()
 
-    k = hasher.hexdigest()
-    bin = REDIS_CONN.get(k)
+
+def get_embed_cache(llmnm, txt):
+    bin = REDIS_CONN.get(_embed_cache_key(llmnm, txt))
     if not bin:
         return
     return np.array(json.loads(bin))
 
 
 def set_embed_cache(llmnm, txt, arr):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
-
-    k = hasher.hexdigest()
     arr = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
-    REDIS_CONN.set(k, arr.encode("utf-8"), 24 * 3600)
+    REDIS_CONN.set(_embed_cache_key(llmnm, txt), arr.encode("utf-8"), 24 * 3600)
+
+
+def get_embed_cache_batch(llmnm, txts):
+    res = []
+    for bin in REDIS_CONN.mget([_embed_cache_key(llmnm, txt) for txt in txts]):
+        res.append(np.array(json.loads(bin)) if bin else None)
+    return res
+
+
+def set_embed_cache_batch(llmnm, txts, arrs):
+    mapping = {}
+    for txt, arr in zip(txts, arrs):
+        mapping[_embed_cache_key(llmnm, txt)] = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
+    REDIS_CONN.mset(mapping, 24 * 3600)
 
 
 def get_tags_from_cache(kb_ids):
@@ -294,9 +309,7 @@ def chunk_id(chunk):
     return xxhash.xxh64((chunk["content_with_weight"] + chunk["kb_id"]).encode("utf-8")).hexdigest()
 
 
-async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
-    global chat_limiter
-    enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+def _graph_node_chunk(kb_id, ent_name, meta):
     chunk = {
         "id": get_uuid(),
         "important_kwd": [ent_name],
@@ -311,6 +324,13 @@ async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
         "available_int": 0,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
+    return chunk
+
+
+async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
+    global chat_limiter
+    enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+    chunk = _graph_node_chunk(kb_id, ent_name, meta)
     ebd = get_embed_cache(embd_mdl.llm_name, ent_name)
     if ebd is None:
         async with chat_limiter:
@@ -345,8 +365,7 @@ def get_relation(tenant_id, kb_id, from_ent_name, to_ent_name, size=1):
     return res
 
 
-async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta, chunks):
-    enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+def _graph_edge_chunk(kb_id, from_ent_name, to_ent_name, meta):
     chunk = {
         "id": get_uuid(),
         "from_entity_kwd": from_ent_name,
@@ -361,6 +380,12 @@ async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta,
         "available_int": 0,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
+    return chunk
+
+
+async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta, chunks):
+    enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+    chunk = _graph_edge_chunk(kb_id, from_ent_name, to_ent_name, meta)
     txt = f"{from_ent_name}->{to_ent_name}"
     ebd = get_embed_cache(embd_mdl.llm_name, txt)
     if ebd is None:
@@ -374,6 +399,37 @@ async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta,
     chunks.append(chunk)
 
 
+async def graph_chunks_embedding(embd_mdl, chunks, cache_keys, texts, callback=None):
+    """
+    Set the vector of every graph chunk, embedding `texts[i]` for `chunks[i]` unless `cache_keys[i]` is in the embedding cache.
+    Cache misses are embedded in batches of EMBEDDING_BATCH_SIZE.
+    """
+    enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+    vectors = await trio.to_thread.run_sync(lambda: get_embed_cache_batch(embd_mdl.llm_name, cache_keys))
+    missed = [i for i, v in enumerate(vectors) if v is None]
+    done = 0
+
+    async def embed(batch):
+        nonlocal done
+        async with chat_limiter:
+            with trio.fail_after(3 * len(batch) if enable_timeout_assertion else 300000000):
+                ebds, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode([texts[i] for i in batch]))
+        for i, ebd in zip(batch, ebds):
+            vectors[i] = ebd
+        await trio.to_thread.run_sync(lambda: set_embed_cache_batch(embd_mdl.llm_name, [cache_keys[i] for i in batch], ebds))
+        done += len(batch)
+        if callback and (done % 1000 < len(batch) or done == len(missed)):
+            callback(msg=f"Get embedding of nodes and edges: {done}/{len(missed)}")
+
+    async with trio.open_nursery() as nursery:
+        for b in range(0, len(missed), settings.EMBEDDING_BATCH_SIZE):
+            nursery.start_soon(embed, missed[b : b + settings.EMBEDDING_BATCH_SIZE])
+
+    for chunk, ebd in zip(chunks, vectors):
+        assert ebd is not None
+        chunk["q_%d_vec" % len(ebd)] = ebd
+
+
 async def does_graph_contains(tenant_id, kb_id, doc_id):
     # Get doc_ids of graph
     fields = ["source_id"]
@@ -429,16 +485,20 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
         await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["entity"], "entity_kwd": sorted(change.removed_nodes)}, search.index_name(tenant_id), kb_id)
 
     if change.removed_edges:
+        # A relation chunk matches when both its entities do, so one terms query per source entity deletes exactly the removed edges.
+        removed_edges = defaultdict(set)
+        for from_node, to_node in change.removed_edges:
+            removed_edges[from_node].add(to_node)
 
-        async def del_edges(from_node, to_node):
+        async def del_edges(from_node, to_nodes):
             async with chat_limiter:
                 await trio.to_thread.run_sync(
-                    settings.docStoreConn.delete, {"knowledge_graph_kwd": ["relation"], "from_entity_kwd": from_node, "to_entity_kwd": to_node}, search.index_name(tenant_id), kb_id
+                    settings.docStoreConn.delete, {"knowledge_graph_kwd": ["relation"], "from_entity_kwd": from_node, "to_entity_kwd": sorted(to_nodes)}, search.index_name(tenant_id), kb_id
                 )
 
         async with trio.open_nursery() as nursery:
-            for from_node, to_node in change.removed_edges:
-                nursery.start_soon(del_edges, from_node, to_node)
+            for from_node, to_nodes in removed_edges.items():
+                nursery.start_soon(del_edges, from_node, to_nodes)
 
     now = trio.current_time()
     if callback:
@@ -475,22 +535,25 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
             }
         )
 
-    async with trio.open_nursery() as nursery:
-        for ii, node in enumerate(change.added_updated_nodes):
-            node_attrs = graph.nodes[node]
-            nursery.start_soon(graph_node_to_chunk, kb_id, embd_mdl, node, node_attrs, chunks)
-            if ii % 100 == 9 and callback:
-                callback(msg=f"Get embedding of nodes: {ii}/{len(change.added_updated_nodes)}")
-
-    async with trio.open_nursery() as nursery:
-        for ii, (from_node, to_node) in enumerate(change.added_updated_edges):
+    def graph_chunks():
+        ent_chunks, cache_keys, texts = [], [], []
+        for node in change.added_updated_nodes:
+            ent_chunks.append(_graph_node_chunk(kb_id, node, graph.nodes[node]))
+            cache_keys.append(node)
+            texts.append(node)
+        for from_node, to_node in change.added_updated_edges:
             edge_attrs = graph.get_edge_data(from_node, to_node)
             if not edge_attrs:
                 # added_updated_edges could record a non-existing edge if both from_node and to_node participate in nodes merging.
                 continue
-            nursery.start_soon(graph_edge_to_chunk, kb_id, embd_mdl, from_node, to_node, edge_attrs, chunks)
-            if ii % 100 == 9 and callback:
-                callback(msg=f"Get embedding of edges: {ii}/{len(change.added_updated_edges)}")
+            ent_chunks.append(_graph_edge_chunk(kb_id, from_node, to_node, edge_attrs))
+            cache_keys.append(f"{from_node}->{to_node}")
+            texts.append(f"{from_node}->{to_node}: {edge_attrs['description']}")
+        return ent_chunks, cache_keys, texts
+
+    ent_chunks, cache_keys, texts = await trio.to_thread.run_sync(graph_chunks)
+    await graph_chunks_embedding(embd_mdl, ent_chunks, cache_keys, texts, callback)
+    chunks.extend(ent_chunks)
 
     now = trio.current_time()
     if callback:
@@ -498,12 +561,14 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
     start = now
 
     enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
-    es_bulk_size = 4
-    for b in range(0, len(chunks), es_bulk_size):
-        with trio.fail_after(3 if enable_timeout_assertion else 30000000):
-            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b : b + es_bulk_size], search.index_name(tenant_id), kb_id))
-        if b % 100 == es_bulk_size and callback:
-            callback(msg=f"Insert chunks: {b}/{len(chunks)}")
+    es_bulk_size = GRAPH_BULK_SIZE or (64 if settings.DOC_ENGINE.lower() == "infinity" else 256)
+    inserted = 0
+    for batch in _bulk_batches(chunks, es_bulk_size, GRAPH_BULK_BYTES):
+        with trio.fail_after(3 * es_bulk_size if enable_timeout_assertion else 30000000):
+            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(batch, search.index_name(tenant_id), kb_id))
+        inserted += len(batch)
+        if callback:
+            callback(msg=f"Insert chunks: {inserted}/{len(chunks)}")
         if doc_store_result:
             error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
             raise Exception(error_message)
@@ -512,6 +577,32 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
         callback(msg=f"set_graph added/updated {len(change.added_updated_nodes)} nodes and {len(change.added_updated_edges)} edges from index in {now - start:.2f}s.")
 
 
+def _chunk_bytes(chunk):
+    size = 0
+    for k, v in chunk.items():
+        if isinstance(v, str):
+            size += len(v.encode("utf-8", "surrogatepass"))
+        elif k.endswith("_vec"):
+            size += 20 * len(v)  # floats are sent as decimal text
+        else:
+            size += len(str(v))
+    return size
+
+
+def _bulk_batches(chunks, max_count, max_bytes):
+    """Split chunks into consecutive batches of at most `max_count` chunks and, unless a single chunk is larger, `max_bytes`."""
+    batch, size = [], 0
+    for chunk in chunks:
+        chunk_size = _chunk_bytes(chunk)
+        if batch and (len(batch) >= max_count or size + chunk_size > max_bytes):
+            yield batch
+            batch, size = [], 0
+        batch.append(chunk)
+        size += chunk_size
+    if batch:
+        yield batch
+
+
 def is_continuous_subsequence(subseq, seq):
     def find_all_indexes(tup, value):
         indexes = []
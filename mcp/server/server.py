@@ -14,6 +14,7 @@
 #  limitations under the License.
 #
 
+import asyncio
 import json
 import logging
 import random
@@ -21,10 +22,11 @@ import time
 from collections import OrderedDict
 from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from functools import wraps
 
 import click
-import requests
+import httpx
 from starlette.applications import Starlette
 from starlette.middleware import Middleware
 from starlette.responses import JSONResponse, Response
@@ -54,14 +56,23 @@ TRANSPORT_SSE_ENABLED = True
 TRANSPORT_STREAMABLE_HTTP_ENABLED = True
 JSON_RESPONSE = True
 
+_API_KEY: ContextVar[str | None] = ContextVar("ragflow_api_key", default=None)
+
 
 class RAGFlowConnector:
     _MAX_DATASET_CACHE = 32
     _MAX_DOCUMENT_CACHE = 128
     _CACHE_TTL = 300
+    _CACHE_STALE_TTL = 3600  # expired entries are still served, and refreshed in the background, for this long
+    _METADATA_FETCH_CONCURRENCY = 8
+    _MAX_CONNECTIONS = 100
+    _MAX_KEEPALIVE_CONNECTIONS = 20
 
     _dataset_metadata_cache: OrderedDict[str, tuple[dict, float | int]] = OrderedDict()  # "dataset_id" -> (metadata, expiry_ts)
     _document_metadata_cache: OrderedDict[str, tuple[list[tuple[str, dict]], float | int]] = OrderedDict()  # "dataset_id" -> ([(document_id, doc_metadata)], expiry_ts)
+    _refreshing: dict[tuple[str, str], asyncio.Task] = {}  # (fetch, "dataset_id") -> background revalidation
+    # One pooled client for every session; lifespans are entered per MCP session, not per process.
+    _client: httpx.AsyncClient | None = None
 
     def __init__(self, base_url: str, version="v1"):
         self.base_url = base_url
@@ -69,17 +80,45 @@ class RAGFlowConnector:
         self.api_url = f"{self.base_url}/api/{self.version}"
 
     def bind_api_key(self, api_key: str):
-        self.api_key = api_key
-        self.authorization_header = {"Authorization": "{} {}".format("Bearer", self.api_key)}
-
-    def _post(self, path, json=None, stream=False, files=None):
+        # Concurrent tool calls share the connector, so the key is bound to the calling task.
+        _API_KEY.set(api_key)
+
+    @property
+    def api_key(self):
+        return _API_KEY.get()
+
+    @property
+    def authorization_header(self):
+        return {"Authorization": "{} {}".format("Bearer", self.api_key)}
+
+    @classmethod
+    def _get_client(cls) -> httpx.AsyncClient:
+        if cls._client is None or cls._client.is_closed:
+            cls._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=cls._MAX_CONNECTIONS, max_keepalive_connections=cls._MAX_KEEPALIVE_CONNECTIONS),
+                timeout=httpx.Timeout(None, connect=10.0),
+            )
+        return cls._client
+
+    @classmethod
+    async def aclose(cls):
+        for task in list(cls._refreshing.values()):
+            task.cancel()
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+
+    async def _post(self, path, json=None, files=None):
         if not self.api_key:
             return None
-        res = requests.post(url=self.api_url + path, json=json, headers=self.authorization_header, stream=stream, files=files)
+        res = await self._get_client().post(url=self.api_url + path, json=json, headers=self.authorization_header, files=files)
         return res
 
-    def _get(self, path, params=None, json=None):
-        res = requests.get(url=self.api_url + path, params=params, headers=self.authorization_header, json=json)
+    async def _get(self, path, params=None, json=None):
+        if params:
+            # httpx sends None-valued params as empty strings
+            params = {k: v for k, v in params.items() if v is not None}
+        res = await self._get_client().request("GET", url=self.api_url + path, params=params, headers=self.authorization_header, json=json)
         return res
 
     def _is_cache_valid(self, ts):
@@ -89,12 +128,22 @@ class RAGFlowConnector:
         offset = random.randint(-30, 30)
         return time.time() + self._CACHE_TTL + offset
 
+    def _revalidate(self, fetch, dataset_id):
+        key = (fetch.__name__, dataset_id)
+        if key in self._refreshing:
+            return
+        task = asyncio.get_running_loop().create_task(fetch(dataset_id))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
     def _get_cached_dataset_metadata(self, dataset_id):
         entry = self._dataset_metadata_cache.get(dataset_id)
         if entry:
             data, ts = entry
-            if self._is_cache_valid(ts):
+            if self._is_cache_valid(ts + self._CACHE_STALE_TTL):
                 self._dataset_metadata_cache.move_to_end(dataset_id)
+                if not self._is_cache_valid(ts):
+                    self._revalidate(self._fetch_dataset_metadata, dataset_id)
                 return data
         return None
 
@@ -108,8 +157,10 @@ class RAGFlowConnector:
         entry = self._document_metadata_cache.get(dataset_id)
         if entry:
             data_list, ts = entry
-            if self._is_cache_valid(ts):
+            if self._is_cache_valid(ts + self._CACHE_STALE_TTL):
                 self._document_metadata_cache.move_to_end(dataset_id)
+                if not self._is_cache_valid(ts):
+                    self._revalidate(self._fetch_document_metadata, dataset_id)
                 return {doc_id: doc_meta for doc_id, doc_meta in data_list}
         return None
 
@@ -119,10 +170,10 @@ class RAGFlowConnector:
         if len(self._document_metadata_cache) > self._MAX_DOCUMENT_CACHE:
             self._document_metadata_cache.popitem(last=False)
 
-    def list_datasets(self, page: int = 1, page_size: int = 1000, orderby: str = "create_time", desc: bool = True, id: str | None = None, name: str | None = None):
-        res = self._get("/datasets", {"page": page, "page_size": page_size, "orderby": orderby, "desc": desc, "id": id, "name": name})
-        if not res:
-            raise Exception([types.TextContent(type="text", text=res.get("Cannot process this operation."))])
+    async def list_datasets(self, page: int = 1, page_size: int = 1000, orderby: str = "create_time", desc: bool = True, id: str | None = None, name: str | None = None):
+        res = await self._get("/datasets", {"page": page, "page_size": page_size, "orderby": orderby, "desc": desc, "id": id, "name": name})
+        if res is None or res.is_error:
+            raise Exception([types.TextContent(type="text", text="Cannot process this operation.")])
 
         res = res.json()
         if res.get("code") == 0:
@@ -133,7 +184,7 @@ class RAGFlowConnector:
             return "\n".join(result_list)
         return ""
 
-    def retrieval(
+    async def retrieval(
         self,
         dataset_ids,
         document_ids=None,
@@ -152,7 +203,7 @@ class RAGFlowConnector:
         
         # If no dataset_ids provided or empty list, get all available dataset IDs
         if not dataset_ids:
-            dataset_list_str = self.list_datasets()
+            dataset_list_str = await self.list_datasets()
             dataset_ids = []
             
             # Parse the dataset list to extract IDs
@@ -178,19 +229,19 @@ class RAGFlowConnector:
             "dataset_ids": dataset_ids,
             "document_ids": document_ids,
         }
-        # Send a POST request to the backend service (using requests library as an example, actual implementation may vary)
-        res = self._post("/retrieval", json=data_json)
-        if not res:
-            raise Exception([types.TextContent(type="text", text=res.get("Cannot process this operation."))])
+        # Fetch document metadata and dataset information while the backend runs the retrieval
+        res, (document_cache, dataset_cache) = await asyncio.gather(
+            self._post("/retrieval", json=data_json),
+            self._get_document_metadata_cache(dataset_ids, force_refresh=force_refresh),
+        )
+        if res is None or res.is_error:
+            raise Exception([types.TextContent(type="text", text="Cannot process this operation.")])
 
         res = res.json()
         if res.get("code") == 0:
             data = res["data"]
             chunks = []
 
-            # Cache document metadata and dataset information
-            document_cache, dataset_cache = self._get_document_metadata_cache(dataset_ids, force_refresh=force_refresh)
-
             # Process chunks with enhanced field mapping including per-chunk metadata
             for chunk_data in data.get("chunks", []):
                 enhanced_chunk = self._map_chunk_fields(chunk_data, dataset_cache, document_cache)
@@ -218,66 +269,98 @@ class RAGFlowConnector:
 
         raise Exception([types.TextContent(type="text", text=res.get("message"))])
 
-    def _get_document_metadata_cache(self, dataset_ids, force_refresh=False):
-        """Cache document metadata for all documents in the specified datasets"""
+    async def _fetch_dataset_metadata(self, dataset_id):
+        try:
+            dataset_res = await self._get("/datasets", {"id": dataset_id, "page_size": 1})
+            if dataset_res and dataset_res.status_code == 200:
+                dataset_data = dataset_res.json()
+                if dataset_data.get("code") == 0 and dataset_data.get("data"):
+                    dataset_info = dataset_data["data"][0]
+                    dataset_meta = {"name": dataset_info.get("name", "Unknown"), "description": dataset_info.get("description", "")}
+                    self._set_cached_dataset_metadata(dataset_id, dataset_meta)
+                    return dataset_meta
+        except Exception:
+            logging.exception(f"Fetch metadata of dataset {dataset_id} failed")
+        return None
+
+    async def _fetch_document_metadata(self, dataset_id):
+        try:
+            docs_res = await self._get(f"/datasets/{dataset_id}/documents")
+            docs_data = docs_res.json()
+            if docs_data.get("code") == 0 and docs_data.get("data", {}).get("docs"):
+                doc_id_meta_list = []
+                docs = {}
+                for doc in docs_data["data"]["docs"]:
+                    doc_id = doc.get("id")
+                    if not doc_id:
+                        continue
+                    doc_meta = {
+                        "document_id": doc_id,
+                        "name": doc.get("name", ""),
+                        "location": doc.get("location", ""),
+                        "type": doc.get("type", ""),
+                        "size": doc.get("size"),
+                        "chunk_count": doc.get("chunk_count"),
+                        # "chunk_method": doc.get("chunk_method", ""),
+                        "create_date": doc.get("create_date", ""),
+                        "update_date": doc.get("update_date", ""),
+                        # "process_begin_at": doc.get("process_begin_at", ""),
+                        # "process_duration": doc.get("process_duration"),
+                        # "progress": doc.get("progress"),
+                        # "progress_msg": doc.get("progress_msg", ""),
+                        # "status": doc.get("status", ""),
+                        # "run": doc.get("run", ""),
+                        "token_count": doc.get("token_count"),
+                        # "source_type": doc.get("source_type", ""),
+                        "thumbnail": doc.get("thumbnail", ""),
+                        "dataset_id": doc.get("dataset_id", dataset_id),
+                        "meta_fields": doc.get("meta_fields", {}),
+                        # "parser_config": doc.get("parser_config", {})
+                    }
+                    doc_id_meta_list.append((doc_id, doc_meta))
+                    docs[doc_id] = doc_meta
+                self._set_cached_document_metadata_by_dataset(dataset_id, doc_id_meta_list)
+                return docs
+        except Exception:
+            logging.exception(f"Fetch document metadata of dataset {dataset_id} failed")
+        return None
+
+    async def _get_document_metadata_cache(self, dataset_ids, force_refresh=False):
+        """
+        Cache document metadata for all documents in the specified datasets.
+
+        Cached entries are returned as they are, expired ones are refreshed in the background and
+        the missing ones are fetched concurrently across datasets.
+        """
         document_cache = {}
         dataset_cache = {}
+        limiter = asyncio.Semaphore(self._METADATA_FETCH_CONCURRENCY)
+
+        async def fetch(fetch_func, dataset_id):
+            async with limiter:
+                return await fetch_func(dataset_id)
+
+        async def get_dataset(dataset_id):
+            dataset_meta = None if force_refresh else self._get_cached_dataset_metadata(dataset_id)
+            if not dataset_meta:
+                dataset_meta = await fetch(self._fetch_dataset_metadata, dataset_id)
+            if dataset_meta:
+                dataset_cache[dataset_id] = dataset_meta
+
+        async def get_documents(dataset_id):
+            docs = None if force_refresh else self._get_cached_document_metadata_by_dataset(dataset_id)
+            if docs is None:
+                docs = await fetch(self._fetch_document_metadata, dataset_id)
+            return docs
 
         try:
-            for dataset_id in dataset_ids:
-                dataset_meta = None if force_refresh else self._get_cached_dataset_metadata(dataset_id)
-                if not dataset_meta:
-                    # First get dataset info for name
-                    dataset_res = self._get("/datasets", {"id": dataset_id, "page_size": 1})
-                    if dataset_res and dataset_res.status_code == 200:
-                        dataset_data = dataset_res.json()
-                        if dataset_data.get("code") == 0 and dataset_data.get("data"):
-                            dataset_info = dataset_data["data"][0]
-                            dataset_meta = {"name": dataset_info.get("name", "Unknown"), "description": dataset_info.get("description", "")}
-                            self._set_cached_dataset_metadata(dataset_id, dataset_meta)
-                if dataset_meta:
-                    dataset_cache[dataset_id] = dataset_meta
-
-                docs = None if force_refresh else self._get_cached_document_metadata_by_dataset(dataset_id)
-                if docs is None:
-                    docs_res = self._get(f"/datasets/{dataset_id}/documents")
-                    docs_data = docs_res.json()
-                    if docs_data.get("code") == 0 and docs_data.get("data", {}).get("docs"):
-                        doc_id_meta_list = []
-                        docs = {}
-                        for doc in docs_data["data"]["docs"]:
-                            doc_id = doc.get("id")
-                            if not doc_id:
-                                continue
-                            doc_meta = {
-                                "document_id": doc_id,
-                                "name": doc.get("name", ""),
-                                "location": doc.get("location", ""),
-                                "type": doc.get("type", ""),
-                                "size": doc.get("size"),
-                                "chunk_count": doc.get("chunk_count"),
-                                # "chunk_method": doc.get("chunk_method", ""),
-                                "create_date": doc.get("create_date", ""),
-                                "update_date": doc.get("update_date", ""),
-                                # "process_begin_at": doc.get("process_begin_at", ""),
-                                # "process_duration": doc.get("process_duration"),
-                                # "progress": doc.get("progress"),
-                                # "progress_msg": doc.get("progress_msg", ""),
-                                # "status": doc.get("status", ""),
-                                # "run": doc.get("run", ""),
-                                "token_count": doc.get("token_count"),
-                                # "source_type": doc.get("source_type", ""),
-                                "thumbnail": doc.get("thumbnail", ""),
-                                "dataset_id": doc.get("dataset_id", dataset_id),
-                                "meta_fields": doc.get("meta_fields", {}),
-                                # "parser_config": doc.get("parser_config", {})
-                            }
-                            doc_id_meta_list.append((doc_id, doc_meta))
-                            docs[doc_id] = doc_meta
-                        self._set_cached_document_metadata_by_dataset(dataset_id, doc_id_meta_list)
+            _, docs_list = await asyncio.gather(
+                asyncio.gather(*[get_dataset(dataset_id) for dataset_id in dataset_ids]),
+                asyncio.gather(*[get_documents(dataset_id) for dataset_id in dataset_ids]),
+            )
+            for docs in docs_list:
                 if docs:
                     document_cache.update(docs)
-
         except Exception:
             # Gracefully handle metadata cache failures
             pass
@@ -365,7 +448,7 @@ def with_api_key(required=True):
 @app.list_tools()
 @with_api_key(required=True)
 async def list_tools(*, connector) -> list[types.Tool]:
-    dataset_description = connector.list_datasets()
+    dataset_description = await connector.list_datasets()
 
     return [
         types.Tool(
@@ -463,7 +546,7 @@ async def call_tool(name: str, arguments: dict, *, connector) -> list[types.Text
         
         # If no dataset_ids provided or empty list, get all available dataset IDs
         if not dataset_ids:
-            dataset_list_str = connector.list_datasets()
+            dataset_list_str = await connector.list_datasets()
             dataset_ids = []
             
             # Parse the dataset list to extract IDs
@@ -477,7 +560,7 @@ async def call_tool(name: str, arguments: dict, *, connector) -> list[types.Text
                             # Skip malformed lines
                             continue
         
-        return connector.retrieval(
+        return await connector.retrieval(
             dataset_ids=dataset_ids,
             document_ids=document_ids,
             question=question,
@@ -573,11 +656,22 @@ def create_starlette_app():
 
         routes.append(Mount("/mcp", app=handle_streamable_http))
 
+    @asynccontextmanager
+    async def lifespan(app: Starlette) -> AsyncIterator[None]:
+        try:
+            if streamablehttp_lifespan:
+                async with streamablehttp_lifespan(app):
+                    yield
+            else:
+                yield
+        finally:
+            await RAGFlowConnector.aclose()
+
     return Starlette(
         debug=True,
         routes=routes,
         middleware=middleware,
-        lifespan=streamablehttp_lifespan,
+        lifespan=lifespan,
     )
 
 
@@ -14,7 +14,6 @@
 #  limitations under the License.
 #
 
-import copy
 import logging
 import re
 from io import BytesIO
@@ -28,48 +27,73 @@ from dateutil.parser import parse as datetime_parse
 
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from deepdoc.parser.utils import get_text
-from rag.nlp import rag_tokenizer, tokenize
+from rag.nlp import rag_tokenizer, tokenize_batch
 from deepdoc.parser import ExcelParser
 
 
 class Excel(ExcelParser):
     def __call__(self, fnm, binary=None, from_page=0, to_page=10000000000, callback=None):
         if not binary:
-            wb = Excel._load_excel_to_workbook(fnm)
+            wb = Excel._load_excel_to_workbook(fnm, read_only=True)
         else:
-            wb = Excel._load_excel_to_workbook(BytesIO(binary))
-        total = 0
-        for sheetname in wb.sheetnames:
-            total += len(list(wb[sheetname].rows))
-        res, fails, done = [], [], 0
+            wb = Excel._load_excel_to_workbook(BytesIO(binary), read_only=True)
+        try:
+            return self._read_workbook(wb, from_page, to_page, callback)
+        finally:
+            wb.close()
+
+    def _read_workbook(self, wb, from_page, to_page, callback):
+        res, fails = [], []
         rn = 0
         for sheetname in wb.sheetnames:
+            if rn >= to_page:
+                break
             ws = wb[sheetname]
             try:
-                rows = list(ws.rows)
+                n_rows = self._sheet_rows(ws)
+                merged = self._merged_ranges(ws)
+                head = list(ws.iter_rows(min_row=1, max_row=min(5, n_rows), values_only=True)) if n_rows else []
             except Exception as e:
                 logging.warning(f"Skip sheet '{sheetname}' due to rows access error: {e}")
                 continue
-            if not rows:
+            if not head:
                 continue
-            headers, header_rows = self._parse_headers(ws, rows)
+            # values of the top-left cells of merged ranges, filled in as their rows are read
+            anchors = {}
+            for min_col, min_row, _, _ in merged:
+                anchors.setdefault(min_row, {})[min_col] = None
+            merged_values = {}
+            for r, row in enumerate(head, 1):
+                self._collect_anchors(anchors, merged_values, r, row)
+            headers, header_rows = self._parse_headers(head, merged, merged_values)
             if not headers:
                 continue
+
+            n_data = n_rows - header_rows
+            if rn + n_data <= from_page:
+                rn += max(n_data, 0)
+                continue
+            skip = max(0, from_page - rn)
+            rn += skip
+            first = header_rows + skip + 1
+            last = first - 1 + min(n_data - skip, to_page - rn)
+            need = {min_row for _, min_row, _, max_row in merged if len(head) < min_row < first <= max_row}
+            if need:
+                for r, row in enumerate(ws.iter_rows(min_row=min(need), max_row=max(need), values_only=True), min(need)):
+                    if r in need:
+                        self._collect_anchors(anchors, merged_values, r, row)
+
             data = []
-            for i, r in enumerate(rows[header_rows:]):
+            for r, row in enumerate(ws.iter_rows(min_row=first, max_row=last, values_only=True), first):
                 rn += 1
-                if rn - 1 < from_page:
-                    continue
-                if rn - 1 >= to_page:
-                    break
-                row_data = self._extract_row_data(ws, r, header_rows + i, len(headers))
+                self._collect_anchors(anchors, merged_values, r, row)
+                row_data = self._extract_row_data(row, r, len(headers), merged, merged_values)
                 if row_data is None:
-                    fails.append(str(i))
+                    fails.append(str(r - header_rows - 1))
                     continue
                 if self._is_empty_row(row_data):
                     continue
                 data.append(row_data)
-                done += 1
             if len(data) == 0:
                 continue
             df = pd.DataFrame(data, columns=headers)
@@ -77,22 +101,26 @@ class Excel(ExcelParser):
         callback(0.3, ("Extract records: {}~{}".format(from_page + 1, min(to_page, from_page + rn)) + (f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
         return res
 
-    def _parse_headers(self, ws, rows):
+    @staticmethod
+    def _collect_anchors(anchors, merged_values, row_num, row):
+        for col in anchors.get(row_num, []):
+            merged_values[(row_num, col)] = row[col - 1] if col - 1 < len(row) else None
+
+    def _parse_headers(self, rows, merged, merged_values):
         if len(rows) == 0:
             return [], 0
-        has_complex_structure = self._has_complex_header_structure(ws, rows)
+        has_complex_structure = self._has_complex_header_structure(rows, merged)
         if has_complex_structure:
-            return self._parse_multi_level_headers(ws, rows)
+            return self._parse_multi_level_headers(rows, merged, merged_values)
         else:
             return self._parse_simple_headers(rows)
 
-    def _has_complex_header_structure(self, ws, rows):
+    def _has_complex_header_structure(self, rows, merged):
         if len(rows) < 1:
             return False
-        merged_ranges = list(ws.merged_cells.ranges)
         # 检查前两行是否涉及合并单元格
-        for rng in merged_ranges:
-            if rng.min_row <= 2:  # 只要合并区域涉及第1或第2行
+        for _, min_row, _, _ in merged:
+            if min_row <= 2:  # 只要合并区域涉及第1或第2行
                 return True
         return False
 
@@ -100,10 +128,10 @@ class Excel(ExcelParser):
         header_like_cells = 0
         data_like_cells = 0
         non_empty_cells = 0
-        for cell in row:
-            if cell.value is not None:
+        for value in row:
+            if value is not None:
                 non_empty_cells += 1
-                val = str(cell.value).strip()
+                val = str(value).strip()
                 if self._looks_like_header(val):
                     header_like_cells += 1
                 elif self._looks_like_data(val):
@@ -116,18 +144,10 @@ class Excel(ExcelParser):
         if not rows:
             return [], 0
         header_row = rows[0]
-        headers = []
-        for cell in header_row:
-            if cell.value is not None:
-                header_value = str(cell.value).strip()
-                if header_value:
-                    headers.append(header_value)
-            else:
-                pass
         final_headers = []
-        for i, cell in enumerate(header_row):
-            if cell.value is not None:
-                header_value = str(cell.value).strip()
+        for i, value in enumerate(header_row):
+            if value is not None:
+                header_value = str(value).strip()
                 if header_value:
                     final_headers.append(header_value)
                 else:
@@ -136,14 +156,14 @@ class Excel(ExcelParser):
                 final_headers.append(f"Column_{i + 1}")
         return final_headers, 1
 
-    def _parse_multi_level_headers(self, ws, rows):
+    def _parse_multi_level_headers(self, rows, merged, merged_values):
         if len(rows) < 2:
             return [], 0
         header_rows = self._detect_header_rows(rows)
         if header_rows == 1:
             return self._parse_simple_headers(rows)
         else:
-            return self._build_hierarchical_headers(ws, rows, header_rows), header_rows
+            return self._build_hierarchical_headers(rows, header_rows, merged, merged_values), header_rows
 
     def _detect_header_rows(self, rows):
         if len(rows) < 2:
@@ -178,16 +198,15 @@ class Excel(ExcelParser):
             return True
         return False
 
-    def _build_hierarchical_headers(self, ws, rows, header_rows):
+    def _build_hierarchical_headers(self, rows, header_rows, merged, merged_values):
         headers = []
         max_col = max(len(row) for row in rows[:header_rows]) if header_rows > 0 else 0
-        merged_ranges = list(ws.merged_cells.ranges)
         for col_idx in range(max_col):
             header_parts = []
             for row_idx in range(header_rows):
                 if col_idx < len(rows[row_idx]):
-                    cell_value = rows[row_idx][col_idx].value
-                    merged_value = self._get_merged_cell_value(ws, row_idx + 1, col_idx + 1, merged_ranges)
+                    cell_value = rows[row_idx][col_idx]
+                    merged_value = self._get_merged_cell_value(row_idx + 1, col_idx + 1, merged, merged_values)
                     if merged_value is not None:
                         cell_value = merged_value
                     if cell_value is not None:
@@ -211,39 +230,21 @@ class Excel(ExcelParser):
             return False
         return True
 
-    def _get_merged_cell_value(self, ws, row, col, merged_ranges):
-        for merged_range in merged_ranges:
-            if merged_range.min_row <= row <= merged_range.max_row and merged_range.min_col <= col <= merged_range.max_col:
-                return ws.cell(merged_range.min_row, merged_range.min_col).value
+    def _get_merged_cell_value(self, row, col, merged, merged_values):
+        for min_col, min_row, max_col, max_row in merged:
+            if min_row <= row <= max_row and min_col <= col <= max_col:
+                return merged_values.get((min_row, min_col))
         return None
 
-    def _extract_row_data(self, ws, row, absolute_row_idx, expected_cols):
+    def _extract_row_data(self, row, actual_row_num, expected_cols, merged, merged_values):
         row_data = []
-        merged_ranges = list(ws.merged_cells.ranges)
-        actual_row_num = absolute_row_idx + 1
         for col_idx in range(expected_cols):
-            cell_value = None
-            actual_col_num = col_idx + 1
-            try:
-                cell_value = ws.cell(row=actual_row_num, column=actual_col_num).value
-            except ValueError:
-                if col_idx < len(row):
-                    cell_value = row[col_idx].value
+            cell_value = row[col_idx] if col_idx < len(row) else None
             if cell_value is None:
-                merged_value = self._get_merged_cell_value(ws, actual_row_num, actual_col_num, merged_ranges)
-                if merged_value is not None:
-                    cell_value = merged_value
-                else:
-                    cell_value = self._get_inherited_value(ws, actual_row_num, actual_col_num, merged_ranges)
+                cell_value = self._get_merged_cell_value(actual_row_num, col_idx + 1, merged, merged_values)
             row_data.append(cell_value)
         return row_data
 
-    def _get_inherited_value(self, ws, row, col, merged_ranges):
-        for merged_range in merged_ranges:
-            if merged_range.min_row <= row <= merged_range.max_row and merged_range.min_col <= col <= merged_range.max_col:
-                return ws.cell(merged_range.min_row, merged_range.min_col).value
-        return None
-
     def _is_empty_row(self, row_data):
         for val in row_data:
             if val is not None and str(val).strip() != "":
@@ -266,42 +267,83 @@ def trans_bool(s):
 
 
 def column_data_type(arr):
-    arr = list(arr)
+    arr = np.asarray(list(arr), dtype=object)
     counts = {"int": 0, "float": 0, "text": 0, "datetime": 0, "bool": 0}
     trans = {t: f for f, t in [(int, "int"), (float, "float"), (trans_datatime, "datetime"), (trans_bool, "bool"), (str, "text")]}
-    float_flag = False
-    for a in arr:
-        if a is None:
-            continue
-        if re.match(r"[+-]?[0-9]+$", str(a).replace("%%", "")) and not str(a).replace("%%", "").startswith("0"):
-            counts["int"] += 1
-            if int(str(a)) > 2**63 - 1:
-                float_flag = True
-                break
-        elif re.match(r"[+-]?[0-9.]{,19}$", str(a).replace("%%", "")) and not str(a).replace("%%", "").startswith("0"):
-            counts["float"] += 1
-        elif re.match(r"(true|yes|是|\*|✓|✔|☑|✅|√|false|no|否|⍻|×)$", str(a), flags=re.IGNORECASE):
-            counts["bool"] += 1
-        elif trans_datatime(str(a)):
-            counts["datetime"] += 1
-        else:
-            counts["text"] += 1
+    present = np.not_equal(arr, None)
+    if not present.any():
+        return arr.tolist(), "int"
+    # classify every distinct string once and weight it by its number of occurrences
+    codes, uniq = pd.factorize(pd.Series(list(map(str, arr[present])), dtype=object))
+    occurrences = np.bincount(codes, minlength=len(uniq))
+    uniq = pd.Series(uniq, dtype=object)
+    plain = uniq.str.replace("%%", "", regex=False)
+    not_zero = ~plain.str.startswith("0").to_numpy(dtype=bool)
+    is_int = plain.str.match(r"[+-]?[0-9]+$").to_numpy(dtype=bool) & not_zero
+    is_float = ~is_int & plain.str.match(r"[+-]?[0-9.]{,19}$").to_numpy(dtype=bool) & not_zero
+    is_bool = ~is_int & ~is_float & uniq.str.match(r"(true|yes|是|\*|✓|✔|☑|✅|√|false|no|否|⍻|×)$", case=False).to_numpy(dtype=bool)
+    rest = ~(is_int | is_float | is_bool)
+    is_datetime = np.zeros(len(uniq), dtype=bool)
+    is_datetime[rest] = [bool(trans_datatime(a)) for a in uniq[rest]]
+    float_flag = any(int(a) > 2**63 - 1 for a in plain[is_int & (plain.str.len() > 18).to_numpy(dtype=bool)])
     if float_flag:
         ty = "float"
     else:
+        counts["int"] = int(occurrences[is_int].sum())
+        counts["float"] = int(occurrences[is_float].sum())
+        counts["bool"] = int(occurrences[is_bool].sum())
+        counts["datetime"] = int(occurrences[is_datetime].sum())
+        counts["text"] = int(occurrences[rest & ~is_datetime].sum())
         counts = sorted(counts.items(), key=lambda x: x[1] * -1)
         ty = counts[0][0]
-    for i in range(len(arr)):
-        if arr[i] is None:
-            continue
+
+    def _trans(a):
         try:
-            arr[i] = trans[ty](str(arr[i]))
+            return trans[ty](a)
         except Exception:
-            arr[i] = None
+            return None
+
+    converted = np.empty(len(uniq), dtype=object)
+    converted[:] = [_trans(a) for a in uniq]
+    arr[present] = converted[codes]
     # if ty == "text":
     #    if len(arr) > 128 and uni / len(arr) < 0.1:
     #        ty = "keyword"
-    return arr, ty
+    return arr.tolist(), ty
+
+
+def dataframe_to_chunks(df, clmns_map, clmn_tys, doc, eng):
+    """
+    Turn every row of `df` holding at least one value into a chunk based on `doc`.
+
+    Works column by column: blank cells are masked, the "column:value" text is concatenated per
+    column and the distinct text cells and row texts are each tokenized in one batch.
+    """
+    values = df.to_numpy()
+    n = len(df)
+    row_txt = pd.Series([""] * n, dtype=object)
+    cells = []
+    for j, clmn in enumerate(df.columns):
+        col = values[:, j]
+        strs = pd.Series(list(map(str, col)), dtype=object)
+        valid = ~pd.isna(col) & (strs != "").to_numpy(dtype=bool)
+        sep = np.where(row_txt == "", "", "; ")
+        row_txt = row_txt.where(~valid, row_txt + sep + f"{clmn}:" + strs)
+        cells.append((clmns_map[j][0], clmn_tys[j], np.flatnonzero(valid), col))
+
+    rows = np.flatnonzero((row_txt != "").to_numpy(dtype=bool))
+    if len(rows) == 0:
+        return []
+    pos = np.full(n, -1)
+    pos[rows] = np.arange(len(rows))
+    res = [dict(doc) for _ in rows]
+    texts = list(dict.fromkeys(col[i] for _, ty, idx, col in cells if ty == "text" for i in idx))
+    tks = dict(zip(texts, (ltks for ltks, _ in rag_tokenizer.tokenize_batch(texts)))) if texts else {}
+    for fld, ty, idx, col in cells:
+        for p, v in zip(pos[idx], col[idx]):
+            res[p][fld] = v if ty != "text" else tks[v]
+    tokenize_batch(res, row_txt.iloc[rows].tolist(), eng)
+    return res
 
 
 def chunk(filename, binary=None, from_page=0, to_page=10000000000, lang="Chinese", callback=None, **kwargs):
@@ -351,6 +393,8 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000, lang="Chinese
     res = []
     PY = Pinyin()
     fieds_map = {"text": "_tks", "int": "_long", "keyword": "_kwd", "float": "_flt", "datetime": "_dt", "bool": "_kwd"}
+    doc = {"docnm_kwd": filename, "title_tks": rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))}
+    eng = lang.lower() == "english"  # is_english(txts)
     for df in dfs:
         for n in ["id", "_id", "index", "idx"]:
             if n in df.columns:
@@ -362,35 +406,15 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000, lang="Chinese
             if duplicates:
                 raise ValueError(f"Duplicate column names detected: {duplicates}\nFrom: {clmns}")
 
-        txts = list(copy.deepcopy(clmns))
         py_clmns = [PY.get_pinyins(re.sub(r"(/.*|（[^（）]+?）|\([^()]+?\))", "", str(n)), "_")[0] for n in clmns]
         clmn_tys = []
         for j in range(len(clmns)):
             cln, ty = column_data_type(df[clmns[j]])
             clmn_tys.append(ty)
             df[clmns[j]] = cln
-            if ty == "text":
-                txts.extend([str(c) for c in cln if c])
         clmns_map = [(py_clmns[i].lower() + fieds_map[clmn_tys[i]], str(clmns[i]).replace("_", " ")) for i in range(len(clmns))]
 
-        eng = lang.lower() == "english"  # is_english(txts)
-        for ii, row in df.iterrows():
-            d = {"docnm_kwd": filename, "title_tks": rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))}
-            row_txt = []
-            for j in range(len(clmns)):
-                if row[clmns[j]] is None:
-                    continue
-                if not str(row[clmns[j]]):
-                    continue
-                if not isinstance(row[clmns[j]], pd.Series) and pd.isna(row[clmns[j]]):
-                    continue
-                fld = clmns_map[j][0]
-                d[fld] = row[clmns[j]] if clmn_tys[j] != "text" else rag_tokenizer.tokenize(row[clmns[j]])
-                row_txt.append("{}:{}".format(clmns[j], row[clmns[j]]))
-            if not row_txt:
-                continue
-            tokenize(d, "; ".join(row_txt), eng)
-            res.append(d)
+        res.extend(dataframe_to_chunks(df, clmns_map, clmn_tys, doc, eng))
 
         KnowledgebaseService.update_parser_config(kwargs["kb_id"], {"field_map": {k: v for k, v in clmns_map}})
     callback(0.35, "")
@@ -0,0 +1,388 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Retrieval latency benchmark, the performance companion of rag/benchmark.py.
+
+It replays a query set against `Dealer.retrieval` with a hashing embedding model and an in-memory doc store,
+so it runs offline and measures RAGFlow's own code rather than a search cluster. It reports QPS and the
+p50/p95/p99 latency of every stage: query parsing, query embedding, doc store search, rerank and the rest
+of `retrieval` (result assembly).
+
+    python rag/benchmark_retrieval.py --docs 20000 --queries 2000 --concurrency 8
+    python rag/benchmark_retrieval.py --corpus passages.txt --query-file queries.txt --output result.json
+"""
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+import xxhash
+
+from common.misc_utils import get_uuid
+from rag.nlp import search, tokenize
+from rag.utils.doc_store_conn import DocStoreConnection, FusionExpr, MatchDenseExpr, MatchTextExpr
+
+STAGES = ["query_parsing", "embedding", "search", "rerank", "assembly"]
+
+
+class StageTimer:
+    """Per thread wall time of the outermost stage being run, nested stages are accounted to their outer one."""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def start(self):
+        self._local.stages = defaultdict(float)
+        self._local.depth = 0
+
+    def stop(self):
+        return dict(self._local.stages)
+
+    @contextmanager
+    def stage(self, name):
+        if getattr(self._local, "depth", None) is None:
+            yield
+            return
+        self._local.depth += 1
+        st = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                self._local.stages[name] += time.perf_counter() - st
+
+    def wrap(self, name, func):
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+class HashEmbedding:
+    """Deterministic bag-of-words hashing embedding, with an optional simulated round trip."""
+
+    def __init__(self, dim=256, latency_ms=0.0):
+        self.llm_name = f"hash-embedding-{dim}"
+        self.dim = dim
+        self.latency = latency_ms / 1000.
+
+    def _vector(self, txt):
+        v = np.zeros(self.dim, dtype=np.float32)
+        for w in re.findall(r"\w+", txt.lower()):
+            h = xxhash.xxh64_intdigest(w.encode("utf-8"))
+            v[h % self.dim] += 1. if (h >> 32) & 1 else -1.
+        n = np.linalg.norm(v)
+        return v / n if n else v
+
+    def encode(self, texts: list):
+        if self.latency:
+            time.sleep(self.latency)
+        return np.array([self._vector(t) for t in texts]), sum(len(t.split()) for t in texts)
+
+    def encode_queries(self, text: str):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._vector(text), len(text.split())
+
+
+class LocalDocStore(DocStoreConnection):
+    """
+    In-memory doc store for benchmarking.
+
+    Full text matching is BM25 over `content_ltks` using the weighted terms of the query expression,
+    dense matching is a brute force cosine, and fusion is the same weighted sum of normalized scores
+    the other stores apply. Only what `Dealer.search` needs is supported.
+    """
+
+    def __init__(self):
+        self.rows = []
+        self._lock = threading.Lock()
+        self._dirty = True
+        self._postings = {}
+        self._doc_len = None
+        self._vectors = {}
+
+    def dbType(self) -> str:
+        return "local"
+
+    def health(self) -> dict:
+        return {"type": "local", "status": "green"}
+
+    def createIdx(self, indexName: str, knowledgebaseId: str, vectorSize: int):
+        return True
+
+    def deleteIdx(self, indexName: str, knowledgebaseId: str):
+        with self._lock:
+            self.rows = [r for r in self.rows if r["_index"] != indexName or (knowledgebaseId and r["kb_id"] != knowledgebaseId)]
+            self._dirty = True
+
+    def indexExist(self, indexName: str, knowledgebaseId: str = None) -> bool:
+        return any(r["_index"] == indexName for r in self.rows)
+
+    def insert(self, rows: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
+        with self._lock:
+            for r in rows:
+                r = dict(r)
+                r["_index"] = indexName
+                if knowledgebaseId:
+                    r["kb_id"] = knowledgebaseId
+                self.rows.append(r)
+            self._dirty = True
+        return []
+
+    def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
+        for r in self.rows:
+            if r["id"] == chunkId and r["_index"] == indexName and r["kb_id"] in knowledgebaseIds:
+                return r
+        return None
+
+    def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
+        raise NotImplementedError("LocalDocStore is read-only once loaded")
+
+    def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
+        raise NotImplementedError("LocalDocStore is read-only once loaded")
+
+    def _build(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            postings = defaultdict(list)
+            doc_len = np.zeros(len(self.rows), dtype=np.float32)
+            for i, r in enumerate(self.rows):
+                tks = r.get("content_ltks", "").split()
+                doc_len[i] = len(tks)
+                for t, c in Counter(tks).items():
+                    postings[t].append((i, c))
+            self._postings = {t: (np.array([i for i, _ in p]), np.array([c for _, c in p], dtype=np.float32)) for t, p in postings.items()}
+            self._doc_len = doc_len
+            self._vectors = {}
+            for k in set(k for r in self.rows for k in r.keys() if re.match(r"q_[0-9]+_vec$", k)):
+                dim = int(k.split("_")[1])
+                self._vectors[k] = np.array([r.get(k, np.zeros(dim)) for r in self.rows], dtype=np.float32)
+            self._dirty = False
+
+    def _filter(self, condition, indexNames, knowledgebaseIds):
+        mask = np.array([r["_index"] in indexNames and r["kb_id"] in knowledgebaseIds for r in self.rows], dtype=bool)
+        for k, v in condition.items():
+            if v is None or k in ["kb_id", "exists", "must_not"]:
+                continue
+            vals = set(v) if isinstance(v, list) else {v}
+            mask &= np.array([bool(set(r[k]) & vals) if isinstance(r.get(k), list) else r.get(k) in vals for r in self.rows], dtype=bool)
+        return mask
+
+    def _bm25(self, expr: MatchTextExpr, k1=1.2, b=0.75):
+        scores = np.zeros(len(self.rows), dtype=np.float32)
+        avg_len = max(float(self._doc_len.mean()), 1.) if len(self.rows) else 1.
+        terms = re.findall(r"\"?([^\s\"()^]+(?: [^\s\"()^]+)*)\"?\^([0-9.]+)", expr.matching_text)
+        for phrase, w in terms:
+            for t in phrase.split():
+                if t not in self._postings:
+                    continue
+                ids, tf = self._postings[t]
+                idf = math.log(1 + (len(self.rows) - len(ids) + .5) / (len(ids) + .5))
+                scores[ids] += float(w) * idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * self._doc_len[ids] / avg_len))
+        return scores
+
+    def search(self, selectFields, highlightFields, condition, matchExprs, orderBy, offset, limit, indexNames, knowledgebaseIds, aggFields=[], rank_feature=None, track_total=True):
+        self._build()
+        if isinstance(indexNames, str):
+            indexNames = indexNames.split(",")
+        mask = self._filter(condition, indexNames, knowledgebaseIds)
+        text = [e for e in matchExprs if isinstance(e, MatchTextExpr)]
+        dense = [e for e in matchExprs if isinstance(e, MatchDenseExpr)]
+        fusion = [e for e in matchExprs if isinstance(e, FusionExpr)]
+
+        scores = np.zeros(len(self.rows), dtype=np.float32)
+        if text:
+            scores = self._bm25(text[0])
+            if not dense:
+                mask &= scores > 0
+        if dense:
+            vectors = self._vectors.get(dense[0].vector_column_name)
+            vscores = vectors @ np.array(dense[0].embedding_data, dtype=np.float32) if vectors is not None else np.zeros(len(self.rows))
+            vscores = np.where(vscores >= dense[0].extra_options.get("similarity", 0.), vscores, 0)
+            if text:
+                tw, vw = (float(w) for w in fusion[0].fusion_params["weights"].split(",")) if fusion else (.05, .95)
+                tmax = scores[mask].max() if mask.any() else 0
+                scores = tw * (scores / tmax if tmax > 0 else scores) + vw * vscores
+                mask &= scores > 0
+            else:
+                scores = vscores
+            topn = dense[0].topn
+        else:
+            topn = len(self.rows)
+
+        ids = np.flatnonzero(mask)
+        if matchExprs:
+            ids = ids[np.argsort(-scores[ids], kind="stable")][:topn]
+        total = len(ids)
+        ids = ids[offset: offset + limit]
+        return {"total": total, "hits": [(self.rows[i], float(scores[i])) for i in ids]}
+
+    def get_total(self, res):
+        return res["total"]
+
+    def get_chunk_ids(self, res):
+        return [r["id"] for r, _ in res["hits"]]
+
+    def get_fields(self, res, fields: list[str]) -> dict[str, dict]:
+        ans = {}
+        for r, score in res["hits"]:
+            d = {f: r[f] for f in fields if f in r}
+            d["_score"] = score
+            ans[r["id"]] = d
+        return ans
+
+    def get_highlight(self, res, keywords: list[str], fieldnm: str):
+        return {}
+
+    def get_aggregation(self, res, fieldnm: str):
+        return list(Counter(r.get(fieldnm, "") for r, _ in res["hits"]).items())
+
+    def sql(self, sql: str, fetch_size: int, format: str):
+        raise NotImplementedError("Not implemented")
+
+
+class TimedDealer(search.Dealer):
+    def __init__(self, dataStore, timer: StageTimer):
+        super().__init__(dataStore)
+        self.timer = timer
+        self.qryr.question = timer.wrap("query_parsing", self.qryr.question)
+        self.dataStore.search = timer.wrap("search", self.dataStore.search)
+
+    def get_vector(self, *args, **kwargs):
+        with self.timer.stage("embedding"):
+            return super().get_vector(*args, **kwargs)
+
+    def rerank(self, *args, **kwargs):
+        with self.timer.stage("rerank"):
+            return super().rerank(*args, **kwargs)
+
+    def rerank_by_model(self, *args, **kwargs):
+        with self.timer.stage("rerank"):
+            return super().rerank_by_model(*args, **kwargs)
+
+
+def synthetic_corpus(n_docs, n_queries, vocab_size=5000, seed=0):
+    rnd = random.Random(seed)
+    syllables = ["ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "pa", "qu", "di", "fo", "gu", "he", "ja"]
+    vocab = list(dict.fromkeys("".join(rnd.choice(syllables) for _ in range(rnd.randint(2, 4))) for _ in range(vocab_size)))
+    # Zipf-like word frequencies, as in natural text
+    weights = [1. / (i + 1) for i in range(len(vocab))]
+    docs = [" ".join(rnd.choices(vocab, weights, k=rnd.randint(40, 200))) for _ in range(n_docs)]
+    queries = [" ".join(rnd.choices(vocab[: len(vocab) // 5], k=rnd.randint(2, 8))) for _ in range(n_queries)]
+    return docs, queries
+
+
+def load_lines(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def build_index(store, embd_mdl, texts, tenant_id, kb_id, batch_size=256):
+    for b in range(0, len(texts), batch_size):
+        docs = []
+        for i, txt in enumerate(texts[b: b + batch_size]):
+            d = {"id": get_uuid(), "kb_id": kb_id, "doc_id": f"doc_{(b + i) // 10}", "docnm_kwd": f"doc_{(b + i) // 10}.txt", "available_int": 1}
+            tokenize(d, txt, True)
+            docs.append(d)
+        vectors, _ = embd_mdl.encode([d["content_with_weight"] for d in docs])
+        for d, v in zip(docs, vectors):
+            d[f"q_{len(v)}_vec"] = v.tolist()
+        store.insert(docs, search.index_name(tenant_id), kb_id)
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": 0., "p95": 0., "p99": 0.}
+    p50, p95, p99 = np.percentile(np.array(values) * 1000., [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def run(dealer, timer, embd_mdl, queries, tenant_id, kb_id, concurrency, page_size, vector_similarity_weight):
+    samples = []
+
+    def one(q):
+        timer.start()
+        st = time.perf_counter()
+        dealer.retrieval(q, embd_mdl, tenant_id, [kb_id], 1, page_size, similarity_threshold=0.0, vector_similarity_weight=vector_similarity_weight)
+        total = time.perf_counter() - st
+        stages = timer.stop()
+        stages["assembly"] = max(total - sum(stages.values()), 0.)
+        stages["total"] = total
+        return stages
+
+    st = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for stages in pool.map(one, queries):
+            samples.append(stages)
+    elapsed = time.perf_counter() - st
+
+    report = {"queries": len(queries), "concurrency": concurrency, "qps": len(queries) / elapsed if elapsed else 0.}
+    for name in STAGES + ["total"]:
+        report[name] = percentiles([s.get(name, 0.) for s in samples])
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RAGFlow retrieval latency benchmark")
+    parser.add_argument("--docs", type=int, default=10000, help="number of synthetic chunks when --corpus is not given")
+    parser.add_argument("--queries", type=int, default=1000, help="number of synthetic queries when --query-file is not given")
+    parser.add_argument("--corpus", default="", help="text file, one chunk per line")
+    parser.add_argument("--query-file", default="", help="text file, one query per line")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=20, help="queries run before measuring")
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--vector-similarity-weight", type=float, default=0.3)
+    parser.add_argument("--dim", type=int, default=256, help="dimension of the hashing embedding")
+    parser.add_argument("--embed-latency-ms", type=float, default=0.0, help="simulated round trip of the embedding model")
+    parser.add_argument("--output", default="", help="write the report as JSON to this file")
+    args = parser.parse_args()
+
+    docs, queries = synthetic_corpus(args.docs, args.queries)
+    if args.corpus:
+        docs = load_lines(args.corpus)
+    if args.query_file:
+        queries = load_lines(args.query_file)
+
+    tenant_id, kb_id = "benchmark_retrieval", "benchmark_retrieval_kb"
+    embd_mdl = HashEmbedding(args.dim, args.embed_latency_ms)
+    store = LocalDocStore()
+    st = time.perf_counter()
+    build_index(store, embd_mdl, docs, tenant_id, kb_id)
+    print(f"Indexed {len(docs)} chunks in {time.perf_counter() - st:.2f}s")
+
+    timer = StageTimer()
+    dealer = TimedDealer(store, timer)
+    run(dealer, timer, embd_mdl, queries[: args.warmup], tenant_id, kb_id, args.concurrency, args.page_size, args.vector_similarity_weight)
+    report = run(dealer, timer, embd_mdl, queries, tenant_id, kb_id, args.concurrency, args.page_size, args.vector_similarity_weight)
+
+    print(f"{report['queries']} queries, concurrency {report['concurrency']}, {report['qps']:.1f} QPS")
+    print(f"{'stage':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name in STAGES + ["total"]:
+        print(f"{name:<16}{report[name]['p50']:>10.2f}{report[name]['p95']:>10.2f}{report[name]['p99']:>10.2f}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
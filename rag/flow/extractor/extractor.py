@@ -14,7 +14,9 @@
 #  limitations under the License.
 import random
 from copy import deepcopy
+import trio
 from agent.component.llm import LLMParam, LLM
+from graphrag.utils import chat_limiter, get_llm_cache, set_llm_cache
 from rag.flow.base import ProcessBase, ProcessParamBase
 
 
@@ -45,19 +47,44 @@ class Extractor(ProcessBase, LLM):
                 chunks_key = k
 
         if chunks:
-            prog = 0
-            for i, ck in enumerate(chunks):
+            msgs = []
+            for ck in chunks:
                 args[chunks_key] = ck["text"]
                 msg, sys_prompt = self._sys_prompt_and_msg([], args)
                 msg.insert(0, {"role": "system", "content": sys_prompt})
-                ck[self._param.field_name] = self._generate(msg)
-                prog += 1./len(chunks)
-                if i % (len(chunks)//100+1) == 1:
-                    self.callback(prog, f"{i+1} / {len(chunks)}")
+                msgs.append(msg)
+
+            done = 0
+
+            async def generate(ck, msg):
+                nonlocal done
+                ck[self._param.field_name] = await self._generate_async(msg)
+                done += 1
+                if done % (len(chunks)//100+1) == 1:
+                    self.callback(done/len(chunks), f"{done} / {len(chunks)}")
+
+            async with trio.open_nursery() as nursery:
+                for ck, msg in zip(chunks, msgs):
+                    nursery.start_soon(generate, ck, msg)
             self.set_output("chunks", chunks)
         else:
             msg, sys_prompt = self._sys_prompt_and_msg([], args)
             msg.insert(0, {"role": "system", "content": sys_prompt})
-            self.set_output("chunks", [{self._param.field_name: self._generate(msg)}])
-
+            self.set_output("chunks", [{self._param.field_name: await self._generate_async(msg)}])
 
+    async def _generate_async(self, msg: list[dict]) -> str:
+        """
+        `_generate` off the event loop, bounded by `chat_limiter` and memoized in the LLM cache
+        by model, prompt and chunk text.
+        """
+        gen_conf = self._param.gen_conf()
+        use_cache = not self.imgs
+        if use_cache:
+            cached = await trio.to_thread.run_sync(lambda: get_llm_cache(self.chat_mdl.llm_name, msg[0]["content"], msg[1:], gen_conf))
+            if cached:
+                return cached
+        async with chat_limiter:
+            ans = await trio.to_thread.run_sync(lambda: self._generate(msg))
+        if use_cache and ans and ans.find("**ERROR**") < 0:
+            await trio.to_thread.run_sync(lambda: set_llm_cache(self.chat_mdl.llm_name, msg[0]["content"], ans, msg[1:], gen_conf))
+        return ans
@@ -17,6 +17,7 @@ import datetime
 import json
 import logging
 import random
+import threading
 from timeit import default_timer as timer
 import trio
 from agent.canvas import Graph
@@ -35,6 +36,10 @@ class Pipeline(Graph):
         self._doc_id = doc_id
         self._flow_id = flow_id
         self._kb_id = None
+        self._trace_lock = threading.Lock()
+        self._trace_last = None
+        self._trace_progress = 0.0
+        self._trace_failed = False
         if self._doc_id:
             self._kb_id = DocumentService.get_knowledgebase_id(doc_id)
             if not self._kb_id:
@@ -42,84 +47,89 @@ class Pipeline(Graph):
 
     def callback(self, component_name: str, progress: float | int | None = None, message: str = "") -> None:
         from common.exceptions import TaskCanceledException
-        log_key = f"{self._flow_id}-{self.task_id}-logs"
         timestamp = timer()
-        if has_canceled(self.task_id):
+        canceled = has_canceled(self.task_id)
+        if canceled:
             progress = -1
             message += "[CANCEL]"
         try:
-            bin = REDIS_CONN.get(log_key)
-            obj = json.loads(bin.encode("utf-8"))
-            if obj:
-                if obj[-1]["component_id"] == component_name:
-                    obj[-1]["trace"].append(
-                        {
-                            "progress": progress,
-                            "message": message,
-                            "datetime": datetime.datetime.now().strftime("%H:%M:%S"),
-                            "timestamp": timestamp,
-                            "elapsed_time": timestamp - obj[-1]["trace"][-1]["timestamp"],
-                        }
-                    )
-                else:
-                    obj.append(
-                        {
-                            "component_id": component_name,
-                            "trace": [{"progress": progress, "message": message, "datetime": datetime.datetime.now().strftime("%H:%M:%S"), "timestamp": timestamp, "elapsed_time": 0}],
-                        }
-                    )
-            else:
-                obj = [
-                    {
-                        "component_id": component_name,
-                        "trace": [{"progress": progress, "message": message, "datetime": datetime.datetime.now().strftime("%H:%M:%S"), "timestamp": timestamp, "elapsed_time": 0}],
-                    }
-                ]
-            if component_name != "END" and self._doc_id and self.task_id:
-                percentage = 1.0 / len(self.components.items())
-                finished = 0.0
-                for o in obj:
-                    for t in o["trace"]:
-                        if t["progress"] < 0:
-                            finished = -1
-                            break
-                    if finished < 0:
-                        break
-                    finished += o["trace"][-1]["progress"] * percentage
+            t = {
+                "component_id": component_name,
+                "progress": progress,
+                "message": message,
+                "datetime": datetime.datetime.now().strftime("%H:%M:%S"),
+                "timestamp": timestamp,
+                "elapsed_time": 0,
+            }
+            # The overall progress is kept up to date here instead of being recomputed from the whole trace.
+            with self._trace_lock:
+                last = self._trace_last
+                new_component = last is None or last["component_id"] != component_name
+                if not new_component:
+                    t["elapsed_time"] = timestamp - last["timestamp"]
+                elif last:
+                    self._trace_progress += last["progress"] or 0
+                if progress is not None and progress < 0:
+                    self._trace_failed = True
+                self._trace_last = t
+                finished = -1 if self._trace_failed else (self._trace_progress + (progress or 0)) / len(self.components.items())
+
+            if component_name == "END" and not self._doc_id:
+                t["dsl"] = json.loads(str(self))
+            REDIS_CONN.rpush(self._trace_key(self._flow_id, self.task_id), [json.dumps(t, ensure_ascii=False)], 60 * 30)
 
+            if component_name != "END" and self._doc_id and self.task_id:
                 msg = ""
-                if len(obj[-1]["trace"]) == 1:
-                    msg += f"\n-------------------------------------\n[{self.get_component_name(o['component_id'])}]:\n"
-                t = obj[-1]["trace"][-1]
+                if new_component:
+                    msg += f"\n-------------------------------------\n[{self.get_component_name(component_name)}]:\n"
                 msg += "%s: %s\n" % (t["datetime"], t["message"])
                 TaskService.update_progress(self.task_id, {"progress": finished, "progress_msg": msg})
-            elif component_name == "END" and not self._doc_id:
-                obj[-1]["trace"][-1]["dsl"] = json.loads(str(self))
-            REDIS_CONN.set_obj(log_key, obj, 60 * 30)
 
         except Exception as e:
             logging.exception(e)
 
-        if has_canceled(self.task_id):
+        if canceled:
             raise TaskCanceledException(message)
 
-    def fetch_logs(self):
-        log_key = f"{self._flow_id}-{self.task_id}-logs"
+    @staticmethod
+    def _trace_key(flow_id, task_id):
+        return f"{flow_id}-{task_id}-trace"
+
+    @staticmethod
+    def load_logs(flow_id, task_id, offset: int = 0, limit: int = -1) -> list[dict]:
+        """
+        Read back `limit` trace entries starting at `offset`, grouped by consecutive component
+        as [{"component_id": ..., "trace": [...]}, ...].
+        """
+        if limit == 0:
+            # LRANGE offset offset-1 would read the whole list when offset is 0, since -1 means the last entry.
+            return []
+        end = -1 if limit < 0 else offset + limit - 1
+        logs = []
         try:
-            bin = REDIS_CONN.get(log_key)
-            if bin:
-                return json.loads(bin.encode("utf-8"))
+            for line in REDIS_CONN.lrange(Pipeline._trace_key(flow_id, task_id), offset, end):
+                t = json.loads(line)
+                component_id = t.pop("component_id")
+                if logs and logs[-1]["component_id"] == component_id:
+                    logs[-1]["trace"].append(t)
+                else:
+                    logs.append({"component_id": component_id, "trace": [t]})
         except Exception as e:
             logging.exception(e)
-        return []
+        return logs
 
+    def fetch_logs(self, offset: int = 0, limit: int = -1):
+        return self.load_logs(self._flow_id, self.task_id, offset, limit)
 
     async def run(self, **kwargs):
-        log_key = f"{self._flow_id}-{self.task_id}-logs"
         try:
-            REDIS_CONN.set_obj(log_key, [], 60 * 10)
+            REDIS_CONN.delete(self._trace_key(self._flow_id, self.task_id))
         except Exception as e:
             logging.exception(e)
+        with self._trace_lock:
+            self._trace_last = None
+            self._trace_progress = 0.0
+            self._trace_failed = False
         self.error = ""
         if not self.path:
             self.path.append("File")
@@ -35,6 +35,9 @@ import base64
 
 
 class Base(ABC):
+    # Whether encode_queries is equivalent to encode, so that concurrent queries can be embedded in one batch.
+    _BATCH_QUERIES = False
+
     def __init__(self, key, model_name, **kwargs):
         """
         Constructor for abstract base class.
@@ -63,6 +66,7 @@ class Base(ABC):
 
 class BuiltinEmbed(Base):
     _FACTORY_NAME = "Builtin"
+    _BATCH_QUERIES = True
     MAX_TOKENS = {"Qwen/Qwen3-Embedding-0.6B": 30000, "BAAI/bge-m3": 8000, "BAAI/bge-small-en-v1.5": 500}
     _model = None
     _model_name = ""
@@ -101,6 +105,7 @@ class BuiltinEmbed(Base):
 
 class OpenAIEmbed(Base):
     _FACTORY_NAME = "OpenAI"
+    _BATCH_QUERIES = True
 
     def __init__(self, key, model_name="text-embedding-ada-002", base_url="https://api.openai.com/v1"):
         if not base_url:
@@ -130,6 +135,7 @@ class OpenAIEmbed(Base):
 
 class LocalAIEmbed(Base):
     _FACTORY_NAME = "LocalAI"
+    _BATCH_QUERIES = True
 
     def __init__(self, key, model_name, base_url):
         if not base_url:
@@ -297,6 +303,7 @@ class OllamaEmbed(Base):
 
 class XinferenceEmbed(Base):
     _FACTORY_NAME = "Xinference"
+    _BATCH_QUERIES = True
 
     def __init__(self, key, model_name="", base_url=""):
         base_url = urljoin(base_url, "v1")
@@ -833,6 +840,7 @@ class VoyageEmbed(Base):
 
 class HuggingFaceEmbed(Base):
     _FACTORY_NAME = "HuggingFace"
+    _BATCH_QUERIES = True
 
     def __init__(self, key, model_name, base_url=None, **kwargs):
         if not model_name:
@@ -271,8 +271,19 @@ def tokenize(d, t, eng):
     d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
 
 
+def tokenize_batch(docs, texts, eng):
+    """Same as calling `tokenize(d, t, eng)` for every pair, with one `rag_tokenizer.tokenize_batch` call."""
+    for d, t in zip(docs, texts):
+        d["content_with_weight"] = t
+    texts = [re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", t) for t in texts]
+    for d, (ltks, sm_ltks) in zip(docs, rag_tokenizer.tokenize_batch(texts)):
+        d["content_ltks"] = ltks
+        d["content_sm_ltks"] = sm_ltks
+
+
 def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
     res = []
+    texts = []
     # wrap up as es documents
     for ii, ck in enumerate(chunks):
         if len(ck.strip()) == 0:
@@ -288,13 +299,15 @@ def tokenize_chunks(chunks, doc, eng, pdf_parser=None):
                 pass
         else:
             add_positions(d, [[ii]*5])
-        tokenize(d, ck, eng)
+        texts.append(ck)
         res.append(d)
+    tokenize_batch(res, texts, eng)
     return res
 
 
 def tokenize_chunks_with_images(chunks, doc, eng, images):
     res = []
+    texts = []
     # wrap up as es documents
     for ii, (ck, image) in enumerate(zip(chunks, images)):
         if len(ck.strip()) == 0:
@@ -303,21 +316,22 @@ def tokenize_chunks_with_images(chunks, doc, eng, images):
         d = copy.deepcopy(doc)
         d["image"] = image
         add_positions(d, [[ii]*5])
-        tokenize(d, ck, eng)
+        texts.append(ck)
         res.append(d)
+    tokenize_batch(res, texts, eng)
     return res
 
 
 def tokenize_table(tbls, doc, eng, batch_size=10):
     res = []
+    texts = []
     # add tables
     for (img, rows), poss in tbls:
         if not rows:
             continue
         if isinstance(rows, str):
             d = copy.deepcopy(doc)
-            tokenize(d, rows, eng)
-            d["content_with_weight"] = rows
+            texts.append(rows)
             if img:
                 d["image"] = img
                 d["doc_type_kwd"] = "image"
@@ -329,12 +343,13 @@ def tokenize_table(tbls, doc, eng, batch_size=10):
         for i in range(0, len(rows), batch_size):
             d = copy.deepcopy(doc)
             r = de.join(rows[i:i + batch_size])
-            tokenize(d, r, eng)
+            texts.append(r)
             if img:
                 d["image"] = img
                 d["doc_type_kwd"] = "image"
             add_positions(d, poss)
             res.append(d)
+    tokenize_batch(res, texts, eng)
     return res
 
 
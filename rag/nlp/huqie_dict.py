@@ -0,0 +1,216 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+from array import array
+from functools import lru_cache
+
+HUQIE_DICT_LOOKUP_CACHE = int(os.environ.get("HUQIE_DICT_LOOKUP_CACHE", "65536"))
+
+_MAGIC = b"HUQIEDB1"
+# magic, byte order mark, number of keys, size of the tag table, size of the key blob
+_HEADER = struct.Struct("=8sIQQQ")
+_BOM = 0x01020304
+
+
+def _align(n, size=8):
+    return (n + size - 1) // size * size
+
+
+class HuqieDict:
+    """
+    Read-only, memory-mapped replacement of the huqie datrie.
+
+    Keys are stored sorted in one blob next to an offset array, so membership, value and prefix
+    lookups are binary searches over the mapped file. Pages are shared by every process mapping
+    the same file and nothing has to be deserialized at start. Values are `(F, tag)` for words and
+    `1` for the reversed `DD` keys, exactly as they are stored in the datrie.
+    """
+
+    def __init__(self, fnm):
+        with open(fnm, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, bom, n, tags_len, blob_len = _HEADER.unpack_from(self._mm, 0)
+        if magic != _MAGIC or bom != _BOM:
+            raise ValueError(f"{fnm} is not a huqie dict compiled on this platform")
+        mv = memoryview(self._mm)
+        pos = _align(_HEADER.size)
+        self._offsets = mv[pos: pos + (n + 1) * 4].cast("I")
+        pos = _align(pos + (n + 1) * 4)
+        self._freqs = mv[pos: pos + n * 2].cast("h")
+        pos = _align(pos + n * 2)
+        self._tags = mv[pos: pos + n * 2].cast("h")
+        pos = _align(pos + n * 2)
+        self._tag_names = bytes(mv[pos: pos + tags_len]).decode("utf-8").split("\n")
+        self._blob = _align(pos + tags_len)
+        if self._blob + blob_len > len(self._mm):
+            raise ValueError(f"{fnm} is truncated")
+        self._n = n
+        self._find = lru_cache(maxsize=HUQIE_DICT_LOOKUP_CACHE)(self._lower_bound)
+
+    def _key(self, i):
+        return self._mm[self._blob + self._offsets[i]: self._blob + self._offsets[i + 1]]
+
+    def _lower_bound(self, key: bytes) -> int:
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _value(self, i):
+        t = self._tags[i]
+        if t < 0:
+            return 1
+        return self._freqs[i], self._tag_names[t]
+
+    def __len__(self):
+        return self._n
+
+    def __contains__(self, key):
+        key = key.encode("utf-8")
+        i = self._find(key)
+        return i < self._n and self._key(i) == key
+
+    def __getitem__(self, key):
+        k = key.encode("utf-8")
+        i = self._find(k)
+        if i >= self._n or self._key(i) != k:
+            raise KeyError(key)
+        return self._value(i)
+
+    def has_keys_with_prefix(self, prefix):
+        prefix = prefix.encode("utf-8")
+        i = self._find(prefix)
+        return i < self._n and self._key(i).startswith(prefix)
+
+    def items(self):
+        for i in range(self._n):
+            yield self._key(i).decode("utf-8"), self._value(i)
+
+    @staticmethod
+    def build(items, fnm):
+        """Compile `(key, value)` pairs, e.g. `datrie.Trie.items()`, into `fnm`."""
+        entries = sorted((k.encode("utf-8"), v) for k, v in items)
+        offsets, freqs, tags = array("I", [0]), array("h"), array("h")
+        tag_ids = {}
+        blob = bytearray()
+        for k, v in entries:
+            blob += k
+            offsets.append(len(blob))
+            if isinstance(v, tuple):
+                freqs.append(v[0])
+                tags.append(tag_ids.setdefault(v[1], len(tag_ids)))
+            else:
+                freqs.append(0)
+                tags.append(-1)
+        tag_table = "\n".join(tag_ids.keys()).encode("utf-8")
+
+        tmp = f"{fnm}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            def write(b):
+                f.write(b)
+                f.write(b"\0" * (_align(f.tell()) - f.tell()))
+
+            write(_HEADER.pack(_MAGIC, _BOM, len(entries), len(tag_table), len(blob)))
+            write(offsets.tobytes())
+            write(freqs.tobytes())
+            write(tags.tobytes())
+            write(tag_table)
+            write(bytes(blob))
+        os.replace(tmp, fnm)
+
+
+_BENCH_SNIPPET = r"""
+import json, os, sys, time
+from rag.nlp import rag_tokenizer
+
+def rss():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024. / 1024.
+
+rss0 = rss()
+t0 = time.perf_counter()
+tknzr = rag_tokenizer.RagTokenizer()
+load = time.perf_counter() - t0
+lines = [l.strip() for l in open(sys.argv[1], encoding="utf-8") if l.strip()]
+tks = 0
+t0 = time.perf_counter()
+for l in lines:
+    tks += len(tknzr.fine_grained_tokenize(tknzr._tokenize(l)).split())
+elapsed = time.perf_counter() - t0
+rss1 = rss()
+t0 = time.perf_counter()
+for _ in range(2):
+    for l in lines:
+        tknzr.fine_grained_tokenize(tknzr.tokenize(l))
+cached = time.perf_counter() - t0
+print(json.dumps({"backend": type(tknzr.trie_).__name__, "load_s": load, "rss_mb": rss1 - rss0,
+                  "tokens_per_s": tks / elapsed, "tokens_per_s_cached": 2 * tks / cached}))
+"""
+
+_BENCH_LINES = [
+    "公开征求意见稿提出，境外投资者可使用自有人民币或外汇投资。",
+    "多校划片就是一个小区对应多个小学初中，让买了学区房的家庭也不确定到底能上哪个学校。",
+    "实际上当时他们已经将业务中心偏移到安全部门和针对政府企业的部门 Scripts are compiled and cached",
+    "数据分析项目经理|数据分析挖掘|数据分析方向|商品数据分析|搜索数据分析 sql python hive tableau Cocos2d-",
+    "涡轮增压发动机num最大功率,不像别的共享买车锁电子化的手段,我们接过来是否有意义",
+]
+
+
+def _bench(corpus):
+    if not corpus:
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".txt", delete=False) as f:
+            f.write("\n".join(_BENCH_LINES * 200))
+        corpus = f.name
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    for mmap_dict in ["0", "1"]:
+        env = dict(os.environ, HUQIE_MMAP_DICT=mmap_dict, PYTHONPATH=root)
+        out = subprocess.run([sys.executable, "-c", _BENCH_SNIPPET, corpus], env=env, cwd=root,
+                             capture_output=True, text=True, check=True)
+        res = json.loads(out.stdout.strip().split("\n")[-1])
+        print("{backend:>10}: load {load_s:.3f}s, RSS +{rss_mb:.1f}MB, "
+              "{tokens_per_s:.0f} tokens/s, {tokens_per_s_cached:.0f} tokens/s with the tokenize cache".format(**res))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Compile or benchmark the memory-mapped huqie dictionary")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("compile", help="compile a datrie file into a memory-mapped dict")
+    p.add_argument("trie", help="e.g. rag/res/huqie.txt.trie")
+    p.add_argument("output", help="e.g. rag/res/huqie.txt.dict")
+    p = sub.add_parser("bench", help="compare cold start and tokens/s of the datrie and the memory-mapped dict")
+    p.add_argument("corpus", nargs="?", default="", help="text file, one line per tokenize call")
+    args = parser.parse_args()
+
+    if args.cmd == "compile":
+        import datrie
+        HuqieDict.build(datrie.Trie.load(args.trie).items(), args.output)
+        logging.info(f"[HUQIE]:Compiled {args.trie} into {args.output}")
+    else:
+        _bench(args.corpus)
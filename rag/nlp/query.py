@@ -19,6 +19,9 @@ import json
 import re
 from collections import defaultdict
 
+import numpy as np
+from scipy.sparse import csr_matrix
+
 from rag.utils.doc_store_conn import MatchTextExpr
 from rag.nlp import rag_tokenizer, term_weight, synonym
 
@@ -217,28 +220,43 @@ class FulltextQueryer:
         return None, keywords
 
     def hybrid_similarity(self, avec, bvecs, atks, btkss, tkweight=0.3, vtweight=0.7):
-        from sklearn.metrics.pairwise import cosine_similarity
-        import numpy as np
-
-        sims = cosine_similarity([avec], bvecs)
+        sims = self.cosine_similarity(avec, bvecs)
         tksim = self.token_similarity(atks, btkss)
-        if np.sum(sims[0]) == 0:
-            return np.array(tksim), tksim, sims[0]
-        return np.array(sims[0]) * vtweight + np.array(tksim) * tkweight, tksim, sims[0]
+        if np.sum(sims) == 0:
+            return np.array(tksim), tksim, sims
+        return sims * vtweight + np.array(tksim) * tkweight, tksim, sims
+
+    @staticmethod
+    def cosine_similarity(avec, bvecs):
+        avec = np.asarray(avec, dtype=np.float64)
+        bvecs = np.asarray(bvecs, dtype=np.float64)
+        if bvecs.size == 0:
+            return np.zeros(len(bvecs))
+        norms = np.linalg.norm(bvecs, axis=1) * np.linalg.norm(avec)
+        return np.divide(bvecs @ avec, norms, out=np.zeros(len(bvecs)), where=norms > 0)
 
     def token_similarity(self, atks, btkss):
-        def to_dict(tks):
+        """
+        Batched version of `similarity`: the share of query term weight covered by every candidate.
+        Only the query terms are weighted, candidates just need to be tested for membership,
+        so every candidate becomes a sparse row over the interned query terms.
+        """
+        if isinstance(atks, str):
+            atks = atks.split()
+        qtwt = defaultdict(float)
+        for t, c in self.tw.weights(atks, preprocess=False):
+            qtwt[t] += c
+        vocab = {t: i for i, t in enumerate(qtwt.keys())}
+        qw = np.fromiter(qtwt.values(), dtype=np.float64, count=len(vocab))
+
+        indptr, indices = [0], []
+        for tks in btkss:
             if isinstance(tks, str):
                 tks = tks.split()
-            d = defaultdict(int)
-            wts = self.tw.weights(tks, preprocess=False)
-            for i, (t, c) in enumerate(wts):
-                d[t] += c
-            return d
-
-        atks = to_dict(atks)
-        btkss = [to_dict(tks) for tks in btkss]
-        return [self.similarity(atks, btks) for btks in btkss]
+            indices.extend({vocab[t] for t in tks if t in vocab})
+            indptr.append(len(indices))
+        m = csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(btkss), len(vocab)))
+        return ((m @ qw + 1e-9) / (np.sum(qw) + 1e-9)).tolist()
 
     def similarity(self, qtwt, dtwt):
         if isinstance(dtwt, type("")):
@@ -22,10 +22,28 @@ import os
 import re
 import string
 import sys
-from hanziconv import HanziConv
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from hanziconv.charmap import simplified_charmap, traditional_charmap
 from nltk import word_tokenize
 from nltk.stem import PorterStemmer, WordNetLemmatizer
 from common.file_utils import get_project_base_directory
+from rag.nlp.huqie_dict import HuqieDict
+
+HUQIE_MMAP_DICT = int(os.environ.get("HUQIE_MMAP_DICT", "1"))
+TOKENIZE_CACHE_SIZE = int(os.environ.get("TOKENIZE_CACHE_SIZE", "8192"))
+TOKENIZE_CACHE_MAX_LEN = int(os.environ.get("TOKENIZE_CACHE_MAX_LEN", "256"))
+TOKENIZE_PROCESS_NUM = int(os.environ.get("TOKENIZE_PROCESS_NUM", "0"))
+TOKENIZE_PROCESS_MIN_BATCH = int(os.environ.get("TOKENIZE_PROCESS_MIN_BATCH", "256"))
+
+# Full-width to half-width, U+3000 is the ideographic space.
+_Q2B_TABLE = {0x3000: 0x20}
+_Q2B_TABLE.update({c: c - 0xfee0 for c in range(0xff00, 0xff5f)})
+# Same mapping as HanziConv.toSimplified, which keeps the first match of every traditional character.
+_T2S_TABLE = {}
+for _t, _s in zip(traditional_charmap, simplified_charmap):
+    _T2S_TABLE.setdefault(ord(_t), _s)
+del _t, _s
 
 
 class RagTokenizer:
@@ -68,7 +86,30 @@ class RagTokenizer:
 
         self.SPLIT_CHAR = r"([ ,\.<>/?;:'\[\]\\`!@#$%^&*\(\)\{\}\|_+=《》，。？、；‘’：“”【】~！￥%……（）——-]+|[a-zA-Z0-9,\.-]+)"
 
+        self._cached_tokenize = lru_cache(maxsize=TOKENIZE_CACHE_SIZE)(self._tokenize)
+        self._cached_fine_grained_tokenize = lru_cache(maxsize=TOKENIZE_CACHE_SIZE)(self._fine_grained_tokenize)
+
         trie_file_name = self.DIR_ + ".txt.trie"
+        dict_file_name = self.DIR_ + ".txt.dict"
+        # the compiled dict is only valid if it is not older than the trie it was built from
+        if HUQIE_MMAP_DICT and os.path.exists(dict_file_name) and (
+                not os.path.exists(trie_file_name) or os.path.getmtime(dict_file_name) >= os.path.getmtime(trie_file_name)):
+            try:
+                self.trie_ = HuqieDict(dict_file_name)
+                return
+            except Exception:
+                logging.exception(f"[HUQIE]:Fail to load dict file {dict_file_name}, fall back to the trie file")
+
+        self._load_trie(trie_file_name)
+        if HUQIE_MMAP_DICT and len(self.trie_):
+            try:
+                logging.info(f"[HUQIE]:Compile trie to {dict_file_name}")
+                HuqieDict.build(self.trie_.items(), dict_file_name)
+                self.trie_ = HuqieDict(dict_file_name)
+            except Exception:
+                logging.exception(f"[HUQIE]:Compile dict file {dict_file_name} failed")
+
+    def _load_trie(self, trie_file_name):
         # check if trie file existence
         if os.path.exists(trie_file_name):
             try:
@@ -87,7 +128,12 @@ class RagTokenizer:
         # load data from dict file and save to trie file
         self._load_dict(self.DIR_ + ".txt")
 
+    def _clear_cache(self):
+        self._cached_tokenize.cache_clear()
+        self._cached_fine_grained_tokenize.cache_clear()
+
     def load_user_dict(self, fnm):
+        self._clear_cache()
         try:
             self.trie_ = datrie.Trie.load(fnm + ".trie")
             return
@@ -96,25 +142,21 @@ class RagTokenizer:
         self._load_dict(fnm)
 
     def add_user_dict(self, fnm):
+        self._clear_cache()
+        if isinstance(self.trie_, HuqieDict):
+            # the memory-mapped dict is read-only, fall back to a private datrie
+            trie = datrie.Trie(string.printable)
+            for k, v in self.trie_.items():
+                trie[k] = v
+            self.trie_ = trie
         self._load_dict(fnm)
 
     def _strQ2B(self, ustring):
         """Convert full-width characters to half-width characters"""
-        rstring = ""
-        for uchar in ustring:
-            inside_code = ord(uchar)
-            if inside_code == 0x3000:
-                inside_code = 0x0020
-            else:
-                inside_code -= 0xfee0
-            if inside_code < 0x0020 or inside_code > 0x7e:  # After the conversion, if it's not a half-width character, return the original character.
-                rstring += uchar
-            else:
-                rstring += chr(inside_code)
-        return rstring
+        return ustring.translate(_Q2B_TABLE)
 
     def _tradi2simp(self, line):
-        return HanziConv.toSimplified(line)
+        return line.translate(_T2S_TABLE)
 
     def dfs_(self, chars, s, preTks, tkslist, _depth=0, _memo=None):
         if _memo is None:
@@ -320,10 +362,44 @@ class RagTokenizer:
         return txt_lang_pairs
 
     def tokenize(self, line):
+        if len(line) > TOKENIZE_CACHE_MAX_LEN:
+            return self._tokenize(line)
+        return self._cached_tokenize(line)
+
+    def _normalize(self, line):
         line = re.sub(r"\W+", " ", line)
         line = self._strQ2B(line).lower()
-        line = self._tradi2simp(line)
+        return self._tradi2simp(line)
+
+    def _tokenize(self, line):
+        return self._tokenize_normalized(self._normalize(line))
+
+    def tokenize_batch(self, lines, processes=TOKENIZE_PROCESS_NUM):
+        """
+        Return `(tokenize(line), fine_grained_tokenize(tokenize(line)))` for every line.
+
+        Identical lines are tokenized once and the normalization runs over all of them at once.
+        Batches of at least TOKENIZE_PROCESS_MIN_BATCH distinct lines are split across a pool of
+        `processes` workers if it is positive.
+        """
+        uniq = list(dict.fromkeys(lines))
+        if processes > 0 and len(uniq) >= TOKENIZE_PROCESS_MIN_BATCH:
+            step = (len(uniq) + processes - 1) // processes
+            res = []
+            for r in _get_pool(processes).map(_tokenize_batch, [uniq[i: i + step] for i in range(0, len(uniq), step)]):
+                res.extend(r)
+        else:
+            # "\W+" turns every newline into a space, so the separator survives the normalization untouched.
+            normalized = "\n".join(re.sub(r"\W+", " ", line) for line in uniq)
+            normalized = self._tradi2simp(self._strQ2B(normalized).lower()).split("\n")
+            res = []
+            for line in normalized:
+                tks = self._tokenize_normalized(line)
+                res.append((tks, self.fine_grained_tokenize(tks)))
+        res = dict(zip(uniq, res))
+        return [res[line] for line in lines]
 
+    def _tokenize_normalized(self, line):
         arr = self._split_by_lang(line)
         res = []
         for L,lang in arr:
@@ -392,6 +468,11 @@ class RagTokenizer:
         return self.merge_(res)
 
     def fine_grained_tokenize(self, tks):
+        if len(tks) > TOKENIZE_CACHE_MAX_LEN:
+            return self._fine_grained_tokenize(tks)
+        return self._cached_fine_grained_tokenize(tks)
+
+    def _fine_grained_tokenize(self, tks):
         tks = tks.split()
         zh_num = len([1 for c in tks if c and is_chinese(c[0])])
         if zh_num < len(tks) * 0.2:
@@ -472,6 +553,20 @@ load_user_dict = tokenizer.load_user_dict
 add_user_dict = tokenizer.add_user_dict
 tradi2simp = tokenizer._tradi2simp
 strQ2B = tokenizer._strQ2B
+tokenize_batch = tokenizer.tokenize_batch
+
+_pool = None
+
+
+def _get_pool(processes):
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=processes)
+    return _pool
+
+
+def _tokenize_batch(lines):
+    return tokenizer.tokenize_batch(lines, processes=0)
 
 if __name__ == '__main__':
     tknzr = RagTokenizer(debug=True)
@@ -25,6 +25,7 @@ from rag.prompts.generator import relevant_chunks_with_toc
 from rag.nlp import rag_tokenizer, query
 import numpy as np
 from rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionExpr, OrderByExpr
+from rag.utils.retrieval_cache import retrieval_cache_key, get_retrieval_cache, set_retrieval_cache
 from common.string_utils import remove_redundant_spaces
 from common.float_utils import get_float
 from common.constants import PAGERANK_FLD, TAG_FLD
@@ -93,6 +94,7 @@ class Dealer:
                        "question_kwd", "question_tks", "doc_type_kwd",
                        "available_int", "content_with_weight", PAGERANK_FLD, TAG_FLD])
         kwds = set([])
+        track_total = req.get("exact_total", True)
 
         qst = req.get("question", "")
         q_vec = []
@@ -101,7 +103,8 @@ class Dealer:
                 orderBy.asc("page_num_int")
                 orderBy.asc("top_int")
                 orderBy.desc("create_timestamp_flt")
-            res = self.dataStore.search(src, [], filters, [], orderBy, offset, limit, idx_names, kb_ids)
+            res = self.dataStore.search(src, [], filters, [], orderBy, offset, limit, idx_names, kb_ids,
+                                        track_total=track_total)
             total = self.dataStore.get_total(res)
             logging.debug("Dealer.search TOTAL: {}".format(total))
         else:
@@ -114,32 +117,35 @@ class Dealer:
             if emb_mdl is None:
                 matchExprs = [matchText]
                 res = self.dataStore.search(src, highlightFields, filters, matchExprs, orderBy, offset, limit,
-                                            idx_names, kb_ids, rank_feature=rank_feature)
+                                            idx_names, kb_ids, rank_feature=rank_feature, track_total=track_total)
                 total = self.dataStore.get_total(res)
                 logging.debug("Dealer.search TOTAL: {}".format(total))
             else:
                 matchDense = self.get_vector(qst, emb_mdl, topk, req.get("similarity", 0.1))
                 q_vec = matchDense.embedding_data
-                src.append(f"q_{len(q_vec)}_vec")
+                if req.get("vector", True):
+                    src.append(f"q_{len(q_vec)}_vec")
 
                 fusionExpr = FusionExpr("weighted_sum", topk, {"weights": "0.05,0.95"})
                 matchExprs = [matchText, matchDense, fusionExpr]
 
                 res = self.dataStore.search(src, highlightFields, filters, matchExprs, orderBy, offset, limit,
-                                            idx_names, kb_ids, rank_feature=rank_feature)
+                                            idx_names, kb_ids, rank_feature=rank_feature, track_total=track_total)
                 total = self.dataStore.get_total(res)
                 logging.debug("Dealer.search TOTAL: {}".format(total))
 
                 # If result is empty, try again with lower min_match
                 if total == 0:
                     if filters.get("doc_id"):
-                        res = self.dataStore.search(src, [], filters, [], orderBy, offset, limit, idx_names, kb_ids)
+                        res = self.dataStore.search(src, [], filters, [], orderBy, offset, limit, idx_names, kb_ids,
+                                                    track_total=track_total)
                         total = self.dataStore.get_total(res)
                     else:
                         matchText, _ = self.qryr.question(qst, min_match=0.1)
                         matchDense.extra_options["similarity"] = 0.17
                         res = self.dataStore.search(src, highlightFields, filters, [matchText, matchDense, fusionExpr],
-                                                    orderBy, offset, limit, idx_names, kb_ids, rank_feature=rank_feature)
+                                                    orderBy, offset, limit, idx_names, kb_ids, rank_feature=rank_feature,
+                                                    track_total=track_total)
                         total = self.dataStore.get_total(res)
                     logging.debug("Dealer.search 2 TOTAL: {}".format(total))
 
@@ -363,12 +369,26 @@ class Dealer:
         if not question:
             return ranks
 
+        cache_key = retrieval_cache_key(question, kb_ids, tenant_ids=tenant_ids, page=page, page_size=page_size,
+                                        similarity_threshold=similarity_threshold,
+                                        vector_similarity_weight=vector_similarity_weight, top=top,
+                                        doc_ids=sorted(doc_ids) if doc_ids else doc_ids, aggs=aggs,
+                                        embd_mdl=getattr(embd_mdl, "llm_name", None),
+                                        rerank_mdl=getattr(rerank_mdl, "llm_name", None),
+                                        highlight=highlight, rank_feature=rank_feature)
+        cached = get_retrieval_cache(cache_key)
+        if cached:
+            return cached
+
         # Ensure RERANK_LIMIT is multiple of page_size
         RERANK_LIMIT = math.ceil(64/page_size) * page_size if page_size>1 else 1
+        lower_case_doc_engine = os.getenv('DOC_ENGINE', 'elasticsearch')
+        # Candidate vectors are only needed by `rerank`, the returned page gets its vectors afterwards.
+        rerank_with_vectors = not rerank_mdl and lower_case_doc_engine in ["elasticsearch", "opensearch"]
         req = {"kb_ids": kb_ids, "doc_ids": doc_ids, "page": math.ceil(page_size*page/RERANK_LIMIT), "size": RERANK_LIMIT,
-               "question": question, "vector": True, "topk": top,
+               "question": question, "vector": rerank_with_vectors, "topk": top,
                "similarity": similarity_threshold,
-               "available_int": 1}
+               "available_int": 1, "exact_total": False}
 
 
         if isinstance(tenant_ids, str):
@@ -383,7 +403,6 @@ class Dealer:
                                                    vector_similarity_weight,
                                                    rank_feature=rank_feature)
         else:
-            lower_case_doc_engine = os.getenv('DOC_ENGINE', 'elasticsearch')
             if lower_case_doc_engine in ["elasticsearch","opensearch"]:
                 # ElasticSearch doesn't normalize each way score before fusion.
                 sim, tsim, vsim = self.rerank(
@@ -456,9 +475,24 @@ class Dealer:
                                                        v in sorted(ranks["doc_aggs"].items(),
                                                                    key=lambda x: x[1]["count"] * -1)]
         ranks["chunks"] = ranks["chunks"][:page_size]
+        if not rerank_with_vectors and ranks["chunks"] and dim:
+            self._fetch_vectors(ranks["chunks"], vector_column, [index_name(tid) for tid in tenant_ids], kb_ids)
 
+        set_retrieval_cache(cache_key, ranks)
         return ranks
 
+    def _fetch_vectors(self, chunks, vector_column, idx_names, kb_ids):
+        ids = [ck["chunk_id"] for ck in chunks]
+        res = self.dataStore.search([vector_column], [], {"id": ids}, [], OrderByExpr(), 0, len(ids), idx_names, kb_ids,
+                                    track_total=False)
+        fields = self.dataStore.get_fields(res, [vector_column])
+        for ck in chunks:
+            vector = fields.get(ck["chunk_id"], {}).get(vector_column)
+            if isinstance(vector, str):
+                vector = [get_float(v) for v in vector.split("\t")]
+            if vector is not None:
+                ck["vector"] = vector
+
     def sql_retrieval(self, sql, fetch_size=128, format="json"):
         tbl = self.dataStore.sql(sql, fetch_size, format)
         return tbl
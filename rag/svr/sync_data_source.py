@@ -85,8 +85,8 @@ class SyncBase:
 
                         e, kb = KnowledgebaseService.get_by_id(task["kb_id"])
                         err, dids = SyncLogsService.duplicate_and_parse(kb, docs, task["tenant_id"], f"{self.SOURCE_NAME}/{task['connector_id']}", task["auto_parse"])
-                        SyncLogsService.increase_docs(task["id"], min_update, max_update, len(docs), "\n".join(err), len(err))
-                        doc_num += len(docs)
+                        SyncLogsService.increase_docs(task["id"], min_update, max_update, len(dids), "\n".join(err), len(err))
+                        doc_num += len(dids)
 
                     logging.info("{} docs synchronized till {}".format(doc_num, next_update))
                     SyncLogsService.done(task["id"], task["connector_id"])
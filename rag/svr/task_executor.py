@@ -53,7 +53,9 @@ from peewee import DoesNotExist
 from common.constants import LLMType, ParserType, PipelineTaskType
 from api.db.services.document_service import DocumentService
 from api.db.services.llm_service import LLMBundle
-from api.db.services.task_service import TaskService, has_canceled, CANVAS_DEBUG_DOC_ID, GRAPH_RAPTOR_FAKE_DOC_ID
+from api.db.services.tenant_llm_service import TOKEN_USAGE
+from api.db.services.task_service import TaskService, has_canceled, CANVAS_DEBUG_DOC_ID, GRAPH_RAPTOR_FAKE_DOC_ID, \
+    TASK_PROGRESS
 from api.db.services.file2document_service import File2DocumentService
 from common.versions import get_ragflow_version
 from api.db.db_models import close_connection
@@ -63,6 +65,7 @@ from rag.nlp import search, rag_tokenizer, add_positions
 from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
 from common.token_utils import num_tokens_from_string, truncate
 from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
+from rag.utils.embedding_cache import EMBEDDING_CACHE
 from graphrag.utils import chat_limiter
 from common.signal_utils import start_tracemalloc_and_snapshot, stop_tracemalloc
 from common.exceptions import TaskCanceledException
@@ -117,6 +120,8 @@ chunk_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
 embed_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
 minio_limiter = trio.CapacityLimiter(MAX_CONCURRENT_MINIO)
 kg_limiter = trio.CapacityLimiter(2)
+EMBED_INDEX_PIPELINE = int(os.environ.get('EMBED_INDEX_PIPELINE', "0"))
+PIPELINE_CHANNEL_SIZE = int(os.environ.get('PIPELINE_CHANNEL_SIZE', "4"))
 WORKER_HEARTBEAT_TIMEOUT = int(os.environ.get('WORKER_HEARTBEAT_TIMEOUT', '120'))
 stop_event = threading.Event()
 
@@ -147,11 +152,7 @@ def set_progress(task_id, from_page=0, to_page=-1, prog=None, msg="Processing...
                     msg = f"Page({from_page + 1}~{to_page + 1}): " + msg
         if msg:
             msg = datetime.now().strftime("%H:%M:%S") + " " + msg
-        d = {"progress_msg": msg}
-        if prog is not None:
-            d["progress"] = prog
-
-        TaskService.update_progress(task_id, d)
+        TASK_PROGRESS.report(task_id, msg, prog)
 
         close_connection()
         if cancel:
@@ -223,8 +224,13 @@ async def get_storage_binary(bucket, name):
     return await trio.to_thread.run_sync(lambda: settings.STORAGE_IMPL.get(bucket, name))
 
 
+def chunk_enrichment_enabled(task):
+    return bool(task["parser_config"].get("auto_keywords", 0) or task["parser_config"].get("auto_questions", 0)
+                or task["kb_parser_config"].get("tag_kb_ids", []))
+
+
 @timeout(60*80, 1)
-async def build_chunks(task, progress_callback):
+async def build_chunks(task, progress_callback, chunk_sink=None):
     if task["size"] > settings.DOC_MAXIMUM_SIZE:
         set_progress(task["id"], prog=-1, msg="File size exceeds( <= %dMb )" %
                                               (int(settings.DOC_MAXIMUM_SIZE / 1024 / 1024)))
@@ -270,6 +276,9 @@ async def build_chunks(task, progress_callback):
     if task["pagerank"]:
         doc[PAGERANK_FLD] = int(task["pagerank"])
     st = timer()
+    # Chunks can be handed to the embedding stage as soon as they are saved, unless LLM enrichment still changes them.
+    if chunk_enrichment_enabled(task):
+        chunk_sink = None
 
     @timeout(60)
     async def upload_to_minio(document, chunk):
@@ -283,17 +292,23 @@ async def build_chunks(task, progress_callback):
                 _ = d.pop("image", None)
                 d["img_id"] = ""
                 docs.append(d)
-                return
+                return d
             await image2id(d, partial(settings.STORAGE_IMPL.put, tenant_id=task["tenant_id"]), d["id"], task["kb_id"])
             docs.append(d)
+            return d
         except Exception:
             logging.exception(
                 "Saving image of chunk {}/{}/{} got exception".format(task["location"], task["name"], d["id"]))
             raise
 
+    async def save_chunk(document, chunk):
+        d = await upload_to_minio(document, chunk)
+        if chunk_sink:
+            await chunk_sink.send(d)
+
     async with trio.open_nursery() as nursery:
         for ck in cks:
-            nursery.start_soon(upload_to_minio, doc, ck)
+            nursery.start_soon(save_chunk, doc, ck)
 
     el = timer() - st
     logging.info("MINIO PUT({}) cost {:.3f} s".format(task["name"], el))
@@ -441,26 +456,45 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
 
     tk_count = 0
     if len(tts) == len(cnts):
-        vts, c = await trio.to_thread.run_sync(lambda: mdl.encode(tts[0: 1]))
-        tts = np.tile(vts[0], (len(cnts), 1))
-        tk_count += c
+        title_vec = EMBEDDING_CACHE.get_many(mdl.cache_namespace, mdl.embedding_dim, tts[0: 1])[0]
+        if title_vec is None:
+            vts, c = await trio.to_thread.run_sync(lambda: mdl.encode(tts[0: 1]))
+            EMBEDDING_CACHE.set_many(mdl.cache_namespace, tts[0: 1], vts)
+            title_vec = vts[0]
+            tk_count += c
+        tts = np.tile(title_vec, (len(cnts), 1))
+
+    def lookup_cache():
+        txts = [truncate(c, mdl.max_length-10) for c in cnts]
+        return txts, EMBEDDING_CACHE.get_many(mdl.cache_namespace, mdl.embedding_dim, txts)
+
+    cnts, vects = await trio.to_thread.run_sync(lookup_cache)
+    # Only the distinct texts missing from the cache are sent to the model.
+    misses = {}
+    for i, v in enumerate(vects):
+        if v is None:
+            misses.setdefault(cnts[i], []).append(i)
+    miss_txts = list(misses.keys())
+    hit_cnt = len(cnts) - sum(len(idx) for idx in misses.values())
 
     @timeout(60)
     def batch_encode(txts):
         nonlocal mdl
-        return mdl.encode([truncate(c, mdl.max_length-10) for c in txts])
+        vts, c = mdl.encode(txts)
+        EMBEDDING_CACHE.set_many(mdl.cache_namespace, txts, vts)
+        return vts, c
 
-    cnts_ = np.array([])
-    for i in range(0, len(cnts), settings.EMBEDDING_BATCH_SIZE):
+    for i in range(0, len(miss_txts), settings.EMBEDDING_BATCH_SIZE):
+        batch = miss_txts[i: i + settings.EMBEDDING_BATCH_SIZE]
         async with embed_limiter:
-            vts, c = await trio.to_thread.run_sync(lambda: batch_encode(cnts[i: i + settings.EMBEDDING_BATCH_SIZE]))
-        if len(cnts_) == 0:
-            cnts_ = vts
-        else:
-            cnts_ = np.concatenate((cnts_, vts), axis=0)
+            vts, c = await trio.to_thread.run_sync(lambda: batch_encode(batch))
+        for txt, v in zip(batch, vts):
+            for j in misses[txt]:
+                vects[j] = v
         tk_count += c
-        callback(prog=0.7 + 0.2 * (i + 1) / len(cnts), msg="")
-    cnts = cnts_
+        callback(prog=0.7 + 0.2 * (i + 1) / len(miss_txts), msg="")
+    callback(msg="Embedding cache: {} hit, {} miss".format(hit_cnt, len(cnts) - hit_cnt))
+    cnts = np.array(vects)
     filename_embd_weight = parser_config.get("filename_embd_weight", 0.1) # due to the db support none value
     if not filename_embd_weight:
         filename_embd_weight = 0.1
@@ -471,11 +505,11 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
         vects = cnts
 
     assert len(vects) == len(docs)
-    vector_size = 0
+    # Rows stay float32 views of one array; they are only serialized when the doc store request is encoded.
+    vects = np.ascontiguousarray(vects, dtype=np.float32)
+    vector_size = vects.shape[1] if vects.ndim == 2 else 0
     for i, d in enumerate(docs):
-        v = vects[i].tolist()
-        vector_size = len(v)
-        d["q_%d_vec" % len(v)] = v
+        d["q_%d_vec" % vector_size] = vects[i]
     return tk_count, vector_size
 
 
@@ -681,7 +715,7 @@ async def run_raptor_for_kb(row, kb_parser_config, chat_mdl, embd_mdl, vector_si
             d["id"] = xxhash.xxh64((content + str(fake_doc_id)).encode("utf-8")).hexdigest()
             d["create_time"] = str(datetime.now()).replace("T", " ")[:19]
             d["create_timestamp_flt"] = datetime.now().timestamp()
-            d[vctr_nm] = vctr.tolist()
+            d[vctr_nm] = np.asarray(vctr, dtype=np.float32)
             d["content_with_weight"] = content
             d["content_ltks"] = rag_tokenizer.tokenize(content)
             d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
@@ -719,8 +753,8 @@ async def delete_image(kb_id, chunk_id):
         raise
 
 
-async def insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback):
-    for b in range(0, len(chunks), settings.DOC_BULK_SIZE):
+async def insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback, start=0):
+    for b in range(start, len(chunks), settings.DOC_BULK_SIZE):
         doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b:b + settings.DOC_BULK_SIZE], search.index_name(task_tenant_id), task_dataset_id))
         task_canceled = has_canceled(task_id)
         if task_canceled:
@@ -747,6 +781,105 @@ async def insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_c
     return True
 
 
+async def build_embed_index(task, embedding_model, progress_callback):
+    """
+    Streaming variant of build_chunks -> embedding -> insert_es.
+    Chunks flow through bounded memory channels, so embedding and indexing overlap with each other
+    and, when no LLM enrichment is configured, with the image uploading of chunking.
+    Returns (chunks, token_count, vector_size), or None if indexing was aborted.
+    """
+    task_id = task["id"]
+    chunk_send, chunk_recv = trio.open_memory_channel(PIPELINE_CHANNEL_SIZE * settings.EMBEDDING_BATCH_SIZE)
+    index_send, index_recv = trio.open_memory_channel(PIPELINE_CHANNEL_SIZE)
+    chunks = []
+    token_count, vector_size = 0, 0
+    stage_cost = {"chunk": 0., "embedding": 0., "indexing": 0.}
+    aborted = False
+
+    def quiet_callback(prog=None, msg=""):
+        pass
+
+    async def chunk_stage():
+        async with chunk_send:
+            st = timer()
+            streamed = not chunk_enrichment_enabled(task)
+            docs = await build_chunks(task, progress_callback, chunk_sink=chunk_send if streamed else None)
+            stage_cost["chunk"] = timer() - st
+            if not docs:
+                return
+            progress_callback(msg="Generate {} chunks".format(len(docs)))
+            if not streamed:
+                for d in docs:
+                    await chunk_send.send(d)
+
+    async def embed_stage():
+        async def embed(batch):
+            nonlocal token_count, vector_size
+            st = timer()
+            try:
+                tk, vector_size = await embedding(batch, embedding_model, task["parser_config"], quiet_callback)
+            except Exception as e:
+                error_message = "Generate embedding error:{}".format(str(e))
+                progress_callback(-1, error_message)
+                logging.exception(error_message)
+                raise
+            token_count += tk
+            stage_cost["embedding"] += timer() - st
+            await index_send.send(batch)
+
+        async with index_send:
+            batch = []
+            async for d in chunk_recv:
+                batch.append(d)
+                if len(batch) >= settings.EMBEDDING_BATCH_SIZE:
+                    await embed(batch)
+                    batch = []
+            if batch:
+                await embed(batch)
+
+    async def index_stage():
+        nonlocal aborted
+        async for batch in index_recv:
+            st = timer()
+            start = len(chunks)
+            chunks.extend(batch)
+            if not await insert_es(task_id, task["tenant_id"], task["kb_id"], chunks, progress_callback, start=start):
+                aborted = True
+                nursery.cancel_scope.cancel()
+                return
+            stage_cost["indexing"] += timer() - st
+            progress_callback(msg="Indexed {} chunks".format(len(chunks)))
+
+    async def remove_indexed():
+        chunk_ids = [ck["id"] for ck in chunks]
+        if not chunk_ids:
+            return
+        try:
+            await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task["tenant_id"]), task["kb_id"]))
+            async with trio.open_nursery() as nursery:
+                for chunk_id in chunk_ids:
+                    nursery.start_soon(delete_image, task["kb_id"], chunk_id)
+        except Exception:
+            logging.exception(f"build_embed_index failed to remove the {len(chunk_ids)} chunks indexed by task {task_id}")
+
+    st = timer()
+    try:
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(chunk_stage)
+            nursery.start_soon(embed_stage)
+            nursery.start_soon(index_stage)
+    except Exception:
+        # Chunks indexed before the failure would otherwise stay searchable without being counted on the document.
+        with trio.CancelScope(shield=True):
+            await remove_indexed()
+        raise
+    if aborted:
+        return None
+    progress_callback(msg="Pipeline done ({:.2f}s): chunking {:.2f}s, embedding {:.2f}s, indexing {:.2f}s".format(
+        timer() - st, stage_cost["chunk"], stage_cost["embedding"], stage_cost["indexing"]))
+    return chunks, token_count, vector_size
+
+
 @timeout(60*60*3, 1)
 async def do_handle_task(task):
     task_type = task.get("task_type", "")
@@ -768,6 +901,7 @@ async def do_handle_task(task):
     task_parser_config = task["parser_config"]
     task_start_ts = timer()
     toc_thread = None
+    indexed = False
     executor = concurrent.futures.ThreadPoolExecutor()
 
     # prepare the progress callback function
@@ -899,32 +1033,44 @@ async def do_handle_task(task):
     else:
         # Standard chunking methods
         start_ts = timer()
-        chunks = await build_chunks(task, progress_callback)
-        logging.info("Build document {}: {:.2f}s".format(task_document_name, timer() - start_ts))
-        if not chunks:
-            progress_callback(1., msg=f"No chunk built from {task_document_name}")
-            return
-        progress_callback(msg="Generate {} chunks".format(len(chunks)))
-        start_ts = timer()
-        try:
-            token_count, vector_size = await embedding(chunks, embedding_model, task_parser_config, progress_callback)
-        except Exception as e:
-            error_message = "Generate embedding error:{}".format(str(e))
-            progress_callback(-1, error_message)
-            logging.exception(error_message)
-            token_count = 0
-            raise
-        progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
-        logging.info(progress_message)
-        progress_callback(msg=progress_message)
+        if EMBED_INDEX_PIPELINE:
+            res = await build_embed_index(task, embedding_model, progress_callback)
+            if res is None:
+                return
+            chunks, token_count, vector_size = res
+            logging.info("Build, embed and index document {}: {:.2f}s".format(task_document_name, timer() - start_ts))
+            if not chunks:
+                progress_callback(1., msg=f"No chunk built from {task_document_name}")
+                return
+            indexed = True
+        else:
+            chunks = await build_chunks(task, progress_callback)
+            logging.info("Build document {}: {:.2f}s".format(task_document_name, timer() - start_ts))
+            if not chunks:
+                progress_callback(1., msg=f"No chunk built from {task_document_name}")
+                return
+            progress_callback(msg="Generate {} chunks".format(len(chunks)))
+            start_ts = timer()
+            try:
+                token_count, vector_size = await embedding(chunks, embedding_model, task_parser_config, progress_callback)
+            except Exception as e:
+                error_message = "Generate embedding error:{}".format(str(e))
+                progress_callback(-1, error_message)
+                logging.exception(error_message)
+                token_count = 0
+                raise
+            progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
+            logging.info(progress_message)
+            progress_callback(msg=progress_message)
         if task["parser_id"].lower() == "naive" and task["parser_config"].get("toc_extraction", False):
             toc_thread = executor.submit(build_TOC,task, chunks, progress_callback)
 
     chunk_count = len(set([chunk["id"] for chunk in chunks]))
-    start_ts = timer()
-    e = await insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback)
-    if not e:
-        return
+    if not indexed:
+        start_ts = timer()
+        e = await insert_es(task_id, task_tenant_id, task_dataset_id, chunks, progress_callback)
+        if not e:
+            return
 
     logging.info("Indexing doc({}), page({}-{}), chunks({}), elapsed: {:.2f}".format(task_document_name, task_from_page,
                                                                                      task_to_page, len(chunks),
@@ -981,6 +1127,7 @@ async def handle_task():
             pass
         logging.exception(f"handle_task got exception for task {json.dumps(task)}")
     finally:
+        TASK_PROGRESS.close(task["id"])
         task_document_ids = []
         if task_type in ["graphrag", "raptor", "mindmap"]:
             task_document_ids = task["doc_ids"]
@@ -1027,6 +1174,7 @@ async def report_status():
                 "done": DONE_TASKS,
                 "failed": FAILED_TASKS,
                 "current": current,
+                "token_usage": TOKEN_USAGE.stats(),
             })
             REDIS_CONN.zadd(CONSUMER_NAME, heartbeat, now.timestamp())
             logging.info(f"{CONSUMER_NAME} reported heartbeat: {heartbeat}")
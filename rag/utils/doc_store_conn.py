@@ -14,15 +14,59 @@
 #  limitations under the License.
 #
 
+import json
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 import numpy as np
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 DEFAULT_MATCH_VECTOR_TOPN = 10
 DEFAULT_MATCH_SPARSE_TOPN = 10
 VEC = list | np.ndarray
 
 
+def _json_default(o):
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    if isinstance(o, np.generic):
+        return o.item()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def json_dumps_bytes(obj) -> bytes:
+    """
+    Serialize `obj` to UTF-8 JSON, writing numpy vectors directly instead of going through Python lists.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+        except orjson.JSONEncodeError:
+            # e.g. lone surrogates in extracted text, which the stdlib encoder passes through
+            pass
+    return json.dumps(obj, ensure_ascii=False, default=_json_default).encode("utf-8", "surrogatepass")
+
+
+def bulk_index_body(documents: list[dict], indexName: str, **extra) -> bytes:
+    """
+    Encode documents as the NDJSON body of a bulk index request, `id` becoming the `_id` of each action.
+    The documents are neither copied nor modified.
+    """
+    lines = []
+    for d in documents:
+        assert "_id" not in d
+        assert "id" in d
+        lines.append(json_dumps_bytes({"index": {"_index": indexName, "_id": d["id"]}}))
+        source = {k: v for k, v in d.items() if k != "id"}
+        source.update(extra)
+        lines.append(json_dumps_bytes(source))
+    lines.append(b"")
+    return b"\n".join(lines)
+
+
 @dataclass
 class SparseVector:
     indices: list[int]
@@ -201,10 +245,12 @@ class DocStoreConnection(ABC):
             indexNames: str|list[str],
             knowledgebaseIds: list[str],
             aggFields: list[str] = [],
-            rank_feature: dict | None = None
+            rank_feature: dict | None = None,
+            track_total: bool = True
     ):
         """
-        Search with given conjunctive equivalent filtering condition and return all fields of matched documents
+        Search with given conjunctive equivalent filtering condition and return the selected fields of matched documents.
+        Without `track_total`, `get_total` may return any lower bound of the number of matches which is positive if anything matched.
         """
         raise NotImplementedError("Not implemented")
 
@@ -0,0 +1,194 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import base64
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import xxhash
+
+from rag.utils.redis_conn import REDIS_CONN
+
+EMBEDDING_CACHE_ENABLED = int(os.environ.get("EMBEDDING_CACHE_ENABLED", "1"))
+EMBEDDING_CACHE_LRU_SIZE = int(os.environ.get("EMBEDDING_CACHE_LRU_SIZE", "50000"))
+EMBEDDING_CACHE_EXPIRE = int(os.environ.get("EMBEDDING_CACHE_EXPIRE", str(7 * 24 * 3600)))
+QUERY_EMBEDDING_CACHE_LRU_SIZE = int(os.environ.get("QUERY_EMBEDDING_CACHE_LRU_SIZE", "10000"))
+QUERY_EMBEDDING_CACHE_EXPIRE = int(os.environ.get("QUERY_EMBEDDING_CACHE_EXPIRE", str(24 * 3600)))
+QUERY_BATCH_WINDOW_MS = int(os.environ.get("QUERY_BATCH_WINDOW_MS", "5"))
+QUERY_BATCH_SIZE = int(os.environ.get("QUERY_BATCH_SIZE", "16"))
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of embedding vectors.
+
+    Vectors are keyed by (model namespace, vector dimension, hash of the already truncated text) and
+    kept in two tiers: a per-process LRU and Redis. The namespace identifies the deployment serving
+    the model (factory, base url and model name, see `LLM4Tenant.cache_namespace`), since the Redis
+    tier is shared by every tenant. Redis values are the raw float32 bytes, base64 encoded since the
+    shared connection decodes responses as text.
+    """
+
+    def __init__(self, prefix: str = "embd_cache", capacity: int = EMBEDDING_CACHE_LRU_SIZE, expire: int = EMBEDDING_CACHE_EXPIRE):
+        self.prefix = prefix
+        self.capacity = capacity
+        self.expire = expire
+        self._lru: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, namespace: str, dim: int, txt: str) -> str:
+        hasher = xxhash.xxh128()
+        hasher.update(str(namespace).encode("utf-8"))
+        hasher.update(f"\x00{dim}\x00".encode("utf-8"))
+        hasher.update(str(txt).encode("utf-8", "surrogatepass"))
+        return f"{self.prefix}:{hasher.hexdigest()}"
+
+    @staticmethod
+    def _dumps(vec) -> str:
+        return base64.b64encode(np.asarray(vec, dtype=np.float32).tobytes()).decode("ascii")
+
+    @staticmethod
+    def _loads(s: str) -> np.ndarray:
+        return np.frombuffer(base64.b64decode(s), dtype=np.float32)
+
+    def _lru_get(self, k: str):
+        with self._lock:
+            v = self._lru.get(k)
+            if v is not None:
+                self._lru.move_to_end(k)
+            return v
+
+    def _lru_put(self, k: str, v: np.ndarray):
+        with self._lock:
+            self._lru[k] = v
+            self._lru.move_to_end(k)
+            while len(self._lru) > self.capacity:
+                self._lru.popitem(last=False)
+
+    def get_many(self, namespace: str, dim: int | None, texts: list[str]) -> list[np.ndarray | None]:
+        """Return the cached vector of every text, or None for a miss. Everything misses while `dim` is unknown."""
+        if not EMBEDDING_CACHE_ENABLED or not dim:
+            return [None] * len(texts)
+        keys = [self.key(namespace, dim, t) for t in texts]
+        res = [self._lru_get(k) for k in keys]
+        remote = [i for i, v in enumerate(res) if v is None]
+        if not remote:
+            return res
+        try:
+            values = REDIS_CONN.mget([keys[i] for i in remote])
+        except Exception:
+            logging.exception("EmbeddingCache.get_many got exception")
+            return res
+        for i, s in zip(remote, values):
+            if not s:
+                continue
+            try:
+                res[i] = self._loads(s)
+            except Exception:
+                res[i] = None
+            if res[i] is None or res[i].shape[0] != dim:
+                logging.warning(f"EmbeddingCache.get_many got a corrupted entry {keys[i]}")
+                res[i] = None
+                continue
+            self._lru_put(keys[i], res[i])
+        return res
+
+    def set_many(self, namespace: str, texts: list[str], vectors):
+        if not EMBEDDING_CACHE_ENABLED:
+            return
+        mapping = {}
+        for t, v in zip(texts, vectors):
+            v = np.asarray(v, dtype=np.float32)
+            k = self.key(namespace, v.shape[-1], t)
+            self._lru_put(k, v)
+            mapping[k] = self._dumps(v)
+        REDIS_CONN.mset(mapping, self.expire)
+
+
+class QueryEncodeCoalescer:
+    """
+    Share query embedding round trips between threads.
+
+    Concurrent calls for the same text wait for a single request. If the model embeds queries
+    the same way as documents (`_BATCH_QUERIES`), calls for different texts arriving within
+    QUERY_BATCH_WINDOW_MS are also gathered into one `encode` batch.
+    """
+
+    class _Batch:
+        def __init__(self):
+            self.texts = []
+            self.index = {}
+            self.vectors = None
+            self.used_tokens = 0
+            self.error = None
+            self.done = threading.Event()
+
+    def __init__(self, window_ms: int = QUERY_BATCH_WINDOW_MS, max_batch: int = QUERY_BATCH_SIZE):
+        self.window = window_ms / 1000.
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def encode_queries(self, key, mdl, text: str):
+        """Return (vector, used_tokens). The tokens of a shared batch are only reported to the caller which sent it."""
+        batchable = getattr(mdl, "_BATCH_QUERIES", False) and self.window > 0
+        if not batchable:
+            key = (key, text)
+        with self._lock:
+            batch = self._pending.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._Batch()
+                self._pending[key] = batch
+            if text not in batch.index:
+                batch.index[text] = len(batch.texts)
+                batch.texts.append(text)
+            i = batch.index[text]
+            if len(batch.texts) >= self.max_batch and self._pending.get(key) is batch:
+                self._pending.pop(key)
+
+        if not leader:
+            batch.done.wait()
+            if batch.error:
+                raise batch.error
+            return batch.vectors[i], 0
+
+        try:
+            if batchable:
+                time.sleep(self.window)
+            with self._lock:
+                if self._pending.get(key) is batch:
+                    self._pending.pop(key)
+            if len(batch.texts) == 1:
+                vector, batch.used_tokens = mdl.encode_queries(batch.texts[0])
+                batch.vectors = [vector]
+            else:
+                batch.vectors, batch.used_tokens = mdl.encode(batch.texts)
+        except Exception as e:
+            batch.error = e
+            raise
+        finally:
+            batch.done.set()
+        return batch.vectors[i], batch.used_tokens
+
+
+EMBEDDING_CACHE = EmbeddingCache()
+QUERY_EMBEDDING_CACHE = EmbeddingCache("qembd_cache", QUERY_EMBEDDING_CACHE_LRU_SIZE, QUERY_EMBEDDING_CACHE_EXPIRE)
+QUERY_ENCODE_COALESCER = QueryEncodeCoalescer()
@@ -25,10 +25,11 @@ from elasticsearch import Elasticsearch, NotFoundError
 from elasticsearch_dsl import UpdateByQuery, Q, Search, Index
 from elastic_transport import ConnectionTimeout
 from common.decorator import singleton
+from rag.utils.retrieval_cache import invalidate_retrieval_cache
 from common.file_utils import get_project_base_directory
 from common.misc_utils import convert_bytes
 from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
-    FusionExpr
+    FusionExpr, bulk_index_body
 from rag.nlp import is_english, rag_tokenizer
 from common.float_utils import get_float
 from common import settings
@@ -109,6 +110,7 @@ class ESConnection(DocStoreConnection):
         except Exception:
             logger.exception("ESConnection.createIndex error %s" % (indexName))
 
+    @invalidate_retrieval_cache
     def deleteIdx(self, indexName: str, knowledgebaseId: str):
         if len(knowledgebaseId) > 0:
             # The index need to be alive after any kb deletion since all kb under this tenant are in one index.
@@ -150,7 +152,8 @@ class ESConnection(DocStoreConnection):
             indexNames: str | list[str],
             knowledgebaseIds: list[str],
             aggFields: list[str] = [],
-            rank_feature: dict | None = None
+            rank_feature: dict | None = None,
+            track_total: bool = True
     ):
         """
         Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/query-dsl.html
@@ -172,6 +175,9 @@ class ESConnection(DocStoreConnection):
                 continue
             if not v:
                 continue
+            if k == "id":
+                bqry.filter.append(Q("ids", values=v if isinstance(v, list) else [v]))
+                continue
             if isinstance(v, list):
                 bqry.filter.append(Q("terms", **{k: v}))
             elif isinstance(v, str) or isinstance(v, int):
@@ -249,12 +255,14 @@ class ESConnection(DocStoreConnection):
         for i in range(ATTEMPT_TIME):
             try:
                 #print(json.dumps(q, ensure_ascii=False))
+                # Only the selected fields are fetched, so vectors are returned only when asked for.
+                # Without `track_total`, matches are only counted up to 1, enough to tell whether anything matched.
                 res = self.es.search(index=indexNames,
                                      body=q,
                                      timeout="600s",
                                      # search_type="dfs_query_then_fetch",
-                                     track_total_hits=True,
-                                     _source=True)
+                                     track_total_hits=True if track_total else 1,
+                                     _source=selectFields if selectFields else True)
                 if str(res.get("timed_out", "")).lower() == "true":
                     raise Exception("Es Timeout.")
                 logger.debug(f"ESConnection.search {str(indexNames)} res: " + str(res))
@@ -288,18 +296,10 @@ class ESConnection(DocStoreConnection):
         logger.error(f"ESConnection.get timeout for {ATTEMPT_TIME} times!")
         raise Exception("ESConnection.get timeout.")
 
+    @invalidate_retrieval_cache
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         # Refers to https://www.elastic.co/guide/en/elasticsearch/reference/current/docs-bulk.html
-        operations = []
-        for d in documents:
-            assert "_id" not in d
-            assert "id" in d
-            d_copy = copy.deepcopy(d)
-            d_copy["kb_id"] = knowledgebaseId
-            meta_id = d_copy.pop("id", "")
-            operations.append(
-                {"index": {"_index": indexName, "_id": meta_id}})
-            operations.append(d_copy)
+        operations = bulk_index_body(documents, indexName, kb_id=knowledgebaseId)
 
         res = []
         for _ in range(ATTEMPT_TIME):
@@ -326,6 +326,7 @@ class ESConnection(DocStoreConnection):
 
         return res
 
+    @invalidate_retrieval_cache
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         doc = copy.deepcopy(newValue)
         doc.pop("id", None)
@@ -418,6 +419,7 @@ class ESConnection(DocStoreConnection):
                 break
         return False
 
+    @invalidate_retrieval_cache
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         qry = None
         assert "_id" not in condition
@@ -14,18 +14,22 @@
 #  limitations under the License.
 #
 
+import heapq
 import logging
 import os
 import re
 import json
 import time
-import copy
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 import infinity
 from infinity.common import ConflictType, InfinityException, SortType
 from infinity.index import IndexInfo, IndexType
 from infinity.connection_pool import ConnectionPool
 from infinity.errors import ErrorCode
 from common.decorator import singleton
+from rag.utils.retrieval_cache import invalidate_retrieval_cache
+import numpy as np
 import pandas as pd
 from common.file_utils import get_project_base_directory
 from rag.nlp import is_english
@@ -42,6 +46,10 @@ from rag.utils.doc_store_conn import (
 
 logger = logging.getLogger("ragflow.infinity_conn")
 
+INFINITY_SEARCH_CONCURRENCY = int(os.environ.get("INFINITY_SEARCH_CONCURRENCY", "8"))
+INFINITY_SEARCH_SHARD_TIMEOUT = float(os.environ.get("INFINITY_SEARCH_SHARD_TIMEOUT", "10"))
+_SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=INFINITY_SEARCH_CONCURRENCY, thread_name_prefix="infinity_search")
+
 
 def field_keyword(field_name: str):
     # The "docnm_kwd" field is always a string, not list.
@@ -126,6 +134,28 @@ def concat_dataframes(df_list: list[pd.DataFrame], selectFields: list[str]) -> p
     return pd.DataFrame(columns=schema)
 
 
+def merge_scored_dataframes(df_list: list[pd.DataFrame], selectFields: list[str], score_column: str, offset: int, limit: int) -> pd.DataFrame:
+    """
+    K-way merge of per-table results by `_score` (relevance plus pagerank), keeping rows offset..offset+limit.
+    Each table only needs to be sorted on its own, so the merge never sorts more than the returned page.
+    """
+    df_list = [df for df in df_list if not df.empty]
+    if not df_list:
+        res = concat_dataframes(df_list, selectFields)
+        res["_score"] = pd.Series(dtype=float)
+        return res
+    runs = []
+    for df in df_list:
+        df["_score"] = df[score_column] + df[PAGERANK_FLD]
+        runs.append(df.sort_values(by="_score", ascending=False).reset_index(drop=True))
+    starts = [0]
+    for df in runs[:-1]:
+        starts.append(starts[-1] + len(df))
+    merged = heapq.merge(*[zip((-df["_score"]).tolist(), range(start, start + len(df))) for start, df in zip(starts, runs)])
+    positions = [pos for _, pos in islice(merged, offset, offset + limit)]
+    return pd.concat(runs, axis=0).reset_index(drop=True).iloc[positions].reset_index(drop=True)
+
+
 @singleton
 class InfinityConnection(DocStoreConnection):
     def __init__(self):
@@ -253,6 +283,7 @@ class InfinityConnection(DocStoreConnection):
         self.connPool.release_conn(inf_conn)
         logger.info(f"INFINITY created table {table_name}, vector size {vectorSize}")
 
+    @invalidate_retrieval_cache
     def deleteIdx(self, indexName: str, knowledgebaseId: str):
         table_name = f"{indexName}_{knowledgebaseId}"
         inf_conn = self.connPool.get_conn()
@@ -290,6 +321,7 @@ class InfinityConnection(DocStoreConnection):
         knowledgebaseIds: list[str],
         aggFields: list[str] = [],
         rank_feature: dict | None = None,
+        track_total: bool = True,
     ) -> tuple[pd.DataFrame, int]:
         """
         BUG: Infinity returns empty for a highlight field if the query string doesn't use that field.
@@ -299,8 +331,6 @@ class InfinityConnection(DocStoreConnection):
         assert isinstance(indexNames, list) and len(indexNames) > 0
         inf_conn = self.connPool.get_conn()
         db_instance = inf_conn.get_database(self.dbName)
-        df_list = list()
-        table_list = list()
         output = selectFields.copy()
         for essential_field in ["id"] + aggFields:
             if essential_field not in output:
@@ -346,6 +376,7 @@ class InfinityConnection(DocStoreConnection):
                     break
             if not table_found:
                 logger.error(f"No valid tables found for indexNames {indexNames} and knowledgebaseIds {knowledgebaseIds}")
+                self.connPool.release_conn(inf_conn)
                 return pd.DataFrame(), 0
 
         for matchExpr in matchExprs:
@@ -398,16 +429,21 @@ class InfinityConnection(DocStoreConnection):
                 else:
                     order_by_expr_list.append((order_field[0], SortType.Desc))
 
-        total_hits_count = 0
-        # Scatter search tables and gather the results
-        for indexName in indexNames:
-            for knowledgebaseId in knowledgebaseIds:
-                table_name = f"{indexName}_{knowledgebaseId}"
+        table_names = [f"{indexName}_{knowledgebaseId}" for indexName in indexNames for knowledgebaseId in knowledgebaseIds]
+        if len(table_names) > 1:
+            self.connPool.release_conn(inf_conn)
+            inf_conn = None
+        # With several scored tables, every table returns its own top offset+limit and the page is cut after merging.
+        merge = bool(matchExprs) and len(table_names) > 1
+        shard_offset, shard_limit = (0, offset + limit) if merge else (offset, limit)
+
+        def search_table(table_name):
+            conn = inf_conn if inf_conn is not None else self.connPool.get_conn()
+            try:
                 try:
-                    table_instance = db_instance.get_table(table_name)
+                    table_instance = conn.get_database(self.dbName).get_table(table_name)
                 except Exception:
-                    continue
-                table_list.append(table_name)
+                    return None
                 builder = table_instance.output(output)
                 if len(matchExprs) > 0:
                     for matchExpr in matchExprs:
@@ -435,18 +471,62 @@ class InfinityConnection(DocStoreConnection):
                         builder.filter(filter_cond)
                 if orderBy.fields:
                     builder.sort(order_by_expr_list)
-                builder.offset(offset).limit(limit)
+                builder.offset(shard_offset).limit(shard_limit)
                 kb_res, extra_result = builder.option({"total_hits_count": True}).to_df()
-                if extra_result:
-                    total_hits_count += int(extra_result["total_hits_count"])
                 logger.debug(f"INFINITY search table: {str(table_name)}, result: {str(kb_res)}")
-                df_list.append(kb_res)
-        self.connPool.release_conn(inf_conn)
-        res = concat_dataframes(df_list, output)
-        if matchExprs:
-            res["_score"] = res[score_column] + res[PAGERANK_FLD]
-            res = res.sort_values(by="_score", ascending=False).reset_index(drop=True)
-            res = res.head(limit)
+                return kb_res, int(extra_result["total_hits_count"]) if extra_result else 0
+            finally:
+                if conn is not inf_conn:
+                    self.connPool.release_conn(conn)
+
+        # Scatter search tables and gather the results
+        if len(table_names) == 1:
+            try:
+                shard_results = [search_table(table_names[0])]
+            finally:
+                self.connPool.release_conn(inf_conn)
+        else:
+            # A table's timeout counts from when it starts running, not from when it is queued behind other searches.
+            started = {}
+
+            def run_shard(table_name):
+                started[table_name] = time.monotonic()
+                return search_table(table_name)
+
+            futures = {_SEARCH_EXECUTOR.submit(run_shard, table_name): table_name for table_name in table_names}
+            shard_results = []
+            errors = []
+            pending = set(futures)
+            while pending:
+                now = time.monotonic()
+                first_start = min((started[futures[f]] for f in pending if futures[f] in started), default=now)
+                done, pending = wait(pending, timeout=max(0.0, first_start + INFINITY_SEARCH_SHARD_TIMEOUT - now), return_when=FIRST_COMPLETED)
+                for f in done:
+                    try:
+                        shard_results.append(f.result())
+                    except Exception as e:
+                        logger.exception(f"INFINITY search table {futures[f]} got exception")
+                        errors.append(e)
+                now = time.monotonic()
+                for f in [f for f in pending if futures[f] in started and now - started[futures[f]] >= INFINITY_SEARCH_SHARD_TIMEOUT]:
+                    pending.discard(f)
+                    f.cancel()
+                    logger.warning(f"INFINITY search table {futures[f]} timed out after {INFINITY_SEARCH_SHARD_TIMEOUT}s, skipped")
+                    errors.append(TimeoutError(f"INFINITY search table {futures[f]} timed out after {INFINITY_SEARCH_SHARD_TIMEOUT}s"))
+            if errors and not shard_results:
+                raise errors[0]
+        shard_results = [r for r in shard_results if r is not None]
+        total_hits_count = sum(hits for _, hits in shard_results)
+        df_list = [df for df, _ in shard_results]
+
+        if merge:
+            res = merge_scored_dataframes(df_list, output, score_column, offset, limit)
+        else:
+            res = concat_dataframes(df_list, output)
+            if matchExprs:
+                res["_score"] = res[score_column] + res[PAGERANK_FLD]
+                res = res.sort_values(by="_score", ascending=False).reset_index(drop=True)
+                res = res.head(limit)
         logger.debug(f"INFINITY search final result: {str(res)}")
         return res, total_hits_count
 
@@ -473,6 +553,7 @@ class InfinityConnection(DocStoreConnection):
         res_fields = self.get_fields(res, res.columns.tolist())
         return res_fields.get(chunkId, None)
 
+    @invalidate_retrieval_cache
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         inf_conn = self.connPool.get_conn()
         db_instance = inf_conn.get_database(self.dbName)
@@ -504,7 +585,8 @@ class InfinityConnection(DocStoreConnection):
                 continue
             embedding_clmns.append((n, int(r.group(1))))
 
-        docs = copy.deepcopy(documents)
+        # every field is reassigned below, so a shallow copy leaves the caller's documents untouched
+        docs = [dict(d) for d in documents]
         for d in docs:
             assert "_id" not in d
             assert "id" in d
@@ -526,6 +608,8 @@ class InfinityConnection(DocStoreConnection):
                 elif k in ["page_num_int", "top_int"]:
                     assert isinstance(v, list)
                     d[k] = "_".join(f"{num:08x}" for num in v)
+                elif isinstance(v, np.ndarray):
+                    d[k] = v.tolist()
                 else:
                     d[k] = v
 
@@ -545,6 +629,7 @@ class InfinityConnection(DocStoreConnection):
         logger.debug(f"INFINITY inserted into {table_name} {str_ids}.")
         return []
 
+    @invalidate_retrieval_cache
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         # if 'position_int' in newValue:
         #     logger.info(f"update position_int: {newValue['position_int']}")
@@ -620,6 +705,7 @@ class InfinityConnection(DocStoreConnection):
         self.connPool.release_conn(inf_conn)
         return True
 
+    @invalidate_retrieval_cache
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         inf_conn = self.connPool.get_conn()
         db_instance = inf_conn.get_database(self.dbName)
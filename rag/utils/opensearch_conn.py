@@ -25,9 +25,10 @@ from opensearchpy import OpenSearch, NotFoundError
 from opensearchpy import UpdateByQuery, Q, Search, Index
 from opensearchpy import ConnectionTimeout
 from common.decorator import singleton
+from rag.utils.retrieval_cache import invalidate_retrieval_cache
 from common.file_utils import get_project_base_directory
 from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
-    FusionExpr
+    FusionExpr, bulk_index_body
 from rag.nlp import is_english, rag_tokenizer
 from common.constants import PAGERANK_FLD, TAG_FLD
 from common import settings
@@ -101,6 +102,7 @@ class OSConnection(DocStoreConnection):
         except Exception:
             logger.exception("OSConnection.createIndex error %s" % (indexName))
 
+    @invalidate_retrieval_cache
     def deleteIdx(self, indexName: str, knowledgebaseId: str):
         if len(knowledgebaseId) > 0:
             # The index need to be alive after any kb deletion since all kb under this tenant are in one index.
@@ -139,7 +141,8 @@ class OSConnection(DocStoreConnection):
             indexNames: str | list[str],
             knowledgebaseIds: list[str],
             aggFields: list[str] = [],
-            rank_feature: dict | None = None
+            rank_feature: dict | None = None,
+            track_total: bool = True
     ):
         """
         Refers to https://github.com/opensearch-project/opensearch-py/blob/main/guides/dsl.md
@@ -162,6 +165,9 @@ class OSConnection(DocStoreConnection):
                 continue
             if not v:
                 continue
+            if k == "id":
+                bqry.filter.append(Q("ids", values=v if isinstance(v, list) else [v]))
+                continue
             if isinstance(v, list):
                 bqry.filter.append(Q("terms", **{k: v}))
             elif isinstance(v, str) or isinstance(v, int):
@@ -247,12 +253,14 @@ class OSConnection(DocStoreConnection):
 
         for i in range(ATTEMPT_TIME):
             try:
+                # Only the selected fields are fetched, so vectors are returned only when asked for.
+                # Without `track_total`, matches are only counted up to 1, enough to tell whether anything matched.
                 res = self.os.search(index=indexNames,
                                      body=q,
                                      timeout=600,
                                      # search_type="dfs_query_then_fetch",
-                                     track_total_hits=True,
-                                     _source=True)
+                                     track_total_hits=True if track_total else 1,
+                                     _source=selectFields if selectFields else True)
                 if str(res.get("timed_out", "")).lower() == "true":
                     raise Exception("OpenSearch Timeout.")
                 logger.debug(f"OSConnection.search {str(indexNames)} res: " + str(res))
@@ -285,17 +293,10 @@ class OSConnection(DocStoreConnection):
         logger.error(f"OSConnection.get timeout for {ATTEMPT_TIME} times!")
         raise Exception("OSConnection.get timeout.")
 
+    @invalidate_retrieval_cache
     def insert(self, documents: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
         # Refers to https://opensearch.org/docs/latest/api-reference/document-apis/bulk/
-        operations = []
-        for d in documents:
-            assert "_id" not in d
-            assert "id" in d
-            d_copy = copy.deepcopy(d)
-            meta_id = d_copy.pop("id", "")
-            operations.append(
-                {"index": {"_index": indexName, "_id": meta_id}})
-            operations.append(d_copy)
+        operations = bulk_index_body(documents, indexName)
 
         res = []
         for _ in range(ATTEMPT_TIME):
@@ -321,6 +322,7 @@ class OSConnection(DocStoreConnection):
                     continue
         return res
 
+    @invalidate_retrieval_cache
     def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
         doc = copy.deepcopy(newValue)
         doc.pop("id", None)
@@ -404,6 +406,7 @@ class OSConnection(DocStoreConnection):
                 break
         return False
 
+    @invalidate_retrieval_cache
     def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
         qry = None
         assert "_id" not in condition
@@ -141,6 +141,38 @@ class RedisDB:
             logging.warning("RedisDB.get " + str(k) + " got exception: " + str(e))
             self.__open__()
 
+    def mget(self, keys: list[str]):
+        if not self.REDIS or not keys:
+            return [None] * len(keys)
+        try:
+            return self.REDIS.mget(keys)
+        except Exception as e:
+            logging.warning("RedisDB.mget " + str(len(keys)) + " keys got exception: " + str(e))
+            self.__open__()
+        return [None] * len(keys)
+
+    def mset(self, mapping: dict, exp=3600):
+        if not mapping:
+            return True
+        try:
+            pipeline = self.REDIS.pipeline(transaction=False)
+            for k, v in mapping.items():
+                pipeline.set(k, v, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.mset " + str(len(mapping)) + " keys got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def incr(self, key: str, amount: int = 1):
+        try:
+            return self.REDIS.incr(key, amount)
+        except Exception as e:
+            logging.warning("RedisDB.incr " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return None
+
     def set_obj(self, k, obj, exp=3600):
         try:
             self.REDIS.set(k, json.dumps(obj, ensure_ascii=False), exp)
@@ -226,6 +258,26 @@ class RedisDB:
             self.__open__()
         return None
 
+    def rpush(self, key: str, values: list[str], exp=3600):
+        try:
+            pipeline = self.REDIS.pipeline(transaction=False)
+            pipeline.rpush(key, *values)
+            pipeline.expire(key, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.rpush " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def lrange(self, key: str, start: int = 0, end: int = -1):
+        try:
+            return self.REDIS.lrange(key, start, end)
+        except Exception as e:
+            logging.warning("RedisDB.lrange " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return []
+
     def transaction(self, key, value, exp=3600):
         try:
             pipeline = self.REDIS.pipeline(transaction=True)
@@ -252,6 +304,25 @@ class RedisDB:
                 self.__open__()
         return False
 
+    def stream_add(self, stream, fields: dict, maxlen=100000):
+        """Append to a capped stream which is read with `stream_read`, without consumer groups."""
+        try:
+            return self.REDIS.xadd(stream, fields, maxlen=maxlen, approximate=True)
+        except Exception as e:
+            logging.warning("RedisDB.stream_add " + str(stream) + " got exception: " + str(e))
+            self.__open__()
+        return None
+
+    def stream_read(self, stream, last_id="0", count=1000):
+        """Return up to `count` (id, fields) entries of `stream` after `last_id`."""
+        try:
+            res = self.REDIS.xread({stream: last_id}, count=count)
+            return res[0][1] if res else []
+        except Exception as e:
+            logging.warning("RedisDB.stream_read " + str(stream) + " got exception: " + str(e))
+            self.__open__()
+        return []
+
     def queue_consumer(self, queue_name, group_name, consumer_name, msg_id=b">") -> RedisMsg:
         """https://redis.io/docs/latest/commands/xreadgroup/"""
         for _ in range(3):
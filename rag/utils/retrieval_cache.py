@@ -0,0 +1,120 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Retrieval result cache.
+
+Every knowledge base has an index generation counter in Redis which is bumped by every write
+(insert/update/delete) that goes through a doc store connection. The generations of the searched
+knowledge bases are part of the cache key, so a write makes the stale entries unreachable instead
+of having to find and delete them.
+"""
+
+import inspect
+import json
+import logging
+import os
+import re
+from functools import wraps
+
+import xxhash
+
+# Seconds a retrieval result is kept, 0 disables the cache.
+RETRIEVAL_CACHE_TTL = int(os.environ.get("RETRIEVAL_CACHE_TTL", "0"))
+# The doc store makes a write searchable after its refresh interval. Don't cache while a knowledge base is that fresh.
+INDEX_SETTLE_SECONDS = int(os.environ.get("INDEX_SETTLE_SECONDS", "2"))
+GLOBAL_GENERATION = "*"
+
+
+def _generation_key(kb_id):
+    return f"kb_index_generation:{kb_id}"
+
+
+def _dirty_key(kb_id):
+    return f"kb_index_dirty:{kb_id}"
+
+
+def bump_index_generation(kb_ids):
+    # Imported here since the doc store connections are created while common.settings is still loading.
+    from rag.utils.redis_conn import REDIS_CONN
+
+    if not kb_ids:
+        kb_ids = [GLOBAL_GENERATION]
+    elif isinstance(kb_ids, str):
+        kb_ids = [kb_ids]
+    for kb_id in kb_ids:
+        REDIS_CONN.incr(_generation_key(kb_id))
+        REDIS_CONN.set(_dirty_key(kb_id), "1", INDEX_SETTLE_SECONDS)
+
+
+def invalidate_retrieval_cache(func):
+    """Bump the index generation of the written knowledge base once the decorated doc store write returns."""
+    sig = inspect.signature(func)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            try:
+                kb_id = sig.bind(*args, **kwargs).arguments.get("knowledgebaseId")
+                bump_index_generation(kb_id)
+            except Exception:
+                logging.exception(f"{func.__qualname__} can't bump index generation")
+
+    return wrapper
+
+
+def retrieval_cache_key(question, kb_ids, **params):
+    """Return the cache key of a retrieval, or None if the result must not be cached."""
+    from rag.utils.redis_conn import REDIS_CONN
+
+    if not RETRIEVAL_CACHE_TTL or not kb_ids:
+        return None
+    kb_ids = sorted(set(kb_ids))
+    ids = [GLOBAL_GENERATION] + kb_ids
+    values = REDIS_CONN.mget([_generation_key(i) for i in ids] + [_dirty_key(i) for i in ids])
+    if any(values[len(ids):]):
+        return None
+    generations = [v or "0" for v in values[:len(ids)]]
+
+    hasher = xxhash.xxh128()
+    hasher.update(re.sub(r"\s+", " ", str(question)).strip().encode("utf-8"))
+    hasher.update(json.dumps({"kb_ids": kb_ids, "generations": generations, **params},
+                             sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    return "retrieval_cache:" + hasher.hexdigest()
+
+
+def get_retrieval_cache(key):
+    from rag.utils.redis_conn import REDIS_CONN
+
+    if not key:
+        return None
+    bin = REDIS_CONN.get(key)
+    if not bin:
+        return None
+    try:
+        return json.loads(bin)
+    except Exception:
+        logging.warning(f"get_retrieval_cache got a corrupted entry {key}")
+        return None
+
+
+def set_retrieval_cache(key, ranks):
+    from rag.utils.redis_conn import REDIS_CONN
+
+    if not key:
+        return
+    REDIS_CONN.set(key, json.dumps(ranks, ensure_ascii=False, default=float), RETRIEVAL_CACHE_TTL)
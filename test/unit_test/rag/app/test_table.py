@@ -0,0 +1,146 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import datetime
+import math
+import random
+
+import pandas as pd
+import pytest
+
+from rag.app.table import column_data_type, dataframe_to_chunks
+from rag.nlp import rag_tokenizer, tokenize
+
+
+def rowwise_chunks(df, clmns_map, clmn_tys, doc, eng):
+    """The row by row conversion that `dataframe_to_chunks` replaces."""
+    clmns = df.columns.values
+    res = []
+    for _, row in df.iterrows():
+        d = dict(doc)
+        row_txt = []
+        for j in range(len(clmns)):
+            if row[clmns[j]] is None:
+                continue
+            if not str(row[clmns[j]]):
+                continue
+            if not isinstance(row[clmns[j]], pd.Series) and pd.isna(row[clmns[j]]):
+                continue
+            fld = clmns_map[j][0]
+            d[fld] = row[clmns[j]] if clmn_tys[j] != "text" else rag_tokenizer.tokenize(row[clmns[j]])
+            row_txt.append("{}:{}".format(clmns[j], row[clmns[j]]))
+        if not row_txt:
+            continue
+        tokenize(d, "; ".join(row_txt), eng)
+        res.append(d)
+    return res
+
+
+def typed_dataframe(cols):
+    """Convert and type every column the way `chunk` does."""
+    fieds_map = {"text": "_tks", "int": "_long", "keyword": "_kwd", "float": "_flt", "datetime": "_dt", "bool": "_kwd"}
+    df = pd.DataFrame(cols)
+    clmn_tys = []
+    for clmn in df.columns:
+        cln, ty = column_data_type(df[clmn])
+        clmn_tys.append(ty)
+        df[clmn] = cln
+    clmns_map = [(str(c).lower() + fieds_map[ty], str(c)) for c, ty in zip(df.columns, clmn_tys)]
+    return df, clmns_map, clmn_tys
+
+
+def normalized(chunks):
+    return [{k: ("nan" if isinstance(v, float) and math.isnan(v) else v, type(v).__name__) for k, v in d.items()} for d in chunks]
+
+
+class TestColumnDataType:
+
+    @pytest.mark.parametrize("values,ty", [
+        (["1", "2", "-3", None], "int"),
+        ([1, 2, 3], "int"),
+        (["1.5", "2", "3.25"], "float"),
+        (["yes", "no", "是", "✓", "1"], "bool"),
+        (["2021-03-04", "2022-01-01 12:00", "x"], "datetime"),
+        (["alice", "bob", "1"], "text"),
+        (["12345678901234567890", "1", "2"], "float"),
+        ([None, None], "int"),
+        ([], "int"),
+    ])
+    def test_detected_type(self, values, ty):
+        """Test the type picked for a column, the most frequent kind of value winning"""
+        assert column_data_type(values)[1] == ty
+
+    def test_conversion(self):
+        """Test that values are converted to the column type, None staying None and failures becoming None"""
+        assert column_data_type(["1", None, "3", "x"]) == ([1, None, 3, None], "int")
+        assert column_data_type(["1.5", "2.5", "y"]) == ([1.5, 2.5, None], "float")
+        assert column_data_type(["YES", "no", "√"]) == (["yes", "no", "yes"], "bool")
+        assert column_data_type(["2021-03-04", "March 5 2021"]) == (["2021-03-04 00:00:00", "2021-03-05 00:00:00"], "datetime")
+        assert column_data_type(["a", "b", 1, None]) == (["a", "b", "1", None], "text")
+
+    def test_non_string_cells(self):
+        """Test that cells read as numbers or dates are typed by their text"""
+        res, ty = column_data_type([1.5, 2.0, None])
+        assert ty == "float" and res == [1.5, 2.0, None]
+        res, ty = column_data_type([datetime.datetime(2020, 1, 2), datetime.datetime(2020, 1, 3, 4, 5)])
+        assert ty == "datetime" and res == ["2020-01-02 00:00:00", "2020-01-03 04:05:00"]
+
+    def test_repeated_values(self):
+        """Test that each occurrence of a repeated value is counted and converted"""
+        res, ty = column_data_type(["a"] * 3 + ["1", "2"])
+        assert ty == "text" and res == ["a", "a", "a", "1", "2"]
+        res, ty = column_data_type(["1"] * 3 + ["a", "b"])
+        assert ty == "int" and res == [1, 1, 1, None, None]
+
+
+class TestDataframeToChunks:
+
+    doc = {"docnm_kwd": "t.xlsx", "title_tks": "t"}
+
+    def test_same_chunks_as_rowwise(self):
+        """Test that the column-wise conversion gives the chunks of the row by row one"""
+        rng = random.Random(3)
+        n = 300
+        df, clmns_map, clmn_tys = typed_dataframe({
+            "name": [rng.choice(["Alice", "Bob", "Carol Smith", "张三", None, ""]) for _ in range(n)],
+            "age": [rng.choice([1, 2, 35, None]) for _ in range(n)],
+            "score": [rng.choice([1.5, 2.25, None, float("nan")]) for _ in range(n)],
+            "ok": [rng.choice(["yes", "no", "是", None]) for _ in range(n)],
+            "when": [rng.choice([datetime.datetime(2020, 1, i % 28 + 1), None, "2021-05-06"]) for i in range(n)],
+            "mixed": [rng.choice(["bob", "", "12", "0012", "3.5", ".", None]) for _ in range(n)],
+            "empty": [None] * n,
+        })
+        for eng in [False, True]:
+            expected = rowwise_chunks(df, clmns_map, clmn_tys, self.doc, eng)
+            res = dataframe_to_chunks(df, clmns_map, clmn_tys, self.doc, eng)
+            assert normalized(res) == normalized(expected)
+
+    def test_numeric_columns(self):
+        """Test rows of numeric columns only, where blank cells are NaN"""
+        df, clmns_map, clmn_tys = typed_dataframe({"a": [1, 2, None, 4], "b": [1.5, None, None, 2.0]})
+        res = dataframe_to_chunks(df, clmns_map, clmn_tys, self.doc, False)
+        assert normalized(res) == normalized(rowwise_chunks(df, clmns_map, clmn_tys, self.doc, False))
+        assert [d["content_with_weight"] for d in res] == ["a:1.0; b:1.5", "a:2.0", "a:4.0; b:2.0"]
+
+    def test_blank_rows_are_skipped(self):
+        """Test that rows without any value give no chunk"""
+        df, clmns_map, clmn_tys = typed_dataframe({"a": ["x", None, "", "y"], "b": [None, None, None, None]})
+        res = dataframe_to_chunks(df, clmns_map, clmn_tys, self.doc, False)
+        assert [d["content_with_weight"] for d in res] == ["a:x", "a:y"]
+        assert res[0]["docnm_kwd"] == "t.xlsx"
+        assert "b_long" not in res[0]
+        df, clmns_map, clmn_tys = typed_dataframe({"a": [None, None]})
+        assert dataframe_to_chunks(df, clmns_map, clmn_tys, self.doc, False) == []
@@ -0,0 +1,125 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import string
+
+import datrie
+import pytest
+
+from rag.nlp import rag_tokenizer
+from rag.nlp.huqie_dict import HuqieDict
+
+WORDS = [
+    ("数据", 50000, "n"), ("分析", 40000, "vn"), ("数据分析", 3000, "n"), ("项目", 45000, "n"),
+    ("经理", 30000, "n"), ("项目经理", 2000, "n"), ("挖掘", 8000, "v"), ("方向", 20000, "n"),
+    ("公开", 25000, "a"), ("征求", 6000, "v"), ("意见", 40000, "n"), ("意见稿", 300, "n"),
+    ("征求意见稿", 100, "n"), ("提出", 30000, "v"), ("境外", 5000, "s"), ("投资者", 9000, "n"),
+    ("投资", 35000, "vn"), ("可", 90000, "v"), ("使用", 60000, "v"), ("自有", 2000, "b"),
+    ("人民币", 15000, "n"), ("或", 80000, "c"), ("外汇", 7000, "n"), ("学区", 800, "n"),
+    ("学区房", 500, "n"), ("小区", 9000, "n"), ("对应", 12000, "v"), ("多个", 20000, "m"),
+    ("小学", 15000, "n"), ("初中", 9000, "n"), ("家庭", 30000, "n"), ("确定", 25000, "v"),
+    ("到底", 10000, "d"), ("哪个", 12000, "r"), ("学校", 40000, "n"), ("涡轮", 600, "n"),
+    ("增压", 400, "vn"), ("发动机", 8000, "n"), ("涡轮增压", 300, "n"), ("最大", 30000, "a"),
+    ("功率", 5000, "n"), ("共享", 7000, "vn"), ("电子化", 900, "vn"), ("手段", 12000, "n"),
+    ("意义", 20000, "n"), ("数据", 100, "vn"),
+]
+
+LINES = [
+    "公开征求意见稿提出，境外投资者可使用自有人民币或外汇投资。",
+    "多校划片就是一个小区对应多个小学初中，让买了学区房的家庭也不确定到底能上哪个学校。",
+    "数据分析项目经理|数据分析挖掘|数据分析方向|商品数据分析 sql python hive tableau Cocos2d-",
+    "涡轮增压发动机num最大功率,不像别的共享买车锁电子化的手段,我们接过来是否有意义",
+    "數據分析項目經理ＡＢＣ１２３",
+]
+
+
+@pytest.fixture(scope="module")
+def tokenizers(tmp_path_factory):
+    """A tokenizer on a datrie built from WORDS, and one on the same words compiled into a HuqieDict."""
+    d = tmp_path_factory.mktemp("huqie")
+    words = d / "huqie.txt"
+    words.write_text("\n".join(f"{w} {f} {t}" for w, f, t in WORDS) + "\n", encoding="utf-8")
+
+    trie_tknzr = rag_tokenizer.RagTokenizer()
+    trie_tknzr.trie_ = datrie.Trie(string.printable)
+    trie_tknzr._load_dict(str(words))
+
+    HuqieDict.build(trie_tknzr.trie_.items(), str(d / "huqie.txt.dict"))
+    dict_tknzr = rag_tokenizer.RagTokenizer()
+    dict_tknzr.trie_ = HuqieDict(str(d / "huqie.txt.dict"))
+    return trie_tknzr, dict_tknzr
+
+
+class TestHuqieDict:
+
+    def test_same_entries(self, tokenizers):
+        """Test that the compiled dict holds exactly the entries of the datrie"""
+        trie, hd = tokenizers[0].trie_, tokenizers[1].trie_
+        assert len(hd) == len(trie)
+        assert dict(hd.items()) == dict(trie.items())
+
+    def test_lookup(self, tokenizers):
+        """Test membership and values of words, reversed keys and missing keys"""
+        tknzr, hd = tokenizers[0], tokenizers[1].trie_
+        for k, v in tknzr.trie_.items():
+            assert k in hd
+            assert hd[k] == v
+        assert hd[tknzr.key_("数据")] == tknzr.trie_[tknzr.key_("数据")]
+        assert hd[tknzr.rkey_("数据分析")] == 1
+        for w in ["数", "数据分", "不存在", "", "DATA"]:
+            assert (tknzr.key_(w) in hd) == (tknzr.key_(w) in tknzr.trie_)
+        with pytest.raises(KeyError):
+            hd[tknzr.key_("不存在")]
+
+    def test_prefix(self, tokenizers):
+        """Test has_keys_with_prefix on every prefix of every key and on keys that are no prefix"""
+        tknzr, hd = tokenizers[0], tokenizers[1].trie_
+        prefixes = {k[:i] for k in tknzr.trie_.keys() for i in range(len(k) + 1)}
+        prefixes.update(tknzr.key_(w) for w in ["不存在", "数据分析师", "涡轮增压器", "z"])
+        for p in prefixes:
+            assert hd.has_keys_with_prefix(p) == tknzr.trie_.has_keys_with_prefix(p), p
+
+    def test_invalid_file(self, tmp_path):
+        """Test that files which are not a compiled dict are rejected"""
+        fnm = tmp_path / "bad.dict"
+        fnm.write_bytes(b"not a huqie dict" * 4)
+        with pytest.raises(ValueError):
+            HuqieDict(str(fnm))
+
+        HuqieDict.build([("abc", (1, "n")), ("abd", 1)], str(fnm))
+        assert dict(HuqieDict(str(fnm)).items()) == {"abc": (1, "n"), "abd": 1}
+        data = fnm.read_bytes()
+        fnm.write_bytes(data[: len(data) - 8])
+        with pytest.raises(ValueError):
+            HuqieDict(str(fnm))
+
+
+class TestTokenizerBackends:
+
+    @pytest.mark.parametrize("line", LINES)
+    def test_same_tokens(self, tokenizers, line):
+        """Test that both backends tokenize exactly alike"""
+        trie_tknzr, dict_tknzr = tokenizers
+        tks = trie_tknzr.tokenize(line)
+        assert dict_tknzr.tokenize(line) == tks
+        assert dict_tknzr.fine_grained_tokenize(tks) == trie_tknzr.fine_grained_tokenize(tks)
+
+    def test_same_freq_and_tag(self, tokenizers):
+        """Test word frequency and tag lookups of both backends"""
+        trie_tknzr, dict_tknzr = tokenizers
+        for w in [w for w, _, _ in WORDS] + ["不存在"]:
+            assert dict_tknzr.freq(w) == trie_tknzr.freq(w)
+            assert dict_tknzr.tag(w) == trie_tknzr.tag(w)
@@ -0,0 +1,93 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import copy
+import json
+
+import numpy as np
+import pytest
+
+from rag.utils import doc_store_conn
+from rag.utils.doc_store_conn import bulk_index_body
+
+
+def parse_body(body):
+    assert isinstance(body, bytes)
+    assert body.endswith(b"\n")
+    return [json.loads(line.decode("utf-8", "surrogatepass")) for line in body.split(b"\n")[:-1]]
+
+
+@pytest.fixture(params=["orjson", "json"])
+def encoder(request, monkeypatch):
+    """Run every test with orjson, when installed, and with the stdlib fallback."""
+    if request.param == "orjson":
+        if doc_store_conn.orjson is None:
+            pytest.skip("orjson is not installed")
+    else:
+        monkeypatch.setattr(doc_store_conn, "orjson", None)
+    return request.param
+
+
+class TestBulkIndexBody:
+
+    def test_actions_and_sources(self, encoder):
+        """Test that every document becomes an index action followed by its source"""
+        docs = [{"id": "1", "content_with_weight": "hello", "page_num_int": [1, 2]},
+                {"id": "2", "content_with_weight": "你好", "available_int": 1}]
+        lines = parse_body(bulk_index_body(docs, "ragflow_t", kb_id="kb"))
+        assert lines == [
+            {"index": {"_index": "ragflow_t", "_id": "1"}},
+            {"content_with_weight": "hello", "page_num_int": [1, 2], "kb_id": "kb"},
+            {"index": {"_index": "ragflow_t", "_id": "2"}},
+            {"content_with_weight": "你好", "available_int": 1, "kb_id": "kb"},
+        ]
+
+    def test_numpy_vectors(self, encoder):
+        """Test that float32 vectors and numpy scalars are written as JSON numbers"""
+        vec = np.random.default_rng(0).standard_normal(16).astype(np.float32)
+        docs = [{"id": "1", "q_16_vec": vec, "rank_int": np.int64(3), "weight_flt": np.float32(0.5)}]
+        _, source = parse_body(bulk_index_body(docs, "idx"))
+        assert np.array_equal(np.asarray(source["q_16_vec"], dtype=np.float32), vec)
+        assert source["rank_int"] == 3
+        assert source["weight_flt"] == 0.5
+
+    def test_lone_surrogates(self, encoder):
+        """Test that text with lone surrogates, e.g. from broken PDF extraction, is still encoded"""
+        docs = [{"id": "1", "content_with_weight": "a\ud83db", "q_2_vec": np.ones(2, dtype=np.float32)}]
+        _, source = parse_body(bulk_index_body(docs, "idx"))
+        assert source["content_with_weight"] == "a\ud83db"
+        assert source["q_2_vec"] == [1.0, 1.0]
+
+    def test_documents_are_not_modified(self, encoder):
+        """Test that the documents are neither copied into nor changed by the body"""
+        vec = np.ones(4, dtype=np.float32)
+        docs = [{"id": "1", "content_with_weight": "x", "q_4_vec": vec}]
+        expected = copy.deepcopy(docs)
+        bulk_index_body(docs, "idx", kb_id="kb")
+        assert docs[0].keys() == expected[0].keys()
+        assert docs[0]["q_4_vec"] is vec
+        assert np.array_equal(docs[0]["q_4_vec"], expected[0]["q_4_vec"])
+
+    def test_document_without_id(self, encoder):
+        """Test that documents must carry an id and no _id"""
+        with pytest.raises(AssertionError):
+            bulk_index_body([{"content_with_weight": "x"}], "idx")
+        with pytest.raises(AssertionError):
+            bulk_index_body([{"id": "1", "_id": "1"}], "idx")
+
+    def test_empty(self, encoder):
+        """Test the body of no documents"""
+        assert bulk_index_body([], "idx") == b""
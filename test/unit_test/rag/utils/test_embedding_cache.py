@@ -0,0 +1,134 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import numpy as np
+import pytest
+
+from rag.utils import embedding_cache
+from rag.utils.embedding_cache import EmbeddingCache
+
+
+class FakeRedis:
+    """Stores what the shared connection would: text values, as it decodes responses."""
+
+    def __init__(self):
+        self.store = {}
+
+    def mset(self, mapping, expire):
+        self.store.update(mapping)
+
+    def mget(self, keys):
+        return [self.store.get(k) for k in keys]
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(embedding_cache, "REDIS_CONN", fake)
+    monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_ENABLED", 1)
+    return fake
+
+
+class TestSerialization:
+
+    def test_float32_round_trip(self):
+        """Test that vectors come back bit for bit as float32"""
+        vec = np.random.default_rng(0).standard_normal(1024).astype(np.float32)
+        s = EmbeddingCache._dumps(vec)
+        assert isinstance(s, str)
+        res = EmbeddingCache._loads(s)
+        assert res.dtype == np.float32
+        assert np.array_equal(res, vec)
+
+    def test_float64_and_list_input(self):
+        """Test that float64 arrays and lists are stored as float32"""
+        vec = [0.1, -2.5, 3.0]
+        res = EmbeddingCache._loads(EmbeddingCache._dumps(vec))
+        assert np.array_equal(res, np.asarray(vec, dtype=np.float32))
+        res = EmbeddingCache._loads(EmbeddingCache._dumps(np.asarray(vec, dtype=np.float64)))
+        assert np.array_equal(res, np.asarray(vec, dtype=np.float32))
+
+
+class TestKey:
+
+    def test_key_depends_on_namespace_dim_and_text(self):
+        """Test that the namespace, the dimension and the text all change the key"""
+        cache = EmbeddingCache()
+        k = cache.key("OpenAI\x00https://a\x00m", 3, "hello")
+        assert k.startswith("embd_cache:")
+        assert k == cache.key("OpenAI\x00https://a\x00m", 3, "hello")
+        assert k != cache.key("OpenAI\x00https://b\x00m", 3, "hello")
+        assert k != cache.key("OpenAI\x00https://a\x00m", 4, "hello")
+        assert k != cache.key("OpenAI\x00https://a\x00m", 3, "hello!")
+
+    def test_key_of_lone_surrogate(self):
+        """Test that text with a lone surrogate can be keyed"""
+        cache = EmbeddingCache()
+        assert cache.key("ns", 3, "a\ud800b") != cache.key("ns", 3, "ab")
+
+
+class TestGetSetMany:
+
+    def test_round_trip_through_redis(self, redis):
+        """Test that a fresh process reads the vectors another one has written"""
+        vecs = np.random.default_rng(1).standard_normal((2, 8)).astype(np.float32)
+        EmbeddingCache().set_many("ns", ["a", "b"], vecs)
+
+        res = EmbeddingCache().get_many("ns", 8, ["a", "b", "c"])
+        assert np.array_equal(res[0], vecs[0])
+        assert np.array_equal(res[1], vecs[1])
+        assert res[2] is None
+        assert all(r.dtype == np.float32 for r in res[:2])
+
+    def test_served_from_lru(self, redis):
+        """Test that hits are served from the LRU without Redis"""
+        cache = EmbeddingCache()
+        cache.set_many("ns", ["a"], [np.ones(4)])
+        redis.store.clear()
+        assert np.array_equal(cache.get_many("ns", 4, ["a"])[0], np.ones(4, dtype=np.float32))
+
+    def test_lru_capacity(self, redis):
+        """Test that the LRU keeps at most `capacity` vectors"""
+        cache = EmbeddingCache(capacity=2)
+        cache.set_many("ns", ["a", "b", "c"], np.eye(3))
+        assert len(cache._lru) == 2
+
+    def test_other_namespace_or_dim_misses(self, redis):
+        """Test that vectors are not shared between deployments or dimensions"""
+        EmbeddingCache().set_many("ns", ["a"], [np.ones(4)])
+        assert EmbeddingCache().get_many("other", 4, ["a"]) == [None]
+        assert EmbeddingCache().get_many("ns", 8, ["a"]) == [None]
+
+    def test_unknown_dim_misses(self, redis):
+        """Test that nothing is read while the dimension is unknown"""
+        EmbeddingCache().set_many("ns", ["a"], [np.ones(4)])
+        assert EmbeddingCache().get_many("ns", None, ["a"]) == [None]
+
+    def test_corrupted_entries_are_dropped(self, redis):
+        """Test that undecodable entries and entries of the wrong length are misses"""
+        cache = EmbeddingCache()
+        redis.store[cache.key("ns", 4, "a")] = "not base64!"
+        redis.store[cache.key("ns", 4, "b")] = EmbeddingCache._dumps(np.ones(3))
+        assert cache.get_many("ns", 4, ["a", "b"]) == [None, None]
+        assert not cache._lru
+
+    def test_disabled(self, redis, monkeypatch):
+        """Test that nothing is read or written when the cache is disabled"""
+        monkeypatch.setattr(embedding_cache, "EMBEDDING_CACHE_ENABLED", 0)
+        cache = EmbeddingCache()
+        cache.set_many("ns", ["a"], [np.ones(4)])
+        assert not redis.store
+        assert cache.get_many("ns", 4, ["a"]) == [None]
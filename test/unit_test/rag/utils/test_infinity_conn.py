@@ -0,0 +1,91 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from common.constants import PAGERANK_FLD
+from rag.utils.infinity_conn import merge_scored_dataframes
+
+FIELDS = ["id", "SCORE", PAGERANK_FLD]
+
+
+def make_tables(sizes, seed=0):
+    """Per-table results with distinct scores, in no particular order, as Infinity returns them."""
+    rng = np.random.default_rng(seed)
+    # distinct integer scores plus a pagerank below 1 keep every _score distinct
+    scores = rng.permutation(sum(sizes)).astype(float)
+    tables, start = [], 0
+    for t, n in enumerate(sizes):
+        tables.append(pd.DataFrame({
+            "id": [f"{t}-{i}" for i in range(n)],
+            "SCORE": scores[start: start + n],
+            PAGERANK_FLD: rng.integers(0, 3, n) / 4,
+        }))
+        start += n
+    return tables
+
+
+def expected_page(tables, offset, limit):
+    """What sorting the concatenation of every table would return."""
+    df = pd.concat([t.copy() for t in tables], axis=0).reset_index(drop=True)
+    df["_score"] = df["SCORE"] + df[PAGERANK_FLD]
+    df = df.sort_values(by="_score", ascending=False, kind="stable")
+    return df.iloc[offset: offset + limit].reset_index(drop=True)
+
+
+class TestMergeScoredDataframes:
+
+    @pytest.mark.parametrize("sizes", [[5], [3, 4], [10, 0, 7, 1], [20, 20, 20]])
+    @pytest.mark.parametrize("offset,limit", [(0, 5), (0, 100), (3, 4), (10, 10), (59, 10), (100, 5)])
+    def test_pages_match_global_sort(self, sizes, offset, limit):
+        """Test that every page equals the same page of the globally sorted rows"""
+        tables = make_tables(sizes)
+        expected = expected_page(tables, offset, limit)
+        res = merge_scored_dataframes([t.copy() for t in tables], FIELDS, "SCORE", offset, limit)
+        assert res["id"].tolist() == expected["id"].tolist()
+        assert res["_score"].tolist() == expected["_score"].tolist()
+        assert list(res.columns) == FIELDS + ["_score"]
+
+    def test_pages_cover_all_rows(self):
+        """Test that consecutive pages return every row exactly once, in score order"""
+        tables = make_tables([7, 11, 5], seed=1)
+        ids, scores = [], []
+        for offset in range(0, 30, 4):
+            page = merge_scored_dataframes([t.copy() for t in tables], FIELDS, "SCORE", offset, 4)
+            ids.extend(page["id"].tolist())
+            scores.extend(page["_score"].tolist())
+        assert sorted(ids) == sorted(i for t in tables for i in t["id"])
+        assert scores == sorted(scores, reverse=True)
+
+    def test_ties(self):
+        """Test that tied scores are all returned"""
+        tables = [pd.DataFrame({"id": ["a", "b"], "SCORE": [1.0, 1.0], PAGERANK_FLD: [0.0, 0.0]}),
+                  pd.DataFrame({"id": ["c"], "SCORE": [1.0], PAGERANK_FLD: [0.0]})]
+        res = merge_scored_dataframes(tables, FIELDS, "SCORE", 0, 10)
+        assert sorted(res["id"]) == ["a", "b", "c"]
+        assert res["_score"].tolist() == [1.0, 1.0, 1.0]
+
+    def test_no_rows(self):
+        """Test that empty tables give an empty page with the selected columns and _score"""
+        empty = pd.DataFrame(columns=FIELDS)
+        res = merge_scored_dataframes([empty, empty.copy()], FIELDS, "SCORE", 0, 10)
+        assert res.empty
+        assert "_score" in res.columns
+        res = merge_scored_dataframes([], ["id", "score()", PAGERANK_FLD], "SCORE", 0, 10)
+        assert res.empty
+        assert list(res.columns) == FIELDS + ["_score"]